@@ -3,6 +3,7 @@ package controllers
 import (
 	"log"
 	"net/http"
+	"strconv"
 
 	"core/internal/feedback"
 	"core/internal/models"
@@ -96,10 +97,34 @@ func PrivateRoutes(r *mux.Router, queueClient *asynq.Client) *mux.Router {
 		RespondWithJSON(w, http.StatusOK, author)
 	}).Methods("GET")
 
+	// Registered before /training/{user_id}, which would match it otherwise
+	r.HandleFunc("/training/changes", func(w http.ResponseWriter, r *http.Request) {
+		since, err := strconv.ParseFloat(r.URL.Query().Get("since"), 64)
+		if err != nil {
+			RespondWithError(w, http.StatusBadRequest, "Invalid since parameter")
+			return
+		}
+		changes, err := feedback.GetTrainingChanges(since)
+		if err != nil {
+			RespondWithError(w, 500, err.Error())
+			return
+		}
+		RespondWithJSON(w, http.StatusOK, changes)
+	}).Methods("GET")
+
 	r.HandleFunc("/training/{user_id}", func(w http.ResponseWriter, r *http.Request) {
 		vars := mux.Vars(r)
 		userId := vars["user_id"]
-		data, err := feedback.GetTFTrainingData(userId)
+		var since float64
+		if sinceParam := r.URL.Query().Get("since"); sinceParam != "" {
+			parsedSince, err := strconv.ParseFloat(sinceParam, 64)
+			if err != nil {
+				RespondWithError(w, http.StatusBadRequest, "Invalid since parameter")
+				return
+			}
+			since = parsedSince
+		}
+		data, err := feedback.GetTFTrainingData(userId, since)
 		if err != nil {
 			RespondWithError(w, 500, err.Error())
 			return
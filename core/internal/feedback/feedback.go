@@ -86,7 +86,7 @@ func ConvertFeedbackTypeToRelevancyRate(feedbackType FeedbackType) float32 {
 	}
 }
 
-func GetTFTrainingData(userId string) ([]models.RankingData, error) {
+func GetTFTrainingData(userId string, since float64) ([]models.RankingData, error) {
 	dataEntryList := make([]models.RankingData, 0)
 	feedbackList, err := GetFeedbackList(userId)
 	if err != nil {
@@ -112,6 +112,12 @@ func GetTFTrainingData(userId string) ([]models.RankingData, error) {
 		}
 	}
 	for storyId, relevancyRate := range relevancyDict {
+		timeStamp := float64(timeDict[storyId].Unix())
+		// The time stamps are truncated to the second, so the stories of the
+		// second of the watermark are returned again
+		if since > 0 && timeStamp < since {
+			continue
+		}
 		currentStory, err := story.GetStoryById(storyId)
 		if err != nil ||
 			currentStory.Author == nil ||
@@ -136,7 +142,6 @@ func GetTFTrainingData(userId string) ([]models.RankingData, error) {
 				mostFrequentEntity = entity
 			}
 		}
-		timeStamp := float64(timeDict[storyId].Unix())
 		rankingData := models.RankingData{
 			StoryId:             storyId,
 			UserId:              &userId,
@@ -162,6 +167,21 @@ func GetTFTrainingData(userId string) ([]models.RankingData, error) {
 	return dataEntryList, nil
 }
 
+// GetTrainingChanges returns the users who gave feedback since a unix time,
+// and the current feedback counts of the stories they gave it to, so that the
+// ml service only fetches the training data of those users and refreshes the
+// counts of its cached entries in one request.
+func GetTrainingChanges(since float64) (models.TrainingChanges, error) {
+	mongoFilter := bson.M{"feedback_datetime": bson.M{"$gte": time.Unix(int64(since), 0)}}
+	userIds := dbs.GetDistinctValues(userFeedbackCollection, mongoFilter, "user_id")
+	storyIds := dbs.GetDistinctValues(userFeedbackCollection, mongoFilter, "story_id")
+	storyCounts, err := story.GetStoryCounts(storyIds)
+	if err != nil {
+		return models.TrainingChanges{}, err
+	}
+	return models.TrainingChanges{UserIds: userIds, Stories: storyCounts}, nil
+}
+
 func FeedbackReceived(userFeedback UserFeedback) error {
 	readStory := user.ReadStory{
 		UserId:   userFeedback.UserId,
@@ -417,6 +417,40 @@ func GetRecommendedStories(userId string, language string) ([]*models.ShortStory
 	return BuildShortStoriesFromDB(stories), nil
 }
 
+func GetStoryCounts(storyIds []string) ([]models.StoryCounts, error) {
+	storyCounts := make([]models.StoryCounts, 0)
+	ids := make([]uuid.UUID, 0, len(storyIds))
+	for _, storyId := range storyIds {
+		id, err := uuid.Parse(storyId)
+		if err != nil {
+			continue
+		}
+		ids = append(ids, id)
+	}
+	if len(ids) == 0 {
+		return storyCounts, nil
+	}
+	mongoFilter := bson.M{"story_id": bson.M{"$in": ids}}
+	var storiesInDb []models.StoryInDb
+	err := dbs.GetMany(storyCollection, mongoFilter, &storiesInDb)
+	if err != nil {
+		return storyCounts, utils.LogError(err)
+	}
+	for _, storyInDb := range storiesInDb {
+		storyCounts = append(storyCounts, models.StoryCounts{
+			StoryId:      storyInDb.StoryId.String(),
+			ReadCount:    storyInDb.ReadCount,
+			SharedCount:  storyInDb.SharedCount,
+			AngryCount:   storyInDb.AngryCount,
+			CryCount:     storyInDb.CryCount,
+			NeutralCount: storyInDb.NeutralCount,
+			SmileCount:   storyInDb.SmileCount,
+			HappyCount:   storyInDb.HappyCount,
+		})
+	}
+	return storyCounts, nil
+}
+
 func UpdateTFIndex(language string) ([]models.RankingData, error) {
 	mongoFilter := bson.M{
 		"language": language,
@@ -451,8 +485,14 @@ func UpdateTFIndex(language string) ([]models.RankingData, error) {
 			}
 		}
 		authorIdString := story.Author.AuthorId.String()
+		// The ml service filters the recommendations by publication time
+		publishedAt := 0.0
+		if story.PublishedAt != nil {
+			publishedAt = float64(story.PublishedAt.Unix())
+		}
 		rankingData = append(rankingData, models.RankingData{
 			StoryId:             story.StoryId.String(),
+			TimeStamp:           &publishedAt,
 			StoryTitle:          story.Title,
 			SourceAlexaRank:     story.Source.RankInAlexa,
 			ReadCount:           story.ReadCount,
@@ -0,0 +1,164 @@
+"""Measures the single user requests served with and without coalescing them
+into batched index queries, at several concurrency levels.
+
+Run from the ml directory with:
+    python -m benchmarks.coalescing --concurrency 1,4,16,64 --window-ms 1,5 \
+        --output coalescing_benchmark.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmarks import serving as serving_benchmark
+from services import coalescer
+from services import serving
+
+logger = logging.getLogger(__name__)
+
+
+def parse_list(value, cast):
+  return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def measure(backend, index, user_ids, k, concurrency, window_seconds,
+            max_batch_size):
+  """Sends the requests of the user ids from concurrent threads, the way
+  the FastAPI threadpool runs the endpoint.
+  """
+
+  request_coalescer = coalescer.RequestCoalescer(backend.query,
+                                                 window_seconds,
+                                                 max_batch_size)
+  latencies = [[] for _ in range(concurrency)]
+  barrier = threading.Barrier(concurrency + 1)
+
+  def client(thread):
+    barrier.wait()
+    for user_id in user_ids[thread::concurrency]:
+      start = time.perf_counter()
+      request_coalescer.submit(serving_benchmark.LANGUAGE, index, user_id, k)
+      latencies[thread].append(time.perf_counter() - start)
+
+  threads = [
+      threading.Thread(target=client, args=(thread,))
+      for thread in range(concurrency)
+  ]
+  for thread in threads:
+    thread.start()
+  barrier.wait()
+  start = time.perf_counter()
+  for thread in threads:
+    thread.join()
+  seconds = time.perf_counter() - start
+  result = serving_benchmark.percentiles(sum(latencies, []))
+  result["requests_per_second"] = len(user_ids) / seconds
+  if request_coalescer.batches:
+    result["mean_batch_size"] = (request_coalescer.requests /
+                                 request_coalescer.batches)
+  return result
+
+
+def crossover(results, window):
+  """Returns the lowest concurrency at which coalescing with the window
+  serves more requests per second than querying each request on its own.
+  """
+
+  for concurrency, result in sorted(results.items()):
+    if (result[window]["requests_per_second"] >
+        result["direct"]["requests_per_second"]):
+      return concurrency
+  return None
+
+
+def run(args):
+  directory = args.directory
+  if not directory:
+    directory = tempfile.mkdtemp()
+    serving_benchmark.prepare(args, directory)
+  rng = np.random.default_rng(args.seed)
+  user_ids = [
+      "user-" + str(user) for user in rng.integers(0, args.users, args.queries)
+  ]
+
+  results = {}
+  for backend_name in args.backends:
+    logger.info("Benchmarking the " + backend_name + " backend")
+    backend = serving.get_backend(backend_name)
+    index = serving_benchmark.load_backend_index(backend_name, directory)
+    # Warms the index up before measuring
+    backend.query(index, user_ids[:args.max_batch_size], args.k)
+    backend_results = {}
+    for concurrency in args.concurrency:
+      backend_results[concurrency] = {
+          "direct":
+              measure(backend, index, user_ids, args.k, concurrency, 0,
+                      args.max_batch_size)
+      }
+      for window_ms in args.window_ms:
+        backend_results[concurrency][str(window_ms) + "ms"] = measure(
+            backend, index, user_ids, args.k, concurrency, window_ms / 1000,
+            args.max_batch_size)
+      logger.info(
+          str(concurrency) + " concurrent requests: " +
+          json.dumps(backend_results[concurrency]))
+    results[backend_name] = {
+        "by_concurrency": backend_results,
+        "crossover_concurrency": {
+            str(window_ms) + "ms":
+                crossover(backend_results,
+                          str(window_ms) + "ms") for window_ms in args.window_ms
+        },
+    }
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--users", type=int, default=2000)
+  parser.add_argument("--stories", type=int, default=10000)
+  parser.add_argument("--interactions-per-user", type=float, default=20.0)
+  parser.add_argument("--epochs", type=int, default=1)
+  parser.add_argument("--queries", type=int, default=2000)
+  parser.add_argument("--k", type=int, default=20)
+  parser.add_argument("--seed", type=int, default=42)
+  parser.add_argument("--backends",
+                      type=lambda value: parse_list(value, str),
+                      default=[serving.SCANN_BACKEND, serving.NUMPY_BACKEND])
+  parser.add_argument("--concurrency",
+                      type=lambda value: parse_list(value, int),
+                      default=[1, 2, 4, 8, 16, 32, 64])
+  parser.add_argument("--window-ms",
+                      type=lambda value: parse_list(value, float),
+                      default=[1.0, 5.0])
+  parser.add_argument("--max-batch-size", type=int, default=64)
+  parser.add_argument("--directory",
+                      help="Directory of a model and indexes prepared by "
+                      "benchmarks.serving, by default a new temporary one")
+  parser.add_argument("--output", default="coalescing_benchmark.json")
+  args = parser.parse_args()
+
+  from benchmarks import training as training_benchmark
+  report = {
+      "benchmark": "coalescing",
+      "commit": training_benchmark.git_commit(),
+      "created_at": time.time(),
+      "host": platform.node(),
+      "cpu_count": os.cpu_count(),
+      "parameters": vars(args),
+      "results": run(args),
+  }
+  with open(args.output, "w") as output_file:
+    json.dump(report, output_file, indent=2)
+  logger.info("Results written to " + args.output)
+
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  main()
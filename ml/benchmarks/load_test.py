@@ -0,0 +1,310 @@
+"""Load tests the recommendation endpoint of the ml service, run with the
+gunicorn configuration of the image against a local stand-in of the core
+service and a synthetic model.
+
+Run from the ml directory with:
+    python -m benchmarks.load_test --concurrency 1,8,32 --duration 30 \
+        --output load_test_benchmark.json
+"""
+import argparse
+import http.server
+import json
+import logging
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+from benchmarks import serving as serving_benchmark
+from services import serving
+from services import synthetic
+
+logger = logging.getLogger(__name__)
+
+ML_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GUNICORN_CONFIG = os.path.join(ML_DIRECTORY, "gunicorn.conf.py")
+UNIFORM = "uniform"
+ZIPF = "zipf"
+
+
+def free_port():
+  with socket.socket() as free_socket:
+    free_socket.bind(("127.0.0.1", 0))
+    return free_socket.getsockname()[1]
+
+
+def start_core_stub(recent_stories):
+  """Serves the recent stories on /update-index/{language}, like the core
+  service does for the index builds.
+  """
+
+  body = json.dumps(recent_stories).encode("utf-8")
+
+  class Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+      if not self.path.startswith("/update-index/"):
+        self.send_error(404)
+        return
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, *args):
+      pass
+
+  server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+
+def prepare_model(args, directory):
+  """Trains a synthetic model once, and saves it where the service loads
+  it from.
+  """
+
+  from services import ranking
+
+  model_directory = os.path.join(directory, ranking.RANKING_MODEL_DIR)
+  if os.path.isdir(model_directory):
+    return
+  os.environ["TRAINING_EPOCHS"] = str(args.epochs)
+  columns = synthetic.generate_ranking_data(
+      args.users,
+      args.stories,
+      interactions_per_user=args.interactions_per_user,
+      seed=args.seed)
+  model, _ = ranking.fit_ranking_model(synthetic.to_entries(columns))
+  ranking.save_model_artifact(model, model_directory)
+
+
+def recent_stories(args):
+  stories = synthetic.generate_stories(args.stories, seed=args.seed)
+  return [
+      dict(zip(stories, values))
+      for values in zip(*[column.tolist() for column in stories.values()])
+  ]
+
+
+def start_service(args, directory, port, core_url):
+  environment = dict(os.environ,
+                     PYTHONPATH=ML_DIRECTORY,
+                     PORT=str(port),
+                     GUNICORN_WORKERS=str(args.workers),
+                     CORE_URL=core_url,
+                     RANKING_MODEL_REGISTRY="local",
+                     SERVING_BACKEND=args.backend)
+  for variable in args.env:
+    name, _, value = variable.partition("=")
+    environment[name] = value
+  return subprocess.Popen([
+      sys.executable, "-m", "gunicorn", "-c", GUNICORN_CONFIG, "controller:app"
+  ],
+                          cwd=directory,
+                          env=environment)
+
+
+def wait_until_ready(service, base_url, workers, timeout):
+  """Waits for the indexes of every language to be served, by as many
+  consecutive requests as there are workers, as each worker builds its own.
+  """
+
+  deadline = time.monotonic() + timeout
+  ready = 0
+  while ready < workers * 3:
+    if service.poll() is not None:
+      raise RuntimeError("The service exited with " + str(service.returncode))
+    if time.monotonic() > deadline:
+      raise TimeoutError("The service was not ready after " + str(timeout) +
+                         "s")
+    try:
+      statuses = requests.get(base_url + "/admin/indexes", timeout=5).json()
+      if all(status["built_at"] for status in statuses.values()):
+        ready += 1
+        continue
+    except (requests.RequestException, ValueError):
+      pass
+    ready = 0
+    time.sleep(0.5)
+
+
+def user_ids(args, rng, count):
+  if args.distribution == ZIPF:
+    users = rng.choice(args.users,
+                       count,
+                       p=synthetic.long_tail_weights(args.users,
+                                                     args.zipf_exponent))
+  else:
+    users = rng.integers(0, args.users, count)
+  ids = np.array(["user-" + str(user) for user in users], dtype=object)
+  # Users the model never saw, served the popular stories
+  unknown = rng.random(count) < args.unknown_fraction
+  ids[unknown] = [
+      "new-user-" + str(user) for user in rng.integers(0, 2**31, unknown.sum())
+  ]
+  return ids.tolist()
+
+
+def run_level(args, base_url, concurrency, seconds, rng):
+  """Sends requests from concurrent clients, each waiting for its response
+  before sending the next one.
+  """
+
+  latencies = [[] for _ in range(concurrency)]
+  errors = [0] * concurrency
+  stop = threading.Event()
+  barrier = threading.Barrier(concurrency + 1)
+  clients_user_ids = [
+      user_ids(args, np.random.default_rng(rng.integers(2**32)), 100_000)
+      for _ in range(concurrency)
+  ]
+
+  def client(thread):
+    session = requests.Session()
+    barrier.wait()
+    for request, user_id in enumerate(clients_user_ids[thread]):
+      if stop.is_set():
+        break
+      language = args.languages[request % len(args.languages)]
+      start = time.perf_counter()
+      try:
+        response = session.get(base_url + "/recommendations/" + user_id + "/" +
+                               language,
+                               timeout=30)
+        response.raise_for_status()
+      except requests.RequestException:
+        errors[thread] += 1
+        continue
+      latencies[thread].append(time.perf_counter() - start)
+
+  threads = [
+      threading.Thread(target=client, args=(thread,))
+      for thread in range(concurrency)
+  ]
+  for thread in threads:
+    thread.start()
+  barrier.wait()
+  start = time.perf_counter()
+  stop.wait(seconds)
+  stop.set()
+  for thread in threads:
+    thread.join()
+  elapsed = time.perf_counter() - start
+  all_latencies = sum(latencies, [])
+  result = {
+      "concurrency": concurrency,
+      "requests": len(all_latencies),
+      "errors": sum(errors),
+      "requests_per_second": len(all_latencies) / elapsed,
+  }
+  if all_latencies:
+    result.update(serving_benchmark.percentiles(all_latencies))
+  return result
+
+
+def run(args):
+  directory = args.directory or tempfile.mkdtemp()
+  prepare_model(args, directory)
+  core = start_core_stub(recent_stories(args))
+  port = free_port()
+  base_url = "http://127.0.0.1:" + str(port)
+  service = start_service(args, directory, port,
+                          "http://127.0.0.1:" + str(core.server_port))
+  try:
+    start = time.perf_counter()
+    wait_until_ready(service, base_url, args.workers, args.startup_timeout)
+    startup_seconds = time.perf_counter() - start
+    logger.info("The service was ready in " + format(startup_seconds, ".1f") +
+                "s")
+    rng = np.random.default_rng(args.seed)
+    if args.warmup:
+      run_level(args, base_url, max(args.concurrency), args.warmup, rng)
+    levels = []
+    for concurrency in args.concurrency:
+      levels.append(run_level(args, base_url, concurrency, args.duration, rng))
+      logger.info(json.dumps(levels[-1]))
+    workers_memory = requests.get(base_url + "/admin/memory", timeout=5).json()
+  finally:
+    service.send_signal(signal.SIGTERM)
+    service.wait(timeout=60)
+    core.shutdown()
+  return {
+      "startup_seconds": startup_seconds,
+      "levels": levels,
+      "max_requests_per_second": max(
+          level["requests_per_second"] for level in levels),
+      "workers_memory": workers_memory,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--users", type=int, default=2000)
+  parser.add_argument("--stories", type=int, default=10000)
+  parser.add_argument("--interactions-per-user", type=float, default=20.0)
+  parser.add_argument("--epochs", type=int, default=1)
+  parser.add_argument("--seed", type=int, default=42)
+  parser.add_argument("--backend",
+                      choices=(serving.SCANN_BACKEND, serving.NUMPY_BACKEND),
+                      default=serving.SCANN_BACKEND)
+  parser.add_argument("--workers", type=int, default=2)
+  parser.add_argument("--concurrency",
+                      type=lambda value: [int(level) for level in value.split(",")],
+                      default=[1, 8, 32])
+  parser.add_argument("--duration",
+                      type=float,
+                      default=30.0,
+                      help="Seconds of load at each concurrency level")
+  parser.add_argument("--warmup", type=float, default=5.0)
+  parser.add_argument("--distribution",
+                      choices=(UNIFORM, ZIPF),
+                      default=ZIPF,
+                      help="How the requests are spread between the users")
+  parser.add_argument("--zipf-exponent", type=float, default=1.0)
+  parser.add_argument("--unknown-fraction",
+                      type=float,
+                      default=0.0,
+                      help="Share of the requests from unknown users")
+  parser.add_argument("--languages",
+                      type=lambda value: value.split(","),
+                      default=list(serving.LANGUAGES))
+  parser.add_argument("--env",
+                      action="append",
+                      default=[],
+                      help="NAME=VALUE environment variable of the service, "
+                      "for instance RECOMMENDATIONS_CACHE_SIZE=0")
+  parser.add_argument("--startup-timeout", type=float, default=600.0)
+  parser.add_argument("--directory",
+                      help="Working directory of the service, where the "
+                      "model is trained once, by default a temporary one")
+  parser.add_argument("--output", default="load_test_benchmark.json")
+  args = parser.parse_args()
+
+  from benchmarks import training as training_benchmark
+  report = {
+      "benchmark": "load_test",
+      "commit": training_benchmark.git_commit(),
+      "created_at": time.time(),
+      "host": platform.node(),
+      "cpu_count": os.cpu_count(),
+      "parameters": vars(args),
+      "results": run(args),
+  }
+  with open(args.output, "w") as output_file:
+    json.dump(report, output_file, indent=2)
+  logger.info("Results written to " + args.output)
+
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  main()
@@ -0,0 +1,212 @@
+"""Compares the ScaNN and the NumPy serving backends on a synthetic model.
+
+Run from the ml directory with:
+    python -m benchmarks.serving --users 2000 --stories 10000 \
+        --output serving_benchmark.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from services import memory
+from services import numpy_index
+from services import serving
+from services import synthetic
+
+logger = logging.getLogger(__name__)
+
+LANGUAGE = "en"
+
+
+def percentiles(seconds):
+  milliseconds = np.array(seconds) * 1000
+  return {
+      "p50_ms": float(np.percentile(milliseconds, 50)),
+      "p90_ms": float(np.percentile(milliseconds, 90)),
+      "p99_ms": float(np.percentile(milliseconds, 99)),
+  }
+
+
+def load_backend_index(backend_name, directory):
+  if backend_name == serving.SCANN_BACKEND:
+    from services import ranking
+    return ranking.load_index(LANGUAGE,
+                              directory=os.path.join(directory, "indexes"))
+  return numpy_index.load_index(LANGUAGE,
+                                directory=os.path.join(directory, "embeddings"))
+
+
+def measure_process(backend_name, directory, k):
+  """Measures the cold start of a backend in the current process."""
+
+  start = time.perf_counter()
+  backend = serving.get_backend(backend_name)
+  index = load_backend_index(backend_name, directory)
+  load_seconds = time.perf_counter() - start
+  start = time.perf_counter()
+  backend.query(index, ["user-1"], k)
+  return {
+      "load_seconds": load_seconds,
+      "first_query_seconds": time.perf_counter() - start,
+      "rss_bytes": memory.process_memory().rss_bytes,
+      "tensorflow_imported": "tensorflow" in sys.modules,
+  }
+
+
+def cold_start(backend_name, directory, k):
+  # A new interpreter includes the imports in the measure
+  start = time.perf_counter()
+  output = subprocess.check_output([
+      sys.executable, "-m", "benchmarks.serving", "--process", backend_name,
+      "--directory", directory, "--k",
+      str(k)
+  ],
+                                   text=True)
+  result = json.loads(output.strip().splitlines()[-1])
+  result["process_seconds"] = time.perf_counter() - start
+  return result
+
+
+def measure_queries(backend, index, user_ids, k, batch_size):
+  single = []
+  for user_id in user_ids:
+    start = time.perf_counter()
+    backend.query(index, [user_id], k)
+    single.append(time.perf_counter() - start)
+  start = time.perf_counter()
+  for offset in range(0, len(user_ids), batch_size):
+    backend.query(index, user_ids[offset:offset + batch_size], k)
+  batch_seconds = time.perf_counter() - start
+  return {
+      "single_user": percentiles(single),
+      "single_user_qps": len(single) / sum(single),
+      "batch_users_per_second": len(user_ids) / batch_seconds,
+  }
+
+
+def recall(results, exact_results, k):
+  found = [
+      len(set(result[:k]) & set(exact[:k])) / k
+      for result, exact in zip(results, exact_results)
+  ]
+  return float(np.mean(found))
+
+
+def prepare(args, directory):
+  """Trains a synthetic model, then saves its ScaNN index and its NumPy
+  export in the directory.
+
+    Returns:
+        The build time of the ScaNN index and of the NumPy export.
+
+  """
+
+  from services import ranking
+
+  os.environ["TRAINING_EPOCHS"] = str(args.epochs)
+  columns = synthetic.generate_ranking_data(
+      args.users,
+      args.stories,
+      interactions_per_user=args.interactions_per_user,
+      seed=args.seed)
+  model, _ = ranking.fit_ranking_model(synthetic.to_entries(columns))
+  model_directory = os.path.join(directory, "ranking_model")
+  ranking.save_model_artifact(model, model_directory)
+  model = ranking.load_model_artifact(model_directory)
+
+  stories = [{
+      "story_id": story_id
+  } for story_id in synthetic.generate_stories(args.stories, seed=args.seed)
+             ["story_id"].tolist()]
+  start = time.perf_counter()
+  index = ranking.build_index(model, LANGUAGE, stories)
+  scann_build_seconds = time.perf_counter() - start
+  ranking.save_index(index, os.path.join(directory, "indexes"))
+  start = time.perf_counter()
+  ranking.export_embeddings(model,
+                            LANGUAGE,
+                            os.path.join(directory, "embeddings"),
+                            recent_stories=stories)
+  numpy_export_seconds = time.perf_counter() - start
+  return scann_build_seconds, numpy_export_seconds
+
+
+def run(args):
+  directory = args.directory or tempfile.mkdtemp()
+  scann_build_seconds, numpy_export_seconds = prepare(args, directory)
+
+  rng = np.random.default_rng(args.seed)
+  user_ids = [
+      "user-" + str(user) for user in rng.integers(0, args.users, args.queries)
+  ]
+  results = {}
+  answers = {}
+  for backend_name, build_seconds in ((serving.SCANN_BACKEND,
+                                       scann_build_seconds),
+                                      (serving.NUMPY_BACKEND,
+                                       numpy_export_seconds)):
+    logger.info("Benchmarking the " + backend_name + " backend")
+    backend = serving.get_backend(backend_name)
+    backend_index = load_backend_index(backend_name, directory)
+    results[backend_name] = {
+        "build_seconds": build_seconds,
+        "cold_start": cold_start(backend_name, directory, args.k),
+        "queries": measure_queries(backend, backend_index, user_ids, args.k,
+                                   args.batch_size),
+    }
+    answers[backend_name] = backend.query(backend_index, user_ids, args.k)
+  # The NumPy backend is exact
+  results[serving.SCANN_BACKEND]["recall_at_k"] = recall(
+      answers[serving.SCANN_BACKEND], answers[serving.NUMPY_BACKEND], args.k)
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--users", type=int, default=2000)
+  parser.add_argument("--stories", type=int, default=10000)
+  parser.add_argument("--interactions-per-user", type=float, default=20.0)
+  parser.add_argument("--epochs", type=int, default=1)
+  parser.add_argument("--queries", type=int, default=1000)
+  parser.add_argument("--batch-size", type=int, default=256)
+  parser.add_argument("--k", type=int, default=20)
+  parser.add_argument("--seed", type=int, default=42)
+  parser.add_argument("--directory",
+                      help="Directory of the model and indexes, by default "
+                      "a temporary one")
+  parser.add_argument("--process",
+                      choices=(serving.SCANN_BACKEND, serving.NUMPY_BACKEND),
+                      help=argparse.SUPPRESS)
+  parser.add_argument("--output", default="serving_benchmark.json")
+  args = parser.parse_args()
+
+  if args.process:
+    print(json.dumps(measure_process(args.process, args.directory, args.k)))
+    return
+
+  # The training benchmark imports TensorFlow, unlike the NumPy processes
+  from benchmarks import training as training_benchmark
+  report = {
+      "benchmark": "serving",
+      "commit": training_benchmark.git_commit(),
+      "created_at": time.time(),
+      "host": platform.node(),
+      "parameters": vars(args),
+      "results": run(args),
+  }
+  with open(args.output, "w") as output_file:
+    json.dump(report, output_file, indent=2)
+  logger.info("Results written to " + args.output)
+
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  main()
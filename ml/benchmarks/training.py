@@ -0,0 +1,145 @@
+"""Times each stage of the ranking model training on synthetic data.
+
+Run from the ml directory with:
+    python -m benchmarks.training --scales 200x1000,2000x10000 \
+        --output benchmark.json
+"""
+import argparse
+import json
+import logging
+import subprocess
+import tempfile
+import time
+import platform
+
+import pandas as pd
+import tensorflow as tf
+
+from services import ranking
+from services import synthetic
+from services import vocabulary
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCALES = "200x1000,2000x10000,20000x50000"
+
+
+def parse_scales(scales: str):
+  parsed = []
+  for scale in scales.split(","):
+    user_count, story_count = scale.lower().split("x")
+    parsed.append((int(user_count), int(story_count)))
+  return parsed
+
+
+def git_commit():
+  try:
+    return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                   stderr=subprocess.DEVNULL,
+                                   text=True).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def benchmark_scale(user_count, story_count, args):
+  columns = synthetic.generate_ranking_data(
+      user_count,
+      story_count,
+      interactions_per_user=args.interactions_per_user,
+      seed=args.seed)
+  entries = synthetic.to_entries(columns)
+  stages = {}
+
+  start = time.perf_counter()
+  data_frame = pd.DataFrame(entries)
+  stages["dataframe_build"] = time.perf_counter() - start
+  del entries
+
+  start = time.perf_counter()
+  vocabularies = vocabulary.build_vocabularies(
+      tf.data.Dataset.from_tensor_slices(dict(data_frame)).batch(
+          100_000).as_numpy_iterator())
+  stages["vocabulary_build"] = time.perf_counter() - start
+
+  # With its vocabularies built, the model construction still collects the
+  # retrieval candidates in a pass over the data
+  start = time.perf_counter()
+  model = ranking.NewsRankingModel(data_entries=data_frame,
+                                   vocabularies=vocabularies)
+  model.compile(optimizer=tf.keras.optimizers.Adagrad(learning_rate=0.1))
+  stages["model_construction"] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  train, test, train_size = ranking.split_dataset(model.dataset,
+                                                  args.shuffle_buffer)
+  train = ranking.build_input_pipeline(train,
+                                       args.batch_size,
+                                       shuffle_buffer=args.shuffle_buffer,
+                                       cache_file="")
+  test = ranking.build_input_pipeline(test,
+                                      args.eval_batch_size,
+                                      cache_file="")
+  stages["dataset_construction"] = time.perf_counter() - start
+
+  throughput = ranking.ThroughputCallback(train_size)
+  model.fit(train, epochs=args.epochs, callbacks=[throughput], verbose=0)
+  stages["fit_epochs"] = throughput.epoch_seconds
+
+  start = time.perf_counter()
+  model.index_candidates()
+  eval_dict = model.evaluate(test, return_dict=True, verbose=0)
+  stages["evaluate"] = time.perf_counter() - start
+
+  with tempfile.TemporaryDirectory() as directory:
+    start = time.perf_counter()
+    ranking.save_model_artifact(model, directory + "/ranking_model")
+    stages["save"] = time.perf_counter() - start
+
+  return {
+      "user_count": user_count,
+      "story_count": story_count,
+      "row_count": len(data_frame),
+      "stages": stages,
+      "examples_per_second": throughput.examples_per_second,
+      "root_mean_squared_error": eval_dict["root_mean_squared_error"],
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--scales",
+                      default=DEFAULT_SCALES,
+                      help="Comma separated USERSxSTORIES scales")
+  parser.add_argument("--interactions-per-user", type=float, default=20.0)
+  parser.add_argument("--epochs", type=int, default=3)
+  parser.add_argument("--batch-size", type=int, default=8192)
+  parser.add_argument("--eval-batch-size", type=int, default=4096)
+  parser.add_argument("--shuffle-buffer", type=int, default=100_000)
+  parser.add_argument("--seed", type=int, default=42)
+  parser.add_argument("--output", default="training_benchmark.json")
+  args = parser.parse_args()
+
+  results = []
+  for user_count, story_count in parse_scales(args.scales):
+    logger.info("Benchmarking " + str(user_count) + " users and " +
+                str(story_count) + " stories")
+    results.append(benchmark_scale(user_count, story_count, args))
+    logger.info(json.dumps(results[-1]["stages"]))
+
+  report = {
+      "benchmark": "training",
+      "commit": git_commit(),
+      "created_at": time.time(),
+      "host": platform.node(),
+      "tensorflow": tf.__version__,
+      "parameters": vars(args),
+      "results": results,
+  }
+  with open(args.output, "w") as output_file:
+    json.dump(report, output_file, indent=2)
+  logger.info("Results written to " + args.output)
+
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  main()
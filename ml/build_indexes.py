@@ -0,0 +1,38 @@
+import os
+import sys
+import logging
+from dotenv import load_dotenv
+from services import ranking
+from services import serving
+
+logger = logging.getLogger(__name__)
+
+
+def build_indexes(languages=ranking.LANGUAGES):
+  # The model is only loaded for the indexes that are missing or stale
+  model = ranking.open_ranking_model()
+  if not model:
+    logger.error("Failed to load model index.")
+    return False
+  max_age = float(
+      os.getenv("INDEX_MAX_AGE", os.getenv("INDEX_REFRESH_INTERVAL", "3600")))
+  backend = os.getenv("SERVING_BACKEND", serving.SCANN_BACKEND)
+  built = True
+  for language in languages:
+    try:
+      if backend == serving.NUMPY_BACKEND:
+        ranking.load_or_export_embeddings(model, language, max_age=max_age)
+      else:
+        ranking.load_or_build_index(model, language, max_age=max_age)
+    except ranking.IndexBuildError as error:
+      logger.error(str(error))
+      built = False
+  return built
+
+
+# Saves fresh indexes, or embedding exports, for the serving workers to load
+if __name__ == '__main__':
+  load_dotenv()
+  logging.basicConfig(level=logging.INFO)
+  if not build_indexes(sys.argv[1:] or ranking.LANGUAGES):
+    sys.exit(1)
@@ -1,39 +1,316 @@
-from fastapi import FastAPI, HTTPException
-import tensorflow as tf
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+import os
+import time
+import threading
+import logging
 from dotenv import load_dotenv
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from services import ranking
+from prometheus_client import Gauge, Histogram
+from services import coalescer
+from services import filtering
+from services import index_refresher
+from services import memory
+from services import metrics
+from services import pagination
+from services import result_cache
+from services import serving
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_AMOUNT_OF_STORIES = 20
+MAX_AMOUNT_OF_STORIES = int(os.getenv("RECOMMENDATIONS_MAX_K", "200"))
+MAX_BATCH_SIZE = int(os.getenv("RECOMMENDATIONS_MAX_BATCH_SIZE", "1000"))
+CACHE_SIZE = int(os.getenv("RECOMMENDATIONS_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("RECOMMENDATIONS_CACHE_TTL", "60"))
+INDEX_REFRESH_INTERVAL = float(os.getenv("INDEX_REFRESH_INTERVAL", "3600"))
+INDEX_BUILD_WORKERS = int(
+    os.getenv("INDEX_BUILD_WORKERS", str(len(serving.LANGUAGES))))
+INDEX_MAX_AGE = float(os.getenv("INDEX_MAX_AGE", str(INDEX_REFRESH_INTERVAL)))
+PAGINATION_DEPTH = int(
+    os.getenv("RECOMMENDATIONS_PAGINATION_DEPTH", str(MAX_AMOUNT_OF_STORIES)))
+PAGINATION_TTL = float(os.getenv("RECOMMENDATIONS_PAGINATION_TTL", "600"))
+PAGINATION_CACHE_SIZE = int(
+    os.getenv("RECOMMENDATIONS_PAGINATION_CACHE_SIZE", "10000"))
+SERVING_BACKEND = os.getenv("SERVING_BACKEND", serving.SCANN_BACKEND)
+COALESCING_WINDOW = float(os.getenv("RECOMMENDATIONS_COALESCING_WINDOW_MS",
+                                    "0")) / 1000
+COALESCING_MAX_BATCH_SIZE = int(
+    os.getenv("RECOMMENDATIONS_COALESCING_MAX_BATCH_SIZE", "64"))
+
 app = FastAPI()
 FastAPIInstrumentor.instrument_app(app)
 
+# The requests in flight of the live workers add up
+in_flight_requests = Gauge("http_requests_in_flight",
+                           "Amount of requests being handled",
+                           multiprocess_mode="livesum")
+request_seconds = Histogram(
+    "http_request_seconds",
+    "Latency of the requests, including their serialization", ("route",),
+    buckets=metrics.LATENCY_BUCKETS)
+
 indexes = {}
+cache = result_cache.ResultCache(CACHE_SIZE, CACHE_TTL)
+# The deep top-k of each session scrolling the recommendations, keyed by the
+# snapshot id in place of k so that the sessions of a user do not replace each
+# other. A snapshot is kept when an index is replaced so that its pages stay
+# consistent.
+snapshots = result_cache.ResultCache(PAGINATION_CACHE_SIZE, PAGINATION_TTL)
+backend = serving.MeteredBackend(
+    serving.get_backend(SERVING_BACKEND, max_age=INDEX_MAX_AGE))
+# Results of the previous index are not served anymore once it is replaced
+refresher = index_refresher.IndexRefresher(indexes,
+                                           serving.LANGUAGES,
+                                           backend.load_model,
+                                           backend.build_index,
+                                           interval_seconds=INDEX_REFRESH_INTERVAL,
+                                           on_swap=cache.invalidate,
+                                           build_workers=INDEX_BUILD_WORKERS)
+# Concurrent single user requests share one index query
+request_coalescer = coalescer.RequestCoalescer(backend.query, COALESCING_WINDOW,
+                                               COALESCING_MAX_BATCH_SIZE)
+
+
+class BatchRecommendationsRequest(BaseModel):
+  user_ids: List[str]
+  language: str
+  k: int = DEFAULT_AMOUNT_OF_STORIES
+  # Applied to the recommendations of every user of the batch
+  filter: Optional[filtering.StoryFilter] = None
+
+
+class BatchRecommendationsResponse(BaseModel):
+  recommendations: Dict[str, List[str]] = {}
+  errors: Dict[str, str] = {}
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+  in_flight_requests.inc()
+  start = time.perf_counter()
+  try:
+    return await call_next(request)
+  finally:
+    in_flight_requests.dec()
+    # The route template keeps the user ids out of the labels
+    route = request.scope.get("route")
+    request_seconds.labels(route=route.path if route else "unmatched").observe(
+        time.perf_counter() - start)
+
+
+def load_indexes():
+  refresher.refresh()
+  worker_memory = memory.process_memory()
+  logger.info("Worker " + str(worker_memory.pid) + " loaded its indexes with " +
+              format(worker_memory.rss_bytes / 2**20, ".0f") + " MiB RSS")
+
 
 @app.on_event("startup")
 def init_data():
-  ranking_indexes = ranking.get_indexes()
-  if ranking_indexes:
-    indexes.update({"en": ranking_indexes["en"]})
-    indexes.update({"fr": ranking_indexes["fr"]})
-    ranking_indexes.clear()
+  # Each language is served as soon as its index is ready, the requests of
+  # the others get a 404 meanwhile
+  threading.Thread(target=load_indexes, name="index-startup",
+                   daemon=True).start()
+  refresher.start()
   return indexes
 
+
+@app.on_event("shutdown")
+def stop_refresher():
+  refresher.stop()
+
+
+def get_index(language: str):
+  if language not in serving.LANGUAGES:
+    raise HTTPException(status_code=500, detail=language + " Language not found")
+  if language not in indexes:
+    raise HTTPException(status_code=404,
+                        detail=language + " Index not initialized")
+  return indexes[language]
+
+
+def query_index(index, user_ids: List[str], k: int) -> List[List[str]]:
+  return backend.query(index, user_ids, k)
+
+
+def get_popular_stories(index, user_ids: List[str],
+                        k: int) -> Dict[str, List[str]]:
+  """Returns the most engaging recent stories for each user unknown to the
+  model, whose recommendations would all come from its OOV embedding.
+  """
+
+  story_ids = serving.popular_stories(index, k)
+  if story_ids is None:
+    return {}
+  known_users = backend.known_users(index, user_ids)
+  return {
+      user_id: story_ids
+      for user_id, known in zip(user_ids, known_users)
+      if not known
+  }
+
+
+def validate_k(k: int, max_k: int = MAX_AMOUNT_OF_STORIES):
+  if not 1 <= k <= max_k:
+    raise HTTPException(status_code=400,
+                        detail="k must be between 1 and " + str(max_k))
+
+
+def recommend(index, user_id: str, language: str, k: int) -> List[str]:
+  # Unknown users are neither queried nor cached
+  popular_story_ids = get_popular_stories(index, [user_id], k)
+  if user_id in popular_story_ids:
+    return popular_story_ids[user_id]
+  # A result of a replaced index is neither served nor merged with the
+  # queries of the new one
+  version = index.artifact.version
+  story_ids = cache.get(user_id, language, k, version)
+  if story_ids is None:
+    story_ids = tuple(
+        request_coalescer.submit((language, version), index, user_id, k))
+    cache.put(user_id, language, k, story_ids, version)
+  return list(story_ids)
+
+
+def recommend_filtered(index, user_ids: List[str], k: int,
+                       story_filter: filtering.StoryFilter
+                      ) -> Dict[str, List[str]]:
+  """Returns k stories passing the filter for each user, the unknown users
+  getting the most engaging ones.
+
+  The filtered recommendations are neither coalesced nor cached, as they
+  depend on the filter of each request.
+  """
+
+  allowed = index.stories.allowed(story_filter)
+  known_users = backend.known_users(index, user_ids)
+  recommendations = {
+      user_id: index.stories.popular(allowed, k)
+      for user_id, known in zip(user_ids, known_users)
+      if not known
+  }
+  user_ids = [
+      user_id for user_id in user_ids if user_id not in recommendations
+  ]
+  if user_ids:
+    recommendations.update(
+        zip(user_ids, backend.query_filtered(index, user_ids, k, allowed)))
+  return recommendations
+
+
 @app.get("/recommendations/{user_id}/{language}")
-def get_reccommendations(user_id: str, language: str):
-  amount_of_stories = 20
-  if language == "en":
-    if "en" not in indexes:
-      raise HTTPException(status_code=404,
-                          detail=language + " Index not initialized")
-    _, story_ids = indexes["en"](tf.constant([user_id]), k=amount_of_stories)
-    story_ids = story_ids.numpy().tolist()[0]
-    return tuple(s.decode("utf-8") for s in story_ids)
-  if language == "fr":
-    if "fr" not in indexes:
-      raise HTTPException(status_code=404, detail="Index not initialized")
-    _, story_ids = indexes["fr"](tf.constant([user_id]), k=amount_of_stories)
-    story_ids = story_ids.numpy().tolist()[0]
-    return tuple(s.decode("utf-8") for s in story_ids)
-  raise HTTPException(status_code=500, detail=language + " Language not found")
+def get_reccommendations(user_id: str,
+                         language: str,
+                         k: int = DEFAULT_AMOUNT_OF_STORIES,
+                         exclude_story_id: List[str] = Query([]),
+                         source_id: Optional[List[str]] = Query(None),
+                         published_after: Optional[float] = None):
+  validate_k(k)
+  index = get_index(language)
+  story_filter = filtering.StoryFilter(exclude_story_ids=exclude_story_id,
+                                       source_ids=source_id,
+                                       published_after=published_after)
+  if not story_filter.is_empty():
+    return recommend_filtered(index, [user_id], k, story_filter)[user_id]
+  return recommend(index, user_id, language, k)
+
+
+@app.get("/recommendations/{user_id}/{language}/page",
+         response_model=pagination.RecommendationsPage)
+def get_recommendations_page(user_id: str,
+                             language: str,
+                             k: int = DEFAULT_AMOUNT_OF_STORIES,
+                             cursor: Optional[str] = None):
+  validate_k(k, PAGINATION_DEPTH)
+  if cursor is None:
+    # The first page queries the index once for every page of the snapshot
+    snapshot_id = pagination.new_snapshot_id()
+    story_ids = recommend(get_index(language), user_id, language,
+                          PAGINATION_DEPTH)
+    snapshots.put(user_id, language, snapshot_id, story_ids)
+    return pagination.get_page(snapshot_id, story_ids, 0, k)
+  try:
+    snapshot_id, offset = pagination.decode_cursor(cursor)
+  except ValueError as error:
+    raise HTTPException(status_code=400, detail=str(error))
+  story_ids = snapshots.get(user_id, language, snapshot_id)
+  if story_ids is None:
+    raise HTTPException(status_code=410,
+                        detail="The cursor expired, restart from the first "
+                        "page")
+  return pagination.get_page(snapshot_id, story_ids, offset, k)
+
+
+@app.post("/recommendations/batch", response_model=BatchRecommendationsResponse)
+def get_batch_recommendations(request: BatchRecommendationsRequest):
+  if not request.user_ids:
+    raise HTTPException(status_code=400, detail="No user ids")
+  if len(request.user_ids) > MAX_BATCH_SIZE:
+    raise HTTPException(status_code=413,
+                        detail="At most " + str(MAX_BATCH_SIZE) +
+                        " user ids per batch")
+  validate_k(request.k)
+  index = get_index(request.language)
+  filtered = request.filter is not None and not request.filter.is_empty()
+
+  response = BatchRecommendationsResponse()
+  # Duplicated, unknown and cached user ids are not queried
+  valid_user_ids = []
+  for user_id in dict.fromkeys(request.user_ids):
+    if not user_id.strip():
+      response.errors[user_id] = "Invalid user id"
+    else:
+      valid_user_ids.append(user_id)
+  if filtered:
+    response.recommendations.update(
+        recommend_filtered(index, valid_user_ids, request.k, request.filter))
+    return response
+  response.recommendations.update(
+      get_popular_stories(index, valid_user_ids, request.k))
+  user_ids = []
+  for user_id in valid_user_ids:
+    if user_id in response.recommendations:
+      continue
+    story_ids = cache.get(user_id, request.language, request.k,
+                          index.artifact.version)
+    if story_ids is None:
+      user_ids.append(user_id)
+    else:
+      response.recommendations[user_id] = list(story_ids)
+  if user_ids:
+    for user_id, story_ids in zip(user_ids,
+                                  query_index(index, user_ids, request.k)):
+      cache.put(user_id, request.language, request.k, tuple(story_ids),
+                index.artifact.version)
+      response.recommendations[user_id] = story_ids
+  return response
+
+
+@app.get("/cache/stats", response_model=result_cache.CacheStats)
+def get_cache_stats():
+  return cache.stats()
+
+
+@app.post("/admin/indexes/refresh", status_code=202)
+def refresh_indexes():
+  return {"started": refresher.trigger()}
+
+
+@app.get("/admin/indexes",
+         response_model=Dict[str, index_refresher.IndexStatus])
+def get_index_statuses():
+  return refresher.statuses
+
+
+@app.get("/metrics")
+def get_metrics():
+  return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/admin/memory", response_model=List[memory.ProcessMemory])
+def get_workers_memory():
+  return memory.workers_memory()
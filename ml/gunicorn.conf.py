@@ -0,0 +1,37 @@
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+
+bind = "0.0.0.0:" + os.getenv("PORT", "5158")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+worker_class = "uvicorn.workers.UvicornH11Worker"
+# TensorFlow does not work in a process forked after its runtime started, so
+# the app is not preloaded in the master. The indexes are built once instead,
+# and every worker loads the saved ones.
+preload_app = False
+BUILD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "build_indexes.py")
+# The workers write their metrics to this directory, for /metrics to aggregate
+# them whichever worker is scraped. It is set before the workers import
+# prometheus_client.
+METRICS_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(),
+                                             "ml-metrics"))
+
+
+def on_starting(server):
+  # The metrics of a previous run would be aggregated with the new ones
+  os.makedirs(METRICS_DIR, exist_ok=True)
+  for metrics_file in glob.glob(os.path.join(METRICS_DIR, "*.db")):
+    os.remove(metrics_file)
+  # Run in a separate process so that the master never imports TensorFlow
+  server.log.info("Building the indexes before starting the workers")
+  subprocess.run([sys.executable, BUILD_SCRIPT], check=False)
+
+
+def child_exit(server, worker):
+  # The gauges of the live workers drop the ones of an exited worker
+  from prometheus_client import multiprocess
+  multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,87 @@
+from typing import Any, Callable, Hashable, List
+import threading
+
+
+class _Batch:
+
+  def __init__(self, index):
+    self.index = index
+    self.user_ids: List[str] = []
+    self.full = threading.Event()
+    self.done = threading.Event()
+    self.results = None
+    self.error = None
+
+
+class RequestCoalescer:
+  """Gathers the single user queries of concurrent requests into one batched
+  index query, and returns each request its own row.
+
+  The first request of a batch waits for the others during the window, or
+  until the batch is full, then runs the query on behalf of all of them.
+  Batches are kept apart by key, so that only queries of the same language
+  and k are merged.
+
+    Args:
+        query: Ranks the stories of a list of users, with an index and k.
+        window_seconds: How long the first request of a batch waits for
+          others, 0 queries every request on its own.
+        max_batch_size: The amount of users after which a batch is queried
+          without waiting for the end of the window.
+
+  """
+
+  def __init__(self,
+               query: Callable[[Any, List[str], int], List[List[str]]],
+               window_seconds: float,
+               max_batch_size: int):
+    self.query = query
+    self.window_seconds = window_seconds
+    self.max_batch_size = max_batch_size
+    self._pending = {}
+    self._lock = threading.Lock()
+    # The amount of merged requests and batched queries
+    self.requests = 0
+    self.batches = 0
+
+  def submit(self, key: Hashable, index, user_id: str, k: int) -> List[str]:
+    if self.window_seconds <= 0 or self.max_batch_size <= 1:
+      return self.query(index, [user_id], k)[0]
+
+    with self._lock:
+      self.requests += 1
+      batch = self._pending.get((key, k))
+      leader = batch is None
+      if leader:
+        batch = _Batch(index)
+        self._pending[(key, k)] = batch
+      row = len(batch.user_ids)
+      batch.user_ids.append(user_id)
+      if len(batch.user_ids) >= self.max_batch_size:
+        # The next requests start a new batch
+        del self._pending[(key, k)]
+        batch.full.set()
+
+    if leader:
+      batch.full.wait(self.window_seconds)
+      with self._lock:
+        if self._pending.get((key, k)) is batch:
+          del self._pending[(key, k)]
+        self.batches += 1
+      self._run(batch, k)
+    else:
+      batch.done.wait()
+    if batch.error is not None:
+      raise batch.error
+    return batch.results[row]
+
+  def _run(self, batch: _Batch, k: int):
+    try:
+      # A user requested several times in the window is only queried once
+      user_ids = list(dict.fromkeys(batch.user_ids))
+      rows = dict(zip(user_ids, self.query(batch.index, user_ids, k)))
+      batch.results = [rows[user_id] for user_id in batch.user_ids]
+    except Exception as error:
+      batch.error = error
+    finally:
+      batch.done.set()
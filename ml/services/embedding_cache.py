@@ -0,0 +1,95 @@
+from pydantic import BaseModel
+from typing import Callable, List
+import numpy as np
+import shutil
+import os
+
+STORY_EMBEDDING_CACHE_DIR = "tf_models/story_embeddings"
+STORY_IDS_FILE = "story_ids.npy"
+EMBEDDINGS_FILE = "embeddings.npy"
+
+
+class CacheUpdate(BaseModel):
+  embedded: int
+  reused: int
+  dropped: int
+
+
+class StoryEmbeddingCache:
+  """Keeps the embedding of each story of a language computed by one model
+  version, so that rebuilding an index only embeds the new stories.
+
+  The cache of other model versions is removed, and the stories which are
+  not part of the index anymore are dropped on every update.
+  """
+
+  def __init__(self,
+               language: str,
+               model_version: str,
+               directory: str = STORY_EMBEDDING_CACHE_DIR):
+    self.language_directory = os.path.join(directory, language)
+    self.directory = os.path.join(self.language_directory, model_version)
+
+  def load(self):
+    if not os.path.isfile(os.path.join(self.directory, EMBEDDINGS_FILE)):
+      return np.array([], dtype=str), None
+    return (np.load(os.path.join(self.directory, STORY_IDS_FILE)),
+            np.load(os.path.join(self.directory, EMBEDDINGS_FILE)))
+
+  def update(self, story_ids: List[str],
+             embed: Callable[[List[str]], np.ndarray]):
+    """Returns the embeddings of the stories, only embedding the ones that
+    are not cached.
+
+    Args:
+        story_ids: The ids of the stories, without duplicates.
+        embed: Returns the embedding matrix of a list of story ids.
+
+    Returns:
+        The embedding matrix, in the order of story_ids, and how many
+        stories were embedded, reused and dropped.
+
+    """
+
+    cached_ids, cached_embeddings = self.load()
+    positions = {story_id: row for row, story_id in enumerate(cached_ids)}
+    rows = np.array([positions.get(story_id, -1) for story_id in story_ids],
+                    dtype=np.int64)
+    new_story_ids = [
+        story_id for story_id, row in zip(story_ids, rows) if row < 0
+    ]
+    embeddings = None
+    if new_story_ids:
+      new_embeddings = np.asarray(embed(new_story_ids), dtype=np.float32)
+      embeddings = np.empty((len(story_ids), new_embeddings.shape[1]),
+                            dtype=np.float32)
+      embeddings[rows < 0] = new_embeddings
+    if cached_embeddings is not None and (rows >= 0).any():
+      if embeddings is None:
+        embeddings = np.empty((len(story_ids), cached_embeddings.shape[1]),
+                              dtype=np.float32)
+      embeddings[rows >= 0] = cached_embeddings[rows[rows >= 0]]
+    if embeddings is None:
+      embeddings = np.empty((0, 0), dtype=np.float32)
+    self.save(story_ids, embeddings)
+    reused = len(story_ids) - len(new_story_ids)
+    return embeddings, CacheUpdate(embedded=len(new_story_ids),
+                                   reused=reused,
+                                   dropped=len(cached_ids) - reused)
+
+  def save(self, story_ids: List[str], embeddings: np.ndarray):
+    staging_directory = self.directory + ".tmp"
+    if os.path.isdir(staging_directory):
+      shutil.rmtree(staging_directory)
+    os.makedirs(staging_directory)
+    np.save(os.path.join(staging_directory, STORY_IDS_FILE),
+            np.asarray(story_ids, dtype=str))
+    np.save(os.path.join(staging_directory, EMBEDDINGS_FILE), embeddings)
+    if os.path.isdir(self.directory):
+      shutil.rmtree(self.directory)
+    os.replace(staging_directory, self.directory)
+    # The embeddings of previous model versions are never reused
+    for version in os.listdir(self.language_directory):
+      path = os.path.join(self.language_directory, version)
+      if path != self.directory:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,200 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import logging
+import json
+import zlib
+import os
+
+from services import spool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKET_COUNT = 64
+WATERMARKS_FILE = "watermarks.json"
+PENDING_USERS_FILE = "pending_users.json"
+KEY_SEPARATOR = "\x1f"
+# The story features that change with the feedback of every user
+STORY_COUNT_COLUMNS = ("read_count", "shared_count", "angry_count",
+                       "cry_count", "neutral_count", "smile_count",
+                       "happy_count")
+
+
+def bucket_of(user_id: str, bucket_count: int = DEFAULT_BUCKET_COUNT) -> int:
+  return zlib.crc32(user_id.encode("utf-8")) % bucket_count
+
+
+def _keys(table: pa.Table) -> pa.Array:
+  return pc.binary_join_element_wise(table["user_id"], table["story_id"],
+                                     KEY_SEPARATOR)
+
+
+class FeatureCache:
+  """A local copy of the training data of every user, along with the
+  time_stamp watermark of their most recent entry and the users whose last
+  fetch failed.
+
+  The users are hashed into buckets which are stored as parquet shards, so
+  that the cache directory can be streamed like a spool directory and a merge
+  only rewrites the buckets of the users that received new entries.
+  """
+
+  def __init__(self,
+               directory: str,
+               bucket_count: int = DEFAULT_BUCKET_COUNT):
+    self.directory = directory
+    self.bucket_count = bucket_count
+    os.makedirs(directory, exist_ok=True)
+    self.watermarks = self._load(WATERMARKS_FILE, {})
+    self.pending_user_ids = self._load(PENDING_USERS_FILE, [])
+
+  def _load(self, name: str, default):
+    path = os.path.join(self.directory, name)
+    if not os.path.exists(path):
+      return default
+    with open(path) as state_file:
+      return json.load(state_file)
+
+  def _save(self, name: str, value):
+    path = os.path.join(self.directory, name)
+    with open(path + ".tmp", "w") as state_file:
+      json.dump(value, state_file)
+    os.replace(path + ".tmp", path)
+
+  def _save_watermarks(self):
+    self._save(WATERMARKS_FILE, self.watermarks)
+
+  def set_pending(self, user_ids: List[str]):
+    """Records the users whose fetch failed, to fetch them on the next run
+    whether or not they gave feedback since.
+    """
+
+    self.pending_user_ids = sorted(user_ids)
+    self._save(PENDING_USERS_FILE, self.pending_user_ids)
+
+  def changes_since(self, lag: float = 0.0) -> Optional[float]:
+    """Returns the unix time after which the feedback is not cached yet,
+    lag seconds before the most recent cached entry to account for the
+    feedback stored late, or None when the cache is empty.
+    """
+
+    if not self.watermarks:
+      return None
+    return max(self.watermarks.values()) - lag
+
+  def _bucket_path(self, bucket: int) -> str:
+    return os.path.join(
+        self.directory,
+        spool.SHARD_PREFIX + str(bucket).zfill(5) + spool.SHARD_SUFFIX)
+
+  def _rewrite_bucket(self, bucket: int, table: pa.Table):
+    path = self._bucket_path(bucket)
+    if table.num_rows == 0:
+      if os.path.exists(path):
+        os.remove(path)
+      return
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+  def _read_bucket(self, bucket: int) -> pa.Table:
+    path = self._bucket_path(bucket)
+    if not os.path.exists(path):
+      return spool.RANKING_DATA_SCHEMA.empty_table()
+    return pq.read_table(path, schema=spool.RANKING_DATA_SCHEMA)
+
+  def merge(self, entries: List[dict]) -> int:
+    """Merges newly fetched entries into the cache, an entry replaces the
+    cached entry of the same user and story.
+
+      Args:
+          entries: The RankingData formated as python dictionaries.
+
+      Returns:
+          The amount of buckets that were rewritten.
+
+      """
+
+    buckets = defaultdict(list)
+    for entry in entries:
+      buckets[bucket_of(entry["user_id"], self.bucket_count)].append(entry)
+    for bucket, bucket_entries in buckets.items():
+      new_table = spool.to_table(bucket_entries)
+      cached_table = self._read_bucket(bucket)
+      replaced = pc.is_in(_keys(cached_table), value_set=_keys(new_table))
+      kept_table = cached_table.filter(pc.invert(replaced))
+      self._rewrite_bucket(bucket, pa.concat_tables([kept_table, new_table]))
+    for entry in entries:
+      user_id = entry["user_id"]
+      time_stamp = entry.get("time_stamp") or 0.0
+      self.watermarks[user_id] = max(self.watermarks.get(user_id, 0.0),
+                                     time_stamp)
+    self._save_watermarks()
+    return len(buckets)
+
+  def refresh_stories(self, stories: List[dict]) -> int:
+    """Replaces the feedback counts of the cached entries of some stories by
+    their current counts.
+
+      Args:
+          stories: The story_id and the counts of each story.
+
+      Returns:
+          The amount of buckets that were rewritten.
+
+      """
+
+    if not stories:
+      return 0
+    story_ids = pa.array([story["story_id"] for story in stories],
+                         type=pa.string())
+    counts = {
+        column: pa.array([story.get(column) or 0 for story in stories],
+                         type=pa.int64()) for column in STORY_COUNT_COLUMNS
+    }
+    rewritten = 0
+    for bucket in range(self.bucket_count):
+      table = self._read_bucket(bucket)
+      positions = pc.index_in(table["story_id"], value_set=story_ids)
+      refreshed = pc.is_valid(positions)
+      if not pc.any(refreshed).as_py():
+        continue
+      for column in STORY_COUNT_COLUMNS:
+        table = table.set_column(
+            table.schema.get_field_index(column), column,
+            pc.if_else(refreshed, pc.take(counts[column], positions),
+                       table[column]))
+      self._rewrite_bucket(bucket, table)
+      rewritten += 1
+    return rewritten
+
+  def prune(self, user_ids: Iterable[str]) -> int:
+    """Removes the cached entries of the users which no longer exist.
+
+      Args:
+          user_ids: The ids of all the current users.
+
+      Returns:
+          The amount of users that were removed.
+
+      """
+
+    removed_user_ids = set(self.watermarks) - set(user_ids)
+    if not removed_user_ids:
+      return 0
+    buckets = {
+        bucket_of(user_id, self.bucket_count) for user_id in removed_user_ids
+    }
+    value_set = pa.array(list(removed_user_ids), type=pa.string())
+    for bucket in buckets:
+      cached_table = self._read_bucket(bucket)
+      removed = pc.is_in(cached_table["user_id"], value_set=value_set)
+      self._rewrite_bucket(bucket, cached_table.filter(pc.invert(removed)))
+    for user_id in removed_user_ids:
+      del self.watermarks[user_id]
+    self._save_watermarks()
+    return len(removed_user_ids)
+
+  def row_count(self) -> int:
+    return spool.count_rows(self.directory)
@@ -0,0 +1,205 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pydantic import BaseModel
+from typing import Callable, Dict, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FETCH_WORKERS = 16
+DEFAULT_FETCH_TIMEOUT = 30.0
+DEFAULT_FETCH_RETRIES = 3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FetchReport(BaseModel):
+  user_count: int = 0
+  entry_count: int = 0
+  failed_user_ids: List[str] = []
+  seconds: float = 0.0
+
+  @property
+  def users_per_second(self) -> float:
+    if not self.seconds:
+      return 0.0
+    return self.user_count / self.seconds
+
+  def summary(self) -> str:
+    return ("Fetched " + str(self.entry_count) + " entries for " +
+            str(self.user_count) + " users in " + format(self.seconds, ".1f") +
+            "s (" + format(self.users_per_second, ".1f") + " users/s), " +
+            str(len(self.failed_user_ids)) + " failed users")
+
+
+class TrainingChanges(BaseModel):
+  user_ids: List[str] = []
+  # The story_id and the current feedback counts of each story
+  stories: List[dict] = []
+
+
+def build_session(pool_size: int = DEFAULT_FETCH_WORKERS,
+                  retries: int = DEFAULT_FETCH_RETRIES) -> requests.Session:
+  """Creates an HTTP session whose connection pool is shared by all the
+  fetching threads.
+
+    Args:
+        pool_size: The amount of connections kept alive towards the core
+          service, should match the amount of workers.
+        retries: The amount of times a request is retried on connection
+          errors or transient server errors.
+
+    Returns:
+        The configured requests Session.
+
+    """
+
+  retry = Retry(total=retries,
+                backoff_factor=0.5,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=("GET",),
+                raise_on_status=False)
+  adapter = HTTPAdapter(pool_connections=1,
+                        pool_maxsize=pool_size,
+                        max_retries=retry)
+  session = requests.Session()
+  session.mount("http://", adapter)
+  session.mount("https://", adapter)
+  return session
+
+
+def fetch_user_features(session: requests.Session,
+                        user_id: str,
+                        timeout: float = DEFAULT_FETCH_TIMEOUT,
+                        since: Optional[float] = None) -> List[dict]:
+  """Retrieves the training data entries of a single user from the core
+  service.
+
+    Args:
+        session: The pooled session used for the request.
+        user_id: The id of the user whose interactions are fetched.
+        timeout: The amount of seconds to wait on the core service.
+        since: If provided, only the entries with a more recent time_stamp
+          are retrieved.
+
+    Returns:
+        A list of RankingData formated as python dictionaries, empty when
+        the user has no training data.
+
+    Raises:
+        requests.RequestException: The request failed after all its retries.
+
+    """
+
+  params = {"since": since} if since else None
+  response = session.get(os.getenv("CORE_URL") + "/training/" + user_id,
+                         params=params,
+                         timeout=timeout)
+  if response.status_code == 404:
+    return []
+  response.raise_for_status()
+  return list(response.json())
+
+
+def fetch_training_changes(
+    since: float,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None) -> Optional[TrainingChanges]:
+  """Retrieves the users who gave feedback since a unix time, and the current
+  feedback counts of the stories they gave it to, in one request.
+
+    Args:
+        since: The unix time of the oldest feedback of the changes.
+        timeout: The amount of seconds to wait on the core service, defaults
+          to the TRAINING_FETCH_TIMEOUT environment variable.
+        retries: The amount of retries of the request, defaults to the
+          TRAINING_FETCH_RETRIES environment variable.
+
+    Returns:
+        The changes, or None when they could not be retrieved.
+
+    """
+
+  timeout = timeout or float(
+      os.getenv("TRAINING_FETCH_TIMEOUT", DEFAULT_FETCH_TIMEOUT))
+  if retries is None:
+    retries = int(os.getenv("TRAINING_FETCH_RETRIES", DEFAULT_FETCH_RETRIES))
+  try:
+    with build_session(1, retries) as session:
+      response = session.get(os.getenv("CORE_URL") + "/training/changes",
+                             params={"since": since},
+                             timeout=timeout)
+      response.raise_for_status()
+      return TrainingChanges(**response.json())
+  except (requests.RequestException, ValueError) as e:
+    logger.warning("Failed to fetch the training changes: " + str(e))
+    return None
+
+
+def fetch_training_data(
+    user_ids: List[str],
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+    sink: Optional[Callable[[List[dict]], None]] = None,
+    since: Optional[Dict[str, float]] = None
+) -> Tuple[List[dict], FetchReport]:
+  """Fetches the training data of every user with a bounded amount of
+  concurrent requests over one pooled session.
+
+    Args:
+        user_ids: The ids of the users whose interactions are fetched.
+        workers: The maximum amount of requests in flight, defaults to the
+          TRAINING_FETCH_WORKERS environment variable.
+        timeout: The amount of seconds to wait on each request, defaults to
+          the TRAINING_FETCH_TIMEOUT environment variable.
+        retries: The amount of retries for each request, defaults to the
+          TRAINING_FETCH_RETRIES environment variable.
+        sink: If provided, receives the entries of each user as they arrive
+          instead of them being accumulated in the returned list.
+        since: If provided, maps user ids to the time_stamp watermark after
+          which their entries are retrieved.
+
+    Returns:
+        The fetched entries, and a report of the fetch throughput and of the
+        users that failed.
+
+    """
+
+  workers = workers or int(
+      os.getenv("TRAINING_FETCH_WORKERS", DEFAULT_FETCH_WORKERS))
+  timeout = timeout or float(
+      os.getenv("TRAINING_FETCH_TIMEOUT", DEFAULT_FETCH_TIMEOUT))
+  if retries is None:
+    retries = int(os.getenv("TRAINING_FETCH_RETRIES", DEFAULT_FETCH_RETRIES))
+  since = since or {}
+  report = FetchReport()
+  entries = []
+  start = time.perf_counter()
+  with build_session(workers, retries) as session:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      futures = {
+          executor.submit(fetch_user_features, session, user_id, timeout,
+                          since.get(user_id)): user_id
+          for user_id in user_ids
+      }
+      for future in as_completed(futures):
+        user_id = futures.pop(future)
+        try:
+          data_entries = future.result()
+        except (requests.RequestException, ValueError) as e:
+          logger.warning("Failed to fetch training data for user " +
+                         user_id + ": " + str(e))
+          report.failed_user_ids.append(user_id)
+          continue
+        report.user_count += 1
+        report.entry_count += len(data_entries)
+        if sink:
+          sink(data_entries)
+        else:
+          entries.extend(data_entries)
+  report.seconds = time.perf_counter() - start
+  return entries, report
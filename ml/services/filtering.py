@@ -0,0 +1,226 @@
+from pydantic import BaseModel
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import os
+
+from services import popularity
+
+STORY_IDS_FILE = "metadata_story_ids.npy"
+SORTED_STORY_IDS_FILE = "metadata_sorted_story_ids.npy"
+SORTED_ROWS_FILE = "metadata_sorted_rows.npy"
+SOURCE_IDS_FILE = "metadata_source_ids.npy"
+SOURCE_CODES_FILE = "metadata_source_codes.npy"
+PUBLISHED_AT_FILE = "metadata_published_at.npy"
+POPULAR_ROWS_FILE = "metadata_popular_rows.npy"
+METADATA_FILES = (STORY_IDS_FILE, SORTED_STORY_IDS_FILE, SORTED_ROWS_FILE,
+                  SOURCE_IDS_FILE, SOURCE_CODES_FILE, PUBLISHED_AT_FILE,
+                  POPULAR_ROWS_FILE)
+OVERFETCH_FACTOR = 4
+
+
+def find_sorted(sorted_ids: np.ndarray,
+                ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+  """Binary searches ids in a sorted array of ids.
+
+    Returns:
+        The position of each id in the array, and whether it was found.
+
+    """
+
+  if not len(sorted_ids):
+    return (np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool))
+  # Casting to the dtype of the array would truncate the longer ids
+  queries = np.asarray(ids, dtype=str)
+  positions = np.searchsorted(sorted_ids, queries)
+  positions = np.minimum(positions, len(sorted_ids) - 1)
+  return positions, sorted_ids[positions] == queries
+
+
+class StoryFilter(BaseModel):
+  # The stories the user already read
+  exclude_story_ids: List[str] = []
+  # If set, only the stories of these sources are recommended
+  source_ids: Optional[List[str]] = None
+  # If set, only the stories published since this UNIX time are recommended
+  published_after: Optional[float] = None
+
+  def is_empty(self) -> bool:
+    return (not self.exclude_story_ids and self.source_ids is None and
+            self.published_after is None)
+
+
+class StoryMetadata:
+  """The source, publication time and engagement rank of the stories of an
+  index, as arrays aligned with its rows, which a filter turns into a mask
+  of the stories that can be recommended.
+
+  The source ids are encoded as integers, the mask of a set of sources
+  being a lookup of their codes.
+  """
+
+  def __init__(self, story_ids: np.ndarray, sorted_story_ids: np.ndarray,
+               sorted_rows: np.ndarray, source_ids: np.ndarray,
+               source_codes: np.ndarray, published_at: np.ndarray,
+               popular_rows: np.ndarray):
+    self.story_ids = story_ids
+    self.sorted_story_ids = sorted_story_ids
+    self.sorted_rows = sorted_rows
+    self.source_ids = source_ids
+    self.source_codes = source_codes
+    self.published_at = published_at
+    self.popular_rows = popular_rows
+
+  @classmethod
+  def from_stories(cls, story_ids: List[str],
+                   recent_stories: List[Dict]) -> "StoryMetadata":
+    """Builds the metadata of the stories of an index.
+
+    Args:
+        story_ids: The ids of the indexed stories, in the order of the rows
+          of the index.
+        recent_stories: The RankingData rows of the stories, whose
+          time_stamp is their publication time.
+
+    """
+
+    stories = {}
+    for story in recent_stories:
+      stories.setdefault(story["story_id"], story)
+    story_ids = np.asarray(story_ids, dtype=str)
+    sorted_rows = np.argsort(story_ids, kind="stable")
+    source_ids, source_codes = np.unique(np.array(
+        [stories[story_id].get("source_id") or "" for story_id in story_ids],
+        dtype=str),
+                                         return_inverse=True)
+    rows = {story_id: row for row, story_id in enumerate(story_ids.tolist())}
+    return cls(
+        story_ids, story_ids[sorted_rows], sorted_rows.astype(np.int64),
+        source_ids, source_codes.astype(np.int32),
+        np.array([
+            float(stories[story_id].get("time_stamp") or 0)
+            for story_id in story_ids
+        ]),
+        np.array([
+            rows[story_id]
+            for story_id in popularity.rank_by_engagement(recent_stories)
+            if story_id in rows
+        ],
+                 dtype=np.int64))
+
+  def save(self, directory: str):
+    arrays = {
+        STORY_IDS_FILE: self.story_ids,
+        SORTED_STORY_IDS_FILE: self.sorted_story_ids,
+        SORTED_ROWS_FILE: self.sorted_rows,
+        SOURCE_IDS_FILE: self.source_ids,
+        SOURCE_CODES_FILE: self.source_codes,
+        PUBLISHED_AT_FILE: self.published_at,
+        POPULAR_ROWS_FILE: self.popular_rows,
+    }
+    for file_name, array in arrays.items():
+      np.save(os.path.join(directory, file_name), array, allow_pickle=False)
+
+  @classmethod
+  def load(cls, directory: str) -> Optional["StoryMetadata"]:
+    """Memory-maps the metadata saved in a directory, or returns None when
+    the directory has none.
+    """
+
+    if not all(
+        os.path.isfile(os.path.join(directory, file_name))
+        for file_name in METADATA_FILES):
+      return None
+    return cls(*[
+        np.load(os.path.join(directory, file_name),
+                mmap_mode="r",
+                allow_pickle=False) for file_name in METADATA_FILES
+    ])
+
+  def rows(self, story_ids: List[str]) -> np.ndarray:
+    """Returns the row of each story, -1 for the stories not indexed."""
+
+    if not len(self.sorted_rows):
+      return np.full(len(story_ids), -1, dtype=np.int64)
+    positions, found = find_sorted(self.sorted_story_ids, story_ids)
+    return np.where(found, self.sorted_rows[positions], -1)
+
+  def allowed(self, story_filter: StoryFilter) -> np.ndarray:
+    """Returns whether each row of the index passes the filter.
+
+    The stories without a publication time pass the published_after
+    filter.
+    """
+
+    allowed = np.ones(len(self.story_ids), dtype=bool)
+    if story_filter.source_ids is not None:
+      positions, found = find_sorted(self.source_ids, story_filter.source_ids)
+      allowed_sources = np.zeros(len(self.source_ids), dtype=bool)
+      allowed_sources[positions[found]] = True
+      allowed &= allowed_sources[self.source_codes]
+    if story_filter.published_after is not None:
+      allowed &= ((self.published_at >= story_filter.published_after) |
+                  (self.published_at == 0))
+    if story_filter.exclude_story_ids:
+      rows = self.rows(story_filter.exclude_story_ids)
+      allowed[rows[rows >= 0]] = False
+    return allowed
+
+  def popular(self, allowed: np.ndarray, k: int,
+              exclude: List[str] = ()) -> List[str]:
+    """Returns the k most engaging allowed stories, except the excluded
+    ones.
+    """
+
+    rows = np.asarray(self.popular_rows)[allowed[self.popular_rows]]
+    if exclude:
+      rows = rows[~np.isin(rows, self.rows(list(exclude)))]
+    return self.story_ids[rows[:k]].tolist()
+
+
+def overfetch(query: Callable[[List[str], int], List[List[str]]],
+              metadata: StoryMetadata, user_ids: List[str], k: int,
+              allowed: np.ndarray, max_k: int) -> List[List[str]]:
+  """Queries an approximate index for more stories than needed, keeps the
+  allowed ones, and queries again with a larger k the users that did not
+  get k of them.
+
+  The users still short of k stories once max_k stories were fetched get
+  the most engaging allowed stories after theirs.
+
+    Args:
+        query: Ranks the stories of a list of users, with k.
+        metadata: The metadata of the stories of the index.
+        user_ids: The users to recommend stories to.
+        k: The amount of stories per user.
+        allowed: Whether each row of the index can be recommended.
+        max_k: The largest k the index can be queried with.
+
+    Returns:
+        Up to k allowed stories for each user, k when the index has enough.
+
+    """
+
+  results = [None] * len(user_ids)
+  pending = list(range(len(user_ids)))
+  fetch = min(k * OVERFETCH_FACTOR, max_k, len(metadata.story_ids))
+  while pending:
+    short = []
+    for user, story_ids in zip(pending,
+                               query([user_ids[user] for user in pending],
+                                     fetch)):
+      rows = metadata.rows(story_ids)
+      kept = [
+          story_id for story_id, row in zip(story_ids, rows)
+          if row >= 0 and allowed[row]
+      ]
+      # The approximate index may return a story more than once
+      kept = list(dict.fromkeys(kept))
+      if len(kept) >= k:
+        results[user] = kept[:k]
+      elif fetch >= min(max_k, len(metadata.story_ids)):
+        results[user] = kept + metadata.popular(allowed, k - len(kept), kept)
+      else:
+        short.append(user)
+    pending = short
+    fetch = min(fetch * OVERFETCH_FACTOR, max_k, len(metadata.story_ids))
+  return results
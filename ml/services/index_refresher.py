@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pydantic import BaseModel
+from typing import Any, Callable, Dict, Iterable, Optional
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class IndexStatus(BaseModel):
+  built_at: Optional[float] = None
+  build_seconds: Optional[float] = None
+  last_attempt_at: Optional[float] = None
+  last_error: Optional[str] = None
+
+
+class IndexRefresher:
+  """Rebuilds the index of each language off the request path, and swaps
+  each new index in place of the previous one once it is built.
+
+  The languages are built concurrently and each one is swapped in as soon
+  as its build finishes. The requests keep being served by the previous
+  index during a build, and a failed build leaves it in place without
+  holding back the other languages. Only one refresh runs at a time.
+
+    Args:
+        indexes: The dictionary of the served indexes, by language.
+        languages: The languages to build an index for.
+        load_model: Returns the model the indexes are built with.
+        build_index: Builds the index of a language from the model.
+        interval_seconds: The amount of seconds between two scheduled
+          refreshes, 0 only refreshes on demand.
+        on_swap: Called with the language whose index was replaced.
+        build_workers: The amount of languages built at the same time, by
+          default all of them.
+
+  """
+
+  def __init__(self,
+               indexes: Dict[str, Any],
+               languages: Iterable[str],
+               load_model: Callable[[], Any],
+               build_index: Callable[[Any, str], Any],
+               interval_seconds: float = 0,
+               on_swap: Callable[[str], None] = None,
+               build_workers: int = None):
+    self.indexes = indexes
+    self.languages = tuple(languages)
+    self.load_model = load_model
+    self.build_index = build_index
+    self.interval_seconds = interval_seconds
+    self.on_swap = on_swap
+    self.build_workers = build_workers or len(self.languages)
+    self.statuses = {language: IndexStatus() for language in self.languages}
+    self._refresh_lock = threading.Lock()
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def refresh(self) -> Dict[str, bool]:
+    """Builds and swaps in a new index for every language.
+
+    Returns:
+        Whether the index of each language was replaced, or an empty
+        dictionary when another refresh was already running.
+
+    """
+
+    if not self._refresh_lock.acquire(blocking=False):
+      logger.info("An index refresh is already running")
+      return {}
+    try:
+      return self._refresh()
+    finally:
+      self._refresh_lock.release()
+
+  def _refresh(self) -> Dict[str, bool]:
+    started_at = time.time()
+    try:
+      model = self.load_model()
+      if not model:
+        raise ValueError("No ranking model to build the indexes with")
+    except Exception as error:
+      logger.exception("Failed to load the ranking model")
+      for status in self.statuses.values():
+        status.last_attempt_at = started_at
+        status.last_error = str(error)
+      return {language: False for language in self.languages}
+
+    swapped = {}
+    with ThreadPoolExecutor(max_workers=self.build_workers,
+                            thread_name_prefix="index-build") as executor:
+      futures = {
+          executor.submit(self._build, model, language): language
+          for language in self.languages
+      }
+      for future in as_completed(futures):
+        swapped[futures.pop(future)] = future.result()
+    return {language: swapped[language] for language in self.languages}
+
+  def _build(self, model, language: str) -> bool:
+    status = self.statuses[language]
+    status.last_attempt_at = time.time()
+    start = time.perf_counter()
+    try:
+      index = self.build_index(model, language)
+    except Exception as error:
+      logger.exception("Failed to build the " + language + " index")
+      status.last_error = str(error)
+      return False
+    # Replacing the entry is atomic, requests get either index whole
+    self.indexes[language] = index
+    status.build_seconds = time.perf_counter() - start
+    status.built_at = time.time()
+    status.last_error = None
+    if self.on_swap:
+      self.on_swap(language)
+    logger.info("Swapped in the " + language + " index built in " +
+                format(status.build_seconds, ".1f") + "s")
+    return True
+
+  def trigger(self) -> bool:
+    """Starts a refresh in the background.
+
+    Returns:
+        False when a refresh is already running.
+
+    """
+
+    if self._refresh_lock.locked():
+      return False
+    threading.Thread(target=self.refresh,
+                     name="index-refresh",
+                     daemon=True).start()
+    return True
+
+  def start(self):
+    if self.interval_seconds <= 0 or self._thread:
+      return
+    self._stopped.clear()
+    self._thread = threading.Thread(target=self._run,
+                                    name="index-refresher",
+                                    daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stopped.set()
+    if self._thread:
+      self._thread.join()
+      self._thread = None
+
+  def _run(self):
+    while not self._stopped.wait(self.interval_seconds):
+      self.refresh()
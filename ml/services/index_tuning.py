@@ -0,0 +1,238 @@
+from pydantic import BaseModel
+from typing import Callable, List, Optional, Tuple
+import logging
+import math
+import json
+import time
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BRUTE_FORCE = "brute_force"
+SCANN = "scann"
+# Below this amount of stories the exact top-k is served without tuning
+EXACT_MAX_STORIES = int(os.getenv("INDEX_EXACT_MAX_STORIES", "10000"))
+TARGET_RECALL = float(os.getenv("INDEX_TARGET_RECALL", "0.95"))
+TUNING_USERS = int(os.getenv("INDEX_TUNING_USERS", "200"))
+# The recall is measured at the largest k served, the deep top-k of the
+# pagination by default
+MAX_K = int(os.getenv("RECOMMENDATIONS_MAX_K", "200"))
+TUNING_K = int(
+    os.getenv(
+        "INDEX_TUNING_K",
+        str(max(MAX_K,
+                int(os.getenv("RECOMMENDATIONS_PAGINATION_DEPTH",
+                              str(MAX_K)))))))
+# A tuned configuration is reused until the amount of stories changes by
+# more than this fraction
+RETUNING_STORY_COUNT_CHANGE = float(
+    os.getenv("INDEX_RETUNING_STORY_COUNT_CHANGE", "0.5"))
+LEAVES_TO_SEARCH_FRACTIONS = (0.05, 0.1, 0.2)
+REORDERING_CANDIDATES = (250, 1000)
+
+
+class IndexConfig(BaseModel):
+  index_type: str
+  num_leaves: Optional[int] = None
+  num_leaves_to_search: Optional[int] = None
+  num_reordering_candidates: Optional[int] = None
+
+  def max_results(self, story_count: int) -> int:
+    """Returns the largest amount of stories a query of the index returns."""
+
+    if self.index_type == SCANN:
+      return min(self.num_reordering_candidates, story_count)
+    return story_count
+
+
+# The ScaNN settings used before the indexes were tuned
+DEFAULT_SCANN_CONFIG = IndexConfig(index_type=SCANN,
+                                   num_leaves=100,
+                                   num_leaves_to_search=10,
+                                   num_reordering_candidates=1000)
+
+
+class TuningResult(BaseModel):
+  config: IndexConfig
+  recall: float
+  query_seconds: Optional[float] = None
+
+
+class SavedTuning(BaseModel):
+  model_version: Optional[str] = None
+  story_count: int
+  k: int
+  result: TuningResult
+
+
+def candidate_configs(story_count: int,
+                      min_results: int = TUNING_K) -> List[IndexConfig]:
+  """Returns the index configurations worth measuring for a corpus size.
+
+  The amount of ScaNN leaves grows with the square root of the amount of
+  stories, a fraction of which is searched, and the reordering candidates
+  never go below min_results.
+  """
+
+  configs = [IndexConfig(index_type=BRUTE_FORCE)]
+  if story_count <= EXACT_MAX_STORIES:
+    return configs
+  root = int(math.sqrt(story_count))
+  for num_leaves in dict.fromkeys(min(leaves, story_count)
+                                  for leaves in (root, 2 * root)):
+    for fraction in LEAVES_TO_SEARCH_FRACTIONS:
+      for num_reordering_candidates in REORDERING_CANDIDATES:
+        configs.append(
+            IndexConfig(index_type=SCANN,
+                        num_leaves=num_leaves,
+                        num_leaves_to_search=max(1,
+                                                 int(num_leaves * fraction)),
+                        num_reordering_candidates=max(
+                            num_reordering_candidates, min_results)))
+  return configs
+
+
+def exact_top_k(query_embeddings: np.ndarray, story_embeddings: np.ndarray,
+                story_ids: List[str], k: int) -> List[List[str]]:
+  """Returns the ids of the k stories with the highest dot product."""
+
+  scores = query_embeddings @ story_embeddings.T
+  k = min(k, len(story_ids))
+  top = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+  return np.asarray(story_ids)[top].tolist()
+
+
+def recall_at_k(results: List[List[str]], expected: List[List[str]]) -> float:
+  """Returns the share of the expected stories found by the results."""
+
+  found = sum(
+      len(set(row) & set(expected_row))
+      for row, expected_row in zip(results, expected))
+  return found / max(sum(len(row) for row in expected), 1)
+
+
+def measure(query: Callable[[np.ndarray, int], List[List[str]]],
+            query_embeddings: np.ndarray, expected: List[List[str]],
+            k: int) -> Tuple[float, float]:
+  """Queries an index for each user on its own, the way single user
+  requests are served.
+
+    Returns:
+        The recall@k of the index and its mean latency in seconds.
+
+    """
+
+  results = []
+  start = time.perf_counter()
+  for row in range(len(query_embeddings)):
+    results.extend(query(query_embeddings[row:row + 1], k))
+  seconds = (time.perf_counter() - start) / max(len(query_embeddings), 1)
+  return recall_at_k(results, expected), seconds
+
+
+def select(results: List[TuningResult],
+           target_recall: float = TARGET_RECALL) -> TuningResult:
+  """Returns the fastest configuration reaching the target recall, or the
+  one with the highest recall when none does.
+  """
+
+  reaching = [result for result in results if result.recall >= target_recall]
+  if reaching:
+    return min(reaching, key=lambda result: result.query_seconds)
+  return max(results, key=lambda result: (result.recall, -result.query_seconds))
+
+
+def tune(build: Callable[[IndexConfig], Callable[[np.ndarray, int],
+                                                 List[List[str]]]],
+         query_embeddings: np.ndarray,
+         story_embeddings: np.ndarray,
+         story_ids: List[str],
+         k: int = TUNING_K,
+         target_recall: float = TARGET_RECALL
+        ) -> Tuple[TuningResult, List[TuningResult]]:
+  """Measures the recall@k against the exact top-k and the query latency of
+  the candidate configurations of an index, on the embeddings of sampled
+  users.
+
+    Args:
+        build: Builds the index of a configuration over the stories, and
+          returns its query function of query embeddings and k.
+        query_embeddings: The embeddings of the sampled users.
+        story_embeddings: The embeddings of the indexed stories.
+        story_ids: The ids of the stories, in the order of their embeddings.
+        k: The amount of stories per query.
+        target_recall: The recall@k the selected configuration has to reach.
+
+    Returns:
+        The selected configuration and the measures of every candidate.
+
+    """
+
+  configs = candidate_configs(len(story_ids), k)
+  if len(configs) == 1 or not len(query_embeddings):
+    # Too few stories for an approximate index, or no users to tune it for
+    result = TuningResult(config=configs[0], recall=1.0)
+    return result, [result]
+  k = min(k, len(story_ids))
+  expected = exact_top_k(query_embeddings, story_embeddings, story_ids, k)
+  results = []
+  for config in configs:
+    query = build(config)
+    # The first query builds the functions of the index
+    query(query_embeddings[:1], k)
+    recall, seconds = measure(query, query_embeddings, expected, k)
+    results.append(
+        TuningResult(config=config, recall=recall, query_seconds=seconds))
+  return select(results, target_recall), results
+
+
+def sample_users(user_embeddings: np.ndarray,
+                 count: int = TUNING_USERS,
+                 seed: int = 0) -> np.ndarray:
+  """Samples the embeddings of known users, without the OOV row 0."""
+
+  rows = np.arange(1, len(user_embeddings))
+  if len(rows) > count:
+    rows = np.random.default_rng(seed).choice(rows, count, replace=False)
+  return np.asarray(user_embeddings[rows], dtype=np.float32)
+
+
+def load_tuning(path: str) -> Optional[SavedTuning]:
+  """Loads the last tuning of an index, or None when it was never saved."""
+
+  if not os.path.isfile(path):
+    return None
+  try:
+    with open(path) as tuning_file:
+      return SavedTuning(**json.load(tuning_file))
+  except ValueError:
+    logger.warning("Ignoring the unreadable index tuning " + path)
+    return None
+
+
+def save_tuning(path: str, tuning: SavedTuning):
+  """Replaces the saved tuning of an index atomically."""
+
+  os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+  with open(path + ".tmp", "w") as tuning_file:
+    json.dump(tuning.dict(), tuning_file)
+  os.replace(path + ".tmp", path)
+
+
+def is_stale(tuning: Optional[SavedTuning], model_version: Optional[str],
+             story_count: int, k: int = TUNING_K) -> bool:
+  """Returns whether the candidate indexes have to be measured again: for
+  another model or k, once the amount of stories crossed EXACT_MAX_STORIES
+  or changed by more than RETUNING_STORY_COUNT_CHANGE.
+  """
+
+  if (tuning is None or tuning.model_version != model_version or
+      tuning.k != k):
+    return True
+  if ((tuning.story_count <= EXACT_MAX_STORIES) !=
+      (story_count <= EXACT_MAX_STORIES)):
+    return True
+  return (abs(story_count - tuning.story_count) >
+          RETUNING_STORY_COUNT_CHANGE * tuning.story_count)
@@ -0,0 +1,94 @@
+from pydantic import BaseModel
+from typing import List, Optional
+import resource
+import os
+
+PAGE_SIZE = resource.getpagesize()
+
+
+class ProcessMemory(BaseModel):
+  pid: int
+  rss_bytes: int
+  # The proportional set size splits each shared page between the processes
+  # mapping it, so summing it over the workers gives their real footprint.
+  pss_bytes: Optional[int] = None
+  shared_bytes: int = 0
+
+
+def process_memory(pid: int = None) -> ProcessMemory:
+  """Reads the resident memory of a process from procfs.
+
+    Args:
+        pid: The id of the process, by default the current one.
+
+    Returns:
+        The resident, proportional and shared memory of the process.
+
+    Raises:
+        OSError: The process does not exist or procfs is not mounted.
+
+    """
+
+  pid = pid or os.getpid()
+  try:
+    sizes = {}
+    with open("/proc/" + str(pid) + "/smaps_rollup") as smaps:
+      for line in smaps:
+        fields = line.split()
+        if len(fields) == 3 and fields[2] == "kB":
+          sizes[fields[0].rstrip(":")] = int(fields[1]) * 1024
+    return ProcessMemory(pid=pid,
+                         rss_bytes=sizes["Rss"],
+                         pss_bytes=sizes.get("Pss"),
+                         shared_bytes=sizes.get("Shared_Clean", 0) +
+                         sizes.get("Shared_Dirty", 0))
+  except (OSError, KeyError):
+    # Kernels before 4.14 have no smaps_rollup
+    with open("/proc/" + str(pid) + "/statm") as statm:
+      _, resident, shared = statm.read().split()[:3]
+    return ProcessMemory(pid=pid,
+                         rss_bytes=int(resident) * PAGE_SIZE,
+                         shared_bytes=int(shared) * PAGE_SIZE)
+
+
+def child_pids(pid: int) -> List[int]:
+  pids = []
+  task_directory = "/proc/" + str(pid) + "/task"
+  for task in os.listdir(task_directory):
+    try:
+      with open(os.path.join(task_directory, task, "children")) as children:
+        pids.extend(int(child) for child in children.read().split())
+    except OSError:
+      continue
+  return sorted(pids)
+
+
+def is_gunicorn_master(pid: int) -> bool:
+  try:
+    with open("/proc/" + str(pid) + "/cmdline", "rb") as cmdline:
+      arguments = cmdline.read().split(b"\0")
+  except OSError:
+    return False
+  # Either the gunicorn script or python -m gunicorn
+  return any(
+      os.path.basename(argument).startswith(b"gunicorn")
+      for argument in arguments[:3])
+
+
+def workers_memory() -> List[ProcessMemory]:
+  """Reads the memory of every worker of the gunicorn master running this
+  process, or of this process alone when it is not run by gunicorn.
+  """
+
+  master_pid = os.getppid()
+  pids = [os.getpid()]
+  if is_gunicorn_master(master_pid):
+    pids = child_pids(master_pid) or pids
+  workers = []
+  for pid in pids:
+    try:
+      workers.append(process_memory(pid))
+    except OSError:
+      # The worker exited meanwhile
+      continue
+  return workers
@@ -0,0 +1,26 @@
+from prometheus_client import CollectorRegistry, REGISTRY
+from prometheus_client import multiprocess
+import prometheus_client
+import os
+
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0)
+BUILD_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+                 600.0, 1800.0)
+
+
+def render(multiprocess_dir: str = None) -> bytes:
+  """Renders the metrics in the Prometheus text format.
+
+  Under gunicorn, every worker writes its metrics to the files of the
+  PROMETHEUS_MULTIPROC_DIR directory, which are aggregated so that a scrape
+  returns the metrics of all the workers whichever one serves it.
+  """
+
+  multiprocess_dir = multiprocess_dir or os.getenv("PROMETHEUS_MULTIPROC_DIR")
+  if not multiprocess_dir:
+    return prometheus_client.generate_latest(REGISTRY)
+  registry = CollectorRegistry()
+  multiprocess.MultiProcessCollector(registry, path=multiprocess_dir)
+  return prometheus_client.generate_latest(registry)
@@ -0,0 +1,243 @@
+from pydantic import BaseModel
+from typing import List, Optional, Tuple
+import numpy as np
+import shutil
+import json
+import time
+import os
+
+from services import filtering
+
+RANKING_EMBEDDINGS_DIR = "tf_models/embeddings"
+USERS_DIR = "users"
+EXPORT_CONFIG_FILE = "export.json"
+EXPORT_VERSIONS_KEPT = 2
+USER_IDS_FILE = "user_ids.npy"
+USER_ROWS_FILE = "user_rows.npy"
+USER_EMBEDDINGS_FILE = "user_embeddings.npy"
+STORY_IDS_FILE = "story_ids.npy"
+STORY_EMBEDDINGS_FILE = "story_embeddings.npy"
+
+
+class EmbeddingExport(BaseModel):
+  language: str
+  version: str
+  model_version: str
+  story_count: int
+  built_at: float
+  popular_story_ids: List[str] = []
+
+
+class NumpyIndex:
+  """Ranks the stories of a language for users with a dot product against
+  memory-mapped embedding matrices, without TensorFlow.
+
+  The user embedding table keeps the row layout of the StringLookup and
+  Embedding layers of the model: unknown user ids get the OOV row 0.
+  """
+
+  def __init__(self, user_ids: np.ndarray, user_rows: np.ndarray,
+               user_embeddings: np.ndarray, story_ids: np.ndarray,
+               story_embeddings: np.ndarray, artifact: EmbeddingExport,
+               stories: filtering.StoryMetadata = None):
+    self.user_ids = user_ids
+    self.user_rows = user_rows
+    self.user_embeddings = user_embeddings
+    self.story_ids = story_ids
+    self.story_embeddings = story_embeddings
+    self.artifact = artifact
+    self.stories = stories
+
+  def lookup(self, user_ids: List[str]) -> np.ndarray:
+    """Returns the embedding table row of each user, 0 when unknown."""
+
+    positions, known = filtering.find_sorted(self.user_ids, user_ids)
+    return np.where(known, self.user_rows[positions], 0)
+
+  def known_users(self, user_ids: List[str]) -> np.ndarray:
+    return filtering.find_sorted(self.user_ids, user_ids)[1]
+
+  def search(self,
+             user_ids: List[str],
+             k: int,
+             allowed: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the k stories with the highest score for each user.
+
+    Args:
+        user_ids: The users to rank the stories for.
+        k: The amount of stories per user.
+        allowed: If set, whether each story can be returned.
+
+    Returns:
+        The scores and the story rows, sorted by decreasing score, as
+        matrices of one row per user.
+
+    """
+
+    story_count = len(self.story_ids) if allowed is None else int(
+        allowed.sum())
+    k = min(k, story_count)
+    if k == 0:
+      return (np.zeros((len(user_ids), 0), dtype=np.float32),
+              np.zeros((len(user_ids), 0), dtype=np.int64))
+    queries = self.user_embeddings[self.lookup(user_ids)]
+    scores = queries @ self.story_embeddings.T
+    if allowed is not None:
+      # The exact top-k of the allowed stories, without over-fetching
+      scores[:, ~allowed] = -np.inf
+    # argpartition finds the top k in linear time, only they are sorted
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return (np.take_along_axis(top_scores, order, axis=1),
+            np.take_along_axis(top, order, axis=1))
+
+  def query(self,
+            user_ids: List[str],
+            k: int,
+            allowed: np.ndarray = None) -> List[List[str]]:
+    _, rows = self.search(user_ids, k, allowed)
+    return self.story_ids[rows].tolist()
+
+
+def _save_arrays(directory: str, arrays: dict):
+  os.makedirs(directory, exist_ok=True)
+  for file_name, array in arrays.items():
+    np.save(os.path.join(directory, file_name), array, allow_pickle=False)
+
+
+def _load_array(directory: str, file_name: str) -> np.ndarray:
+  # Memory-mapped arrays are paged in from the page cache, which every
+  # process reading the same file shares.
+  return np.load(os.path.join(directory, file_name),
+                 mmap_mode="r",
+                 allow_pickle=False)
+
+
+def save_users(model_version: str,
+               user_ids: List[str],
+               user_embeddings: np.ndarray,
+               directory: str = RANKING_EMBEDDINGS_DIR) -> str:
+  """Saves the user embedding table of a model version.
+
+    Args:
+        model_version: The version of the model.
+        user_ids: The vocabulary of the user id StringLookup, in its order.
+        user_embeddings: The embedding table, whose row 0 is the OOV row and
+          row i + 1 the row of user_ids[i].
+        directory: The directory of the exports.
+
+    Returns:
+        The directory of the user embedding table.
+
+    """
+
+  users_directory = os.path.join(directory, USERS_DIR, model_version)
+  if os.path.isdir(users_directory):
+    return users_directory
+  staging_directory = users_directory + ".tmp"
+  if os.path.isdir(staging_directory):
+    shutil.rmtree(staging_directory)
+  user_ids = np.asarray(user_ids, dtype=str)
+  # Sorted for the lookups to be binary searches
+  order = np.argsort(user_ids, kind="stable")
+  _save_arrays(
+      staging_directory, {
+          USER_IDS_FILE: user_ids[order],
+          USER_ROWS_FILE: (order + 1).astype(np.int64),
+          USER_EMBEDDINGS_FILE: np.asarray(user_embeddings, dtype=np.float32),
+      })
+  os.replace(staging_directory, users_directory)
+  # The model versions are timestamps, the oldest tables are removed
+  users_root = os.path.join(directory, USERS_DIR)
+  model_versions = sorted(
+      version for version in os.listdir(users_root)
+      if not version.endswith(".tmp"))
+  for version in model_versions[:-EXPORT_VERSIONS_KEPT]:
+    shutil.rmtree(os.path.join(users_root, version), ignore_errors=True)
+  return users_directory
+
+
+def save_stories(artifact: EmbeddingExport,
+                 story_ids: List[str],
+                 story_embeddings: np.ndarray,
+                 directory: str = RANKING_EMBEDDINGS_DIR,
+                 stories: filtering.StoryMetadata = None) -> str:
+  """Saves the story embedding matrix of a language as a new version, and
+  removes the oldest versions.
+  """
+
+  language_directory = os.path.join(directory, artifact.language)
+  version_directory = os.path.join(language_directory, artifact.version)
+  staging_directory = version_directory + ".tmp"
+  if os.path.isdir(staging_directory):
+    shutil.rmtree(staging_directory)
+  _save_arrays(
+      staging_directory, {
+          STORY_IDS_FILE: np.asarray(story_ids, dtype=str),
+          STORY_EMBEDDINGS_FILE: np.asarray(story_embeddings,
+                                            dtype=np.float32),
+      })
+  if stories is not None:
+    stories.save(staging_directory)
+  with open(os.path.join(staging_directory, EXPORT_CONFIG_FILE),
+            "w") as config_file:
+    json.dump(artifact.dict(), config_file)
+  if os.path.isdir(version_directory):
+    shutil.rmtree(version_directory)
+  os.replace(staging_directory, version_directory)
+  for version in list_versions(language_directory)[:-EXPORT_VERSIONS_KEPT]:
+    shutil.rmtree(os.path.join(language_directory, version),
+                  ignore_errors=True)
+  return version_directory
+
+
+def list_versions(language_directory: str) -> List[str]:
+  if not os.path.isdir(language_directory):
+    return []
+  return sorted(version for version in os.listdir(language_directory)
+                if os.path.isfile(
+                    os.path.join(language_directory, version,
+                                 EXPORT_CONFIG_FILE)))
+
+
+def load_index(language: str,
+               model_version: str = None,
+               max_age: float = None,
+               directory: str = RANKING_EMBEDDINGS_DIR) -> Optional[NumpyIndex]:
+  """Memory-maps the latest export of a language.
+
+    Args:
+        language: The language of the stories.
+        model_version: If set, an export of another model version is stale.
+        max_age: If set, an export older than this amount of seconds is
+          stale.
+        directory: The directory of the exports.
+
+    Returns:
+        The index, or None when the export is missing or stale.
+
+    """
+
+  language_directory = os.path.join(directory, language)
+  versions = list_versions(language_directory)
+  if not versions:
+    return None
+  version_directory = os.path.join(language_directory, versions[-1])
+  with open(os.path.join(version_directory, EXPORT_CONFIG_FILE)) as config_file:
+    artifact = EmbeddingExport(**json.load(config_file))
+  if model_version and artifact.model_version != model_version:
+    return None
+  if max_age and time.time() - artifact.built_at > max_age:
+    return None
+  stories = filtering.StoryMetadata.load(version_directory)
+  if stories is None:
+    # Exported before the story metadata was, it cannot filter the stories
+    return None
+  users_directory = os.path.join(directory, USERS_DIR, artifact.model_version)
+  return NumpyIndex(_load_array(users_directory, USER_IDS_FILE),
+                    _load_array(users_directory, USER_ROWS_FILE),
+                    _load_array(users_directory, USER_EMBEDDINGS_FILE),
+                    _load_array(version_directory, STORY_IDS_FILE),
+                    _load_array(version_directory, STORY_EMBEDDINGS_FILE),
+                    artifact, stories)
@@ -0,0 +1,44 @@
+from pydantic import BaseModel
+from typing import List, Optional, Tuple
+import secrets
+
+
+class RecommendationsPage(BaseModel):
+  story_ids: List[str]
+  # None once the deep top-k is exhausted
+  next_cursor: Optional[str] = None
+
+
+def new_snapshot_id() -> str:
+  return secrets.token_hex(8)
+
+
+def encode_cursor(snapshot_id: str, offset: int) -> str:
+  return snapshot_id + "-" + str(offset)
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+  """Returns the snapshot id and the offset of a cursor.
+
+    Raises:
+        ValueError: The cursor is malformed.
+
+    """
+
+  snapshot_id, separator, offset = cursor.partition("-")
+  if not separator or not snapshot_id or not offset.isdigit():
+    raise ValueError("Invalid cursor: " + cursor)
+  return snapshot_id, int(offset)
+
+
+def get_page(snapshot_id: str, story_ids: List[str], offset: int,
+             k: int) -> RecommendationsPage:
+  """Slices a page of k stories from a deep top-k, and the cursor of the
+  next page when there are stories left.
+  """
+
+  end = offset + k
+  return RecommendationsPage(
+      story_ids=list(story_ids[offset:end]),
+      next_cursor=encode_cursor(snapshot_id, end)
+      if end < len(story_ids) else None)
@@ -0,0 +1,38 @@
+from typing import Dict, List
+import numpy as np
+
+POPULAR_STORIES_COUNT = 200
+# The counters of RankingData that a reader engaged with a story
+ENGAGEMENT_COUNTS = ("read_count", "shared_count", "angry_count", "cry_count",
+                     "neutral_count", "smile_count", "happy_count")
+
+
+def popular_story_ids(recent_stories: List[Dict],
+                      count: int = POPULAR_STORIES_COUNT) -> List[str]:
+  """Ranks the recent stories of a language by their engagement, for the
+  users the ranking model knows nothing about.
+
+    Args:
+        recent_stories: The RankingData rows of the recent stories.
+        count: The amount of stories to keep.
+
+    Returns:
+        The ids of the most engaging stories, from the most engaging one.
+
+    """
+
+  return rank_by_engagement(recent_stories)[:count]
+
+
+def rank_by_engagement(recent_stories: List[Dict]) -> List[str]:
+  story_ids = list(
+      dict.fromkeys(story["story_id"] for story in recent_stories))
+  engagement = dict.fromkeys(story_ids, 0)
+  for story in recent_stories:
+    engagement[story["story_id"]] = max(
+        engagement[story["story_id"]],
+        sum(story.get(name) or 0 for name in ENGAGEMENT_COUNTS))
+  scores = np.array([engagement[story_id] for story_id in story_ids])
+  # The stable sort keeps the order of the core service between ties
+  order = np.argsort(-scores, kind="stable")
+  return [story_ids[row] for row in order]
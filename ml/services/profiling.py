@@ -0,0 +1,83 @@
+from contextlib import contextmanager
+from pydantic import BaseModel
+from typing import Dict, List
+import logging
+import resource
+import time
+
+logger = logging.getLogger(__name__)
+
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+
+class PhaseTiming(BaseModel):
+  seconds: float
+  peak_rss_bytes: int
+
+
+def reset_peak_rss() -> bool:
+  # Linux resets the peak RSS of the process (VmHWM) to its current RSS when
+  # 5 is written to clear_refs, so each phase reports its own peak.
+  try:
+    with open(PROC_CLEAR_REFS, "w") as clear_refs:
+      clear_refs.write("5")
+    return True
+  except OSError:
+    return False
+
+
+def peak_rss_bytes() -> int:
+  try:
+    with open(PROC_STATUS) as status:
+      for line in status:
+        if line.startswith("VmHWM:"):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+  # Without procfs this is the peak since the start of the process, which
+  # ru_maxrss reports in kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PhaseTimer:
+  """Records the wall time and the peak RSS of the phases of a job, in the
+  order they ran. Phases are not meant to be nested.
+  """
+
+  def __init__(self):
+    self.phases: Dict[str, PhaseTiming] = {}
+
+  @contextmanager
+  def phase(self, name: str):
+    reset_peak_rss()
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.phases[name] = PhaseTiming(seconds=time.perf_counter() - start,
+                                      peak_rss_bytes=peak_rss_bytes())
+      logger.info(name + ": " + format(self.phases[name].seconds, ".2f") +
+                  "s, peak RSS " +
+                  format(self.phases[name].peak_rss_bytes / 2**20, ".0f") +
+                  " MiB")
+
+  def summary(self) -> Dict[str, dict]:
+    return {name: timing.dict() for name, timing in self.phases.items()}
+
+
+def parse_steps(steps: str) -> List[int]:
+  """Parses the training steps to profile, either "start,stop" or a single
+  step.
+
+    Raises:
+        ValueError: The steps are not one or two positive integers.
+
+    """
+
+  parsed = [int(step) for step in steps.split(",")]
+  if len(parsed) == 1:
+    parsed *= 2
+  if len(parsed) != 2 or parsed[0] < 1 or parsed[1] < parsed[0]:
+    raise ValueError("Invalid profiled steps: " + steps)
+  return parsed
@@ -1,51 +1,216 @@
 from pydantic import BaseModel, Field
-from typing import Dict, Text, Any
+from typing import Dict, List, Optional, Text, Any
 import requests
 import logging
 import pandas as pd
 import numpy as np
 import tensorflow as tf
 import tensorflow_recommenders as tfrs
+import threading
+import shutil
+import fcntl
+import json
+import time
 import os
 
+from opentelemetry import trace
+
+from services import embedding_cache
+from services import filtering
+from services import index_tuning
 from services import mongo
+from services import numpy_index
+from services import popularity
+from services import profiling
+from services import serving
+from services import spool
+from services import vocabulary
 from classes import bson_id
 
 logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+RANKING_MODEL_DIR = "tf_models/ranking_model"
+RANKING_INDEX_DIR = "tf_models/indexes"
+INDEX_TUNING_DIR = "tf_models/index_tuning"
+INDEX_CONFIG_FILE = "index.json"
+INDEX_USER_IDS_FILE = "user_ids.npy"
+INDEX_VERSIONS_KEPT = 2
+ARTIFACT_CONFIG_FILE = "config.json"
+ARTIFACT_WEIGHTS = "weights"
+LANGUAGES = serving.LANGUAGES
+RETRIEVAL_METRIC_KS = (1, 5, 10, 50, 100)
+RANKING_MODEL_HISTORY_LENGTH = 100
+MONGO_MODEL_REGISTRY = "mongo"
+LOCAL_MODEL_REGISTRY = "local"
+
+def train_ranking_model(data_entries, timer=None):
+  timer = timer or profiling.PhaseTimer()
+  # Caching to a file keeps the decoded examples out of RAM between epochs
+  model, eval_dict = fit_ranking_model(
+      data_entries,
+      cache_file=os.getenv("TRAINING_DATA_CACHE_FILE"),
+      timer=timer,
+      profile_dir=os.getenv("TRAINING_PROFILE_DIR"),
+      profile_steps=os.getenv("TRAINING_PROFILE_STEPS", "10,20"))
+  rmse = eval_dict["root_mean_squared_error"]
+  result = save_ranking_model(model, eval_dict, timer=timer)
+  if result:
+    return "Model improved with RMSE score: " + str(rmse)
+  return "Model did not improve with RMSE score: " + str(rmse)
 
-RANKING_MODEL_WEIGHTS_DIR = "tf_models/my_model_weights"
-RANKING_MODEL_DATASET_DIR = "tf_models/dataset.parquet"
-RANKING_MODEL_SCANN_DIR = "tf_models/my_model_scann"
-LANGUAGES = ("en", "fr")
 
-def train_ranking_model(data_entries):
-  data_frame = pd.DataFrame(data_entries)
-  model = NewsRankingModel(data_entries=data_frame)
+def fit_ranking_model(data_entries,
+                      vocabularies=None,
+                      cache_file=None,
+                      threads=None,
+                      timer=None,
+                      profile_dir=None,
+                      profile_steps="10,20",
+                      **model_kwargs):
+  """Fits and evaluates a NewsRankingModel on the training data.
+
+    Args:
+        data_entries: The training entries, or a spool directory of parquet
+          shards which is streamed from disk instead of being loaded in
+          memory.
+        vocabularies: Previously built vocabularies of the training data.
+        cache_file: A path prefix to cache the decoded examples in local
+          files. Without it, in-memory training data is cached in RAM.
+        threads: The size of the private tf.data thread pools.
+        timer: Records the wall time and peak RSS of each phase.
+        profile_dir: If set, a TensorFlow profiler trace of the profiled
+          training steps is written to this directory.
+        profile_steps: The first and last training steps to profile, as
+          "start,stop".
+        **model_kwargs: The hyperparameters of the NewsRankingModel.
+
+    Returns:
+        The fitted model and its evaluation metrics.
+
+    """
+
+  timer = timer or profiling.PhaseTimer()
+  streamed = isinstance(data_entries, str)
+  if not streamed:
+    with timer.phase("dataframe_build"):
+      data_entries = pd.DataFrame(data_entries)
+  batch_size = int(os.getenv("TRAINING_BATCH_SIZE", "8192"))
+  eval_batch_size = int(os.getenv("TRAINING_EVAL_BATCH_SIZE", "4096"))
+  shuffle_buffer = int(os.getenv("TRAINING_SHUFFLE_BUFFER", "100000"))
+  epochs = int(os.getenv("TRAINING_EPOCHS", "3"))
+  if cache_file:
+    spool.remove_cache_files(cache_file)
+  elif not streamed:
+    cache_file = ""
+
+  eval_candidate_sample = int(os.getenv("TRAINING_EVAL_CANDIDATES", "0"))
+
+  model = NewsRankingModel(data_entries=data_entries,
+                           vocabularies=vocabularies,
+                           vocabulary_min_frequency=int(
+                               os.getenv("TRAINING_VOCABULARY_MIN_FREQUENCY",
+                                         "1")),
+                           eval_candidate_sample=eval_candidate_sample,
+                           timer=timer,
+                           **model_kwargs)
   model.compile(optimizer=tf.keras.optimizers.Adagrad(learning_rate=0.1))
 
-  dataset_size = tf.data.experimental.cardinality(model.dataset).numpy()
+  with timer.phase("dataset_construction"):
+    train, test, train_size = split_dataset(model.dataset, shuffle_buffer)
+    cached_train = build_input_pipeline(
+        train,
+        batch_size,
+        shuffle_buffer=shuffle_buffer,
+        cache_file=cache_file + "_train" if cache_file else cache_file,
+        threads=threads)
+    cached_test = build_input_pipeline(
+        test,
+        eval_batch_size,
+        cache_file=cache_file + "_test" if cache_file else cache_file,
+        threads=threads)
+
+  callbacks = [ThroughputCallback(train_size)]
+  if profile_dir:
+    # Only the profiled steps are traced, the TensorBoard logs are unused
+    callbacks.append(
+        tf.keras.callbacks.TensorBoard(
+            log_dir=profile_dir,
+            profile_batch=profiling.parse_steps(profile_steps),
+            histogram_freq=0,
+            write_graph=False,
+            update_freq="epoch"))
+  with timer.phase("fit"):
+    model.fit(cached_train, epochs=epochs, callbacks=callbacks)
+  with timer.phase("evaluate"):
+    model.index_candidates()
+    eval_dict = model.evaluate(cached_test, return_dict=True)
+  if cache_file:
+    spool.remove_cache_files(cache_file)
+  return model, eval_dict
+
+
+def split_dataset(dataset, shuffle_buffer):
+  dataset_size = tf.data.experimental.cardinality(dataset).numpy()
   train_size = int(0.6 * dataset_size)
   test_size = int(0.4 * dataset_size)
-  shuffled = model.dataset.shuffle(100_000,
-                                   seed=42,
-                                   reshuffle_each_iteration=False)
+  shuffled = dataset.shuffle(shuffle_buffer,
+                             seed=42,
+                             reshuffle_each_iteration=False)
   train = shuffled.take(train_size)
   test = shuffled.skip(train_size).take(test_size)
-  cached_train = train.shuffle(100_000).batch(8192).cache()
-  cached_test = test.batch(4096).cache()
-
-  model.fit(cached_train, epochs=3)
-  eval_dict = model.evaluate(cached_test, return_dict=True)
-  rmse = eval_dict["root_mean_squared_error"]
-  result = save_ranking_model(model, eval_dict)
-  if result:
-    return "Model improved with RMSE score: " + str(rmse)
-  return "Model did not improve with RMSE score: " + str(rmse)
+  return train, test, train_size
+
+
+def build_input_pipeline(dataset,
+                         batch_size,
+                         shuffle_buffer=None,
+                         cache_file=None,
+                         threads=None):
+  """Batches and prefetches the examples, shuffling them again on every
+  epoch with a bounded buffer.
+
+  A cache_file of "" caches the examples in memory, a path caches them in
+  local files, and None reads them from the source on every epoch. Setting
+  threads gives the pipeline its own thread pool instead of one sized to
+  every core of the host.
+  """
+
+  if cache_file is not None:
+    dataset = dataset.cache(cache_file)
+  if shuffle_buffer:
+    dataset = dataset.shuffle(shuffle_buffer)
+  dataset = dataset.batch(batch_size, num_parallel_calls=tf.data.AUTOTUNE)
+  if threads:
+    options = tf.data.Options()
+    options.threading.private_threadpool_size = threads
+    dataset = dataset.with_options(options)
+  return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+  def __init__(self, examples_per_epoch):
+    super(ThroughputCallback, self).__init__()
+    self.examples_per_epoch = examples_per_epoch
+    self.examples_per_second = []
+    self.epoch_seconds = []
+    self._epoch_start = None
+
+  def on_epoch_begin(self, epoch, logs=None):
+    self._epoch_start = time.perf_counter()
+
+  def on_epoch_end(self, epoch, logs=None):
+    seconds = time.perf_counter() - self._epoch_start
+    self.epoch_seconds.append(seconds)
+    self.examples_per_second.append(self.examples_per_epoch / seconds)
+    logger.info("Epoch " + str(epoch + 1) + ": " +
+                format(self.examples_per_second[-1], ".0f") +
+                " examples/sec over " + format(seconds, ".1f") + "s")
 
 
 class UserModel(tf.keras.Model):
-  def __init__(self, embedding_dimension, unique_user_ids, timestamps,
-               timestamp_buckets, **kwargs):
+  def __init__(self, embedding_dimension, unique_user_ids, timestamp_buckets,
+               timestamp_mean, timestamp_variance, **kwargs):
     super(UserModel, self).__init__(**kwargs)
 
     self.unique_user_ids = unique_user_ids
@@ -65,9 +230,8 @@ class UserModel(tf.keras.Model):
         tf.keras.layers.Embedding(
             len(self.timestamp_buckets) + 1, embedding_dimension),
     ])
-    self.normalized_timestamp = tf.keras.layers.experimental.preprocessing.Normalization(axis=None)
-
-    self.normalized_timestamp.adapt(timestamps)
+    self.normalized_timestamp = tf.keras.layers.experimental.preprocessing.Normalization(
+        axis=None, mean=timestamp_mean, variance=timestamp_variance)
 
     self._embeddings = {}
 
@@ -94,37 +258,31 @@ class UserModel(tf.keras.Model):
 
 
 class NewsModel(tf.keras.Model):
-  def __init__(self, embedding_dimension, string_features, int_features, **kwargs):
+  def __init__(self, embedding_dimension, vocabularies, **kwargs):
     super(NewsModel, self).__init__(**kwargs)
 
-    self.string_feature_keys = [
-        "story_id", "story_title", "source_id", "author_id",
-        "most_frequent_keyword", "most_frequent_entity"
-    ]
+    self.string_feature_keys = list(vocabulary.STRING_FEATURES)
 
-    self.int_feature_keys = [
-        "source_alexa_rank", "read_count", "shared_count", "angry_count",
-        "cry_count", "neutral_count", "smile_count", "happy_count"
-    ]
+    self.int_feature_keys = list(vocabulary.INT_FEATURES)
 
     self._embeddings = {}
 
     for feature_name in self.string_feature_keys:
-      vocab = string_features.batch(1_000_000).map(lambda x: x[feature_name])
-      vocabulary = np.unique(np.concatenate(list(vocab)))
+      feature_vocabulary = vocabularies[feature_name]
       self._embeddings[feature_name] = tf.keras.Sequential([
           tf.keras.layers.experimental.preprocessing.StringLookup(
-              vocabulary=vocabulary, mask_token=None),
-          tf.keras.layers.Embedding(len(vocabulary) + 1, embedding_dimension)
+              vocabulary=feature_vocabulary, mask_token=None),
+          tf.keras.layers.Embedding(len(feature_vocabulary) + 1,
+                                    embedding_dimension)
       ])
 
     for feature_name in self.int_feature_keys:
-      vocab = int_features.batch(1_000_000).map(lambda x: x[feature_name])
-      vocabulary = np.unique(np.concatenate(list(vocab)))
+      feature_vocabulary = vocabularies[feature_name]
       self._embeddings[feature_name] = tf.keras.Sequential([
           tf.keras.layers.experimental.preprocessing.IntegerLookup(
-              vocabulary=vocabulary, mask_token=None),
-          tf.keras.layers.Embedding(len(vocabulary) + 1, embedding_dimension)
+              vocabulary=feature_vocabulary, mask_token=None),
+          tf.keras.layers.Embedding(len(feature_vocabulary) + 1,
+                                    embedding_dimension)
       ])
 
   def call(self, features):
@@ -154,15 +312,17 @@ class QueryModel(tf.keras.Model):
                layer_sizes,
                embedding_dimension,
                unique_user_ids,
-               timestamps,
                timestamp_buckets,
+               timestamp_mean,
+               timestamp_variance,
                use_cross_layer=False,
                projection_dim=None,
                **kwargs):
     super(QueryModel, self).__init__(**kwargs)
     # We first use the user model for generating embeddings.
     self.embedding_model = UserModel(embedding_dimension, unique_user_ids,
-                                     timestamps, timestamp_buckets)
+                                     timestamp_buckets, timestamp_mean,
+                                     timestamp_variance)
 
     # Then construct the layers.
     self._deep_layers = [
@@ -208,15 +368,12 @@ class CandidateModel(tf.keras.Model):
   def __init__(self,
                layer_sizes,
                embedding_dimension,
-               string_features,
-               int_features,
+               vocabularies,
                use_cross_layer=False,
                projection_dim=None,
                **kwargs):
     super(CandidateModel, self).__init__(**kwargs)
-    self.embedding_model = NewsModel(embedding_dimension,
-                                     string_features,
-                                     int_features)
+    self.embedding_model = NewsModel(embedding_dimension, vocabularies)
 
     self._deep_layers = [
         tf.keras.layers.Dense(layer_size, activation="relu")
@@ -259,51 +416,71 @@ class CandidateModel(tf.keras.Model):
 
 class NewsRankingModel(tfrs.models.Model):
   def __init__(self,
-               data_entries,
+               data_entries=None,
                ranking_weight: float = 1.0,
                retrieval_weight: float = 1.0,
                layer_sizes=[32],
                embedding_dimension=32,
+               vocabularies=None,
+               vocabulary_min_frequency=1,
+               eval_candidate_sample=None,
+               timer=None,
                **kwargs):
     super(NewsRankingModel, self).__init__(**kwargs)
     self.data_entries = data_entries
 
     tf.random.set_seed(42)
 
-    self.dataset = tf.data.Dataset.from_tensor_slices(
-        dict(pd.DataFrame(self.data_entries))).map(
-            lambda x: {
-                "story_id": x["story_id"],
-                "story_title": x["story_title"],
-                "user_id": x["user_id"],
-                "relevancy_rate": x["relevancy_rate"],
-                "time_stamp": x["time_stamp"],
-                "source_alexa_rank": x["source_alexa_rank"],
-                "read_count": x["read_count"],
-                "shared_count": x["shared_count"],
-                "angry_count": x["angry_count"],
-                "cry_count": x["cry_count"],
-                "neutral_count": x["neutral_count"],
-                "smile_count": x["smile_count"],
-                "happy_count": x["happy_count"],
-                "source_id": x["source_id"],
-                "author_id": x["author_id"],
-                "most_frequent_keyword": x["most_frequent_keyword"],
-                "most_frequent_entity": x["most_frequent_entity"]
-            })
-
-    self.timestamps = np.concatenate(
-        list(self.dataset.map(lambda x: x["time_stamp"]).batch(100)))
-
-    self.timestamp_buckets = np.linspace(
-        self.timestamps.min(),
-        self.timestamps.max(),
-        num=1000,
-    ).tolist()
-
-    self.unique_user_ids = np.unique(
-        np.concatenate(
-            list(self.dataset.batch(1_000_000).map(lambda x: x["user_id"]))))
+    # A model restored from an artifact has no training data
+    self.dataset = None
+    if self.data_entries is not None:
+      if isinstance(self.data_entries, str):
+        source = dataset_from_spool(self.data_entries)
+      else:
+        source = tf.data.Dataset.from_tensor_slices(
+            dict(pd.DataFrame(self.data_entries)))
+      self.dataset = source.map(
+          lambda x: {
+              "story_id": x["story_id"],
+              "story_title": x["story_title"],
+              "user_id": x["user_id"],
+              "relevancy_rate": x["relevancy_rate"],
+              "time_stamp": x["time_stamp"],
+              "source_alexa_rank": x["source_alexa_rank"],
+              "read_count": x["read_count"],
+              "shared_count": x["shared_count"],
+              "angry_count": x["angry_count"],
+              "cry_count": x["cry_count"],
+              "neutral_count": x["neutral_count"],
+              "smile_count": x["smile_count"],
+              "happy_count": x["happy_count"],
+              "source_id": x["source_id"],
+              "author_id": x["author_id"],
+              "most_frequent_keyword": x["most_frequent_keyword"],
+              "most_frequent_entity": x["most_frequent_entity"]
+          },
+          num_parallel_calls=tf.data.AUTOTUNE)
+
+    # All the lookup vocabularies and time_stamp statistics are computed in
+    # one pass, unless they were previously built for this data. The same
+    # pass collects each story once to be used as retrieval candidates.
+    self.story_candidates = None
+    self.story_count = 0
+    if self.dataset is not None:
+      timer = timer or profiling.PhaseTimer()
+      corpus = vocabulary.StoryCorpus()
+      batches = corpus.observe(self.dataset.batch(100_000).as_numpy_iterator())
+      with timer.phase("vocabulary_build"):
+        if vocabularies is None:
+          vocabularies = vocabulary.build_vocabularies(
+              batches, min_frequency=vocabulary_min_frequency)
+        else:
+          for _ in batches:
+            pass
+      self.story_candidates = tf.data.Dataset.from_tensor_slices(
+          corpus.columns())
+      self.story_count = len(corpus)
+    self.vocabularies = vocabularies
 
     self.layer_sizes = layer_sizes
     self.embedding_dimension = embedding_dimension
@@ -311,40 +488,17 @@ class NewsRankingModel(tfrs.models.Model):
     # Compute embeddings for users.
     self.query_model = QueryModel(self.layer_sizes,
                                   self.embedding_dimension,
-                                  self.unique_user_ids,
-                                  self.timestamps,
-                                  self.timestamp_buckets,
+                                  self.vocabularies.vocabularies["user_id"],
+                                  self.vocabularies.timestamp_buckets,
+                                  self.vocabularies.timestamp_mean,
+                                  self.vocabularies.timestamp_variance,
                                   use_cross_layer=False,
                                   projection_dim=None)
 
-    self.string_features = self.dataset.map(
-      lambda x: {
-          "story_id": x["story_id"],
-          "story_title": x["story_title"],
-          "source_id": x["source_id"],
-          "author_id": x["author_id"],
-          "most_frequent_keyword": x["most_frequent_keyword"],
-          "most_frequent_entity": x["most_frequent_entity"]
-        }
-      )
-
-    self.int_features = self.dataset.map(
-        lambda x: {
-            "source_alexa_rank": x["source_alexa_rank"],
-            "read_count": x["read_count"],
-            "shared_count": x["shared_count"],
-            "angry_count": x["angry_count"],
-            "cry_count": x["cry_count"],
-            "neutral_count": x["neutral_count"],
-            "smile_count": x["smile_count"],
-            "happy_count": x["happy_count"]
-        })
-
     # Compute embeddings for stories.
     self.candidate_model = CandidateModel(self.layer_sizes,
                                           self.embedding_dimension,
-                                          self.string_features,
-                                          self.int_features,
+                                          self.vocabularies.vocabularies,
                                           use_cross_layer=False,
                                           projection_dim=None)
 
@@ -361,9 +515,21 @@ class NewsRankingModel(tfrs.models.Model):
         loss=tf.keras.losses.MeanSquaredError(),
         metrics=[tf.keras.metrics.RootMeanSquaredError()])
 
+    # The retrieval metrics score against a precomputed matrix of candidate
+    # embeddings, which is filled by index_candidates once the model is fit.
+    self.eval_candidate_sample = eval_candidate_sample
+    self.candidate_index = None
+    retrieval_metrics = None
+    if self.story_candidates is not None:
+      candidate_count = self.story_count
+      if self.eval_candidate_sample:
+        candidate_count = min(candidate_count, self.eval_candidate_sample)
+      self.candidate_index = tfrs.layers.factorized_top_k.BruteForce()
+      retrieval_metrics = tfrs.metrics.FactorizedTopK(
+          candidates=self.candidate_index,
+          ks=[k for k in RETRIEVAL_METRIC_KS if k <= candidate_count])
     self.retrieval_task: tf.keras.layers.Layer = tfrs.tasks.Retrieval(
-        metrics=tfrs.metrics.FactorizedTopK(candidates=self.dataset.batch(
-            128).cache().map(self.candidate_model)))
+        metrics=retrieval_metrics)
 
     # The loss weights.
     self.ranking_weight = ranking_weight
@@ -422,12 +588,25 @@ class NewsRankingModel(tfrs.models.Model):
         labels=rankings,
         predictions=ranking_predictions,
     )
-    retrieval_loss = self.retrieval_task(user_embeddings, story_embeddings)
+    # The retrieval metrics are only needed when evaluating
+    retrieval_loss = self.retrieval_task(user_embeddings,
+                                         story_embeddings,
+                                         compute_metrics=not training)
 
     # And combine them using the loss weights.
     return (self.ranking_weight * ranking_loss +
             self.retrieval_weight * retrieval_loss)
 
+  def index_candidates(self):
+    candidates = self.story_candidates
+    # Sampled metrics rank the true story among a random subset of stories
+    if self.eval_candidate_sample:
+      candidates = candidates.shuffle(self.story_count, seed=42).take(
+          self.eval_candidate_sample)
+    self.candidate_index.index_from_dataset(
+        candidates.batch(4096).map(lambda x: (x["story_id"],
+                                              self.candidate_model(x))))
+
   def get_config(self):
     config = {
         "data_entries": self.data_entries,
@@ -455,10 +634,120 @@ class NewsRankingModel(tfrs.models.Model):
     return cls(**conf)
 
 
+def dataset_from_spool(directory):
+  output_signature = {
+      name: tf.TensorSpec(shape=(None,), dtype=tf.as_dtype(column_type))
+      for name, column_type in spool.RANKING_DATA_COLUMNS.items()
+  }
+  shards = spool.list_shards(directory)
+
+  def read_shard(shard):
+    return tf.data.Dataset.from_generator(
+        lambda path: spool.read_shard(path.decode("utf-8")),
+        output_signature=output_signature,
+        args=(shard,))
+
+  # The shards are read in parallel, in a deterministic order so that the
+  # seeded train/test split stays the same on every epoch.
+  dataset = tf.data.Dataset.from_tensor_slices(shards).interleave(
+      read_shard,
+      cycle_length=max(1, min(len(shards), 4)),
+      num_parallel_calls=tf.data.AUTOTUNE,
+      deterministic=True).unbatch()
+  return dataset.apply(
+      tf.data.experimental.assert_cardinality(spool.count_rows(directory)))
+
+
+class ModelArtifact(BaseModel):
+  version: str
+  layer_sizes: List[int]
+  embedding_dimension: int
+  ranking_weight: float
+  retrieval_weight: float
+
+
+def save_model_artifact(model, directory=RANKING_MODEL_DIR):
+  """Saves everything needed to rebuild the model without its training data:
+  the layer config, the vocabularies with the Discretization and
+  Normalization state, and the weights. The artifact is written next to the
+  previous one and then swapped in place of it.
+  """
+
+  staging_directory = directory + ".tmp"
+  if os.path.isdir(staging_directory):
+    shutil.rmtree(staging_directory)
+  os.makedirs(staging_directory)
+  artifact = ModelArtifact(version=time.strftime("%Y%m%d%H%M%S",
+                                                 time.gmtime()),
+                           layer_sizes=list(model.layer_sizes),
+                           embedding_dimension=model.embedding_dimension,
+                           ranking_weight=model.ranking_weight,
+                           retrieval_weight=model.retrieval_weight)
+  with open(os.path.join(staging_directory, ARTIFACT_CONFIG_FILE),
+            "w") as config_file:
+    json.dump(artifact.dict(), config_file)
+  model.vocabularies.save(staging_directory)
+  model.save_weights(filepath=os.path.join(staging_directory,
+                                           ARTIFACT_WEIGHTS),
+                     save_format="tf")
+  swap_artifact(staging_directory, directory)
+  model.version = artifact.version
+  return artifact
+
+
+def copy_model_artifact(source_directory, directory=RANKING_MODEL_DIR):
+  """Copies a saved artifact, such as the one of a sweep trial, in place of
+  the artifact of the directory, keeping its version and weights as saved.
+  """
+
+  staging_directory = directory + ".tmp"
+  if os.path.isdir(staging_directory):
+    shutil.rmtree(staging_directory)
+  shutil.copytree(source_directory, staging_directory)
+  with open(os.path.join(staging_directory,
+                         ARTIFACT_CONFIG_FILE)) as config_file:
+    artifact = ModelArtifact(**json.load(config_file))
+  swap_artifact(staging_directory, directory)
+  return artifact
+
+
+def swap_artifact(staging_directory, directory):
+  previous_directory = directory + ".old"
+  if os.path.isdir(directory):
+    os.replace(directory, previous_directory)
+  os.replace(staging_directory, directory)
+  if os.path.isdir(previous_directory):
+    shutil.rmtree(previous_directory)
+
+
+def load_model_artifact(directory=RANKING_MODEL_DIR):
+  with open(os.path.join(directory, ARTIFACT_CONFIG_FILE)) as config_file:
+    artifact = ModelArtifact(**json.load(config_file))
+  loaded_model = NewsRankingModel(
+      layer_sizes=artifact.layer_sizes,
+      embedding_dimension=artifact.embedding_dimension,
+      ranking_weight=artifact.ranking_weight,
+      retrieval_weight=artifact.retrieval_weight,
+      vocabularies=vocabulary.Vocabularies.load(directory))
+  # The optimizer slots and metrics are not needed to serve the model
+  loaded_model.load_weights(os.path.join(directory,
+                                         ARTIFACT_WEIGHTS)).expect_partial()
+  # Calling the layers builds them, which restores their loaded weights.
+  # Keras layers are not safe to build from concurrent index builds.
+  loaded_model.query_model.embedding_model.user_embedding(tf.constant([""]))
+  loaded_model.candidate_model.embedding_model._embeddings["story_id"](
+      tf.constant([""]))
+  loaded_model.version = artifact.version
+  return loaded_model
+
+
 class RankingModel(BaseModel):
   id: bson_id.ObjectIdStr = Field(None, alias="_id")
   ranking_model_id: str
   results: dict
+  model_version: Optional[str] = None
+  timings: Optional[dict] = None
+  history: List[dict] = []
 
 
 def get_ranking_model():
@@ -469,80 +758,517 @@ def get_ranking_model():
   return None
 
 
-def save_ranking_model(model, eval_dict):
+def save_ranking_model(model, eval_dict, timer=None):
+  return _save_ranking_model(
+      eval_dict, lambda: save_model_artifact(model, RANKING_MODEL_DIR), timer)
+
+
+def promote_ranking_model(artifact_dir, eval_dict, timer=None):
+  """Saves the artifact of a sweep trial as the ranking model when its
+  results improve on the saved model. The artifact is copied as is, since
+  a model loaded to serve it only restores its embeddings.
+  """
+
+  return _save_ranking_model(
+      eval_dict, lambda: copy_model_artifact(artifact_dir, RANKING_MODEL_DIR),
+      timer)
+
+
+def _save_ranking_model(eval_dict, save_artifact, timer=None):
+  timer = timer or profiling.PhaseTimer()
   ranking_model = get_ranking_model()
+  # The lower the RMSE metric, the more accurate our model is at predicting ranking
+  improved = not ranking_model or eval_dict[
+      "root_mean_squared_error"] < ranking_model.results[
+          "root_mean_squared_error"]
+  # Models saved before the artifacts only left their weights, so the first
+  # run without an artifact saves its model whatever its RMSE
+  if not improved and not os.path.isdir(RANKING_MODEL_DIR):
+    logger.info("No saved model artifact, saving the model with RMSE score: " +
+                str(eval_dict["root_mean_squared_error"]))
+    improved = True
+  artifact = None
+  if improved:
+    with timer.phase("save"):
+      artifact = save_artifact()
+  # Every run is kept, so the performance history sits next to the accuracy
+  run = {
+      "created_at": time.time(),
+      "results": eval_dict,
+      "timings": timer.summary(),
+      "model_version": artifact.version if artifact else None
+  }
   if not ranking_model:
     new_ranking_model = {
         "ranking_model_id": "1",
-        "results": eval_dict
+        "results": eval_dict,
+        "model_version": artifact.version,
+        "timings": run["timings"],
+        "history": [run]
     }
-    model.save_weights(filepath=RANKING_MODEL_WEIGHTS_DIR, save_format="tf")
-    model.data_entries.to_parquet(RANKING_MODEL_DATASET_DIR)
     return mongo.add_or_update(new_ranking_model, "RankingModel")
-  if eval_dict["root_mean_squared_error"] < ranking_model.results[
-      "root_mean_squared_error"]:  # The lower the RMSE metric, the more accurate our model is at predicting ranking
+  ranking_model.history = (ranking_model.history +
+                           [run])[-RANKING_MODEL_HISTORY_LENGTH:]
+  if improved:
     ranking_model.results = eval_dict
-    model.save_weights(filepath=RANKING_MODEL_WEIGHTS_DIR, save_format="tf")
-    model.data_entries.to_parquet(RANKING_MODEL_DATASET_DIR)
+    ranking_model.model_version = artifact.version
+    ranking_model.timings = run["timings"]
     return mongo.add_or_update(ranking_model.dict(), "RankingModel")
+  mongo.add_or_update(ranking_model.dict(), "RankingModel")
   return None
 
 
-def load_ranking_model():
-  ranking_model = get_ranking_model()
-  if ranking_model:
-    data_frame = pd.read_parquet(RANKING_MODEL_DATASET_DIR)
-    loaded_model = NewsRankingModel(data_entries=data_frame)
-    loaded_model.load_weights(RANKING_MODEL_WEIGHTS_DIR)
-    return loaded_model
-  return None
+class SavedRankingModel:
+  """A saved model artifact, whose version is read from its config while
+  its vocabularies and weights are only loaded once an index has to be
+  built with it. The time of that load is observed by the load_seconds
+  histogram, if any.
+  """
+
+  def __init__(self, directory=RANKING_MODEL_DIR, load_seconds=None):
+    self.directory = directory
+    self.load_seconds = load_seconds
+    with open(os.path.join(directory, ARTIFACT_CONFIG_FILE)) as config_file:
+      self.version = ModelArtifact(**json.load(config_file)).version
+    self._model = None
+    self._lock = threading.Lock()
+
+  def load(self):
+    # The languages built concurrently share one model
+    with self._lock:
+      if self._model is None:
+        with tracer.start_as_current_span("load_model_artifact"):
+          start = time.perf_counter()
+          self._model = load_model_artifact(self.directory)
+          if self.load_seconds is not None:
+            self.load_seconds.observe(time.perf_counter() - start)
+      return self._model
+
+
+def open_ranking_model(load_seconds=None):
+  """Returns the saved ranking model without loading it, or None when there
+  is no model.
+  """
+
+  with tracer.start_as_current_span("open_ranking_model"):
+    # The local registry serves the saved model without its Mongo document,
+    # for local runs and load tests
+    ranking_model = os.getenv(
+        "RANKING_MODEL_REGISTRY",
+        MONGO_MODEL_REGISTRY) == LOCAL_MODEL_REGISTRY or get_ranking_model()
+    if ranking_model and os.path.isdir(RANKING_MODEL_DIR):
+      return SavedRankingModel(RANKING_MODEL_DIR, load_seconds)
+    return None
 
 
-def get_indexes():
-  indexes = {}
-  model = load_ranking_model()
-  if not model:
-    logger.error("Failed to load model index.")
-    return None
-  for language in LANGUAGES:
-    response = requests.get(os.getenv("CORE_URL") +
-                            "/update-index/" + language)
+class IndexBuildError(Exception):
+  pass
+
+
+def get_recent_stories(language):
+  with tracer.start_as_current_span("get_recent_stories") as span:
+    span.set_attribute("language", language)
+    response = requests.get(
+        os.getenv("CORE_URL") + "/update-index/" + language)
     if not response:
-      logger.error("Failed to initialize " + language +
-            " index. Update Index call failed")
-      return None
-    recent_stories = list(response.json())
-    df = pd.DataFrame(recent_stories)
-    dic = dict(df)
-    if not dic:
-      logger.error("Failed to initialize " + language + " index. There was no Data")
-      return None
-    dataset = tf.data.Dataset.from_tensor_slices(dic)
-
-    story_ids = dataset.map(lambda x: x["story_id"]).shuffle(
-        10_000, seed=42, reshuffle_each_iteration=False).batch(100)
-    
-    story_id_embeddings = story_ids.map(
-            model.candidate_model.embedding_model._embeddings["story_id"])
-    
-    num_leaves = 100
-    if len(recent_stories) < num_leaves:
-      num_leaves = len(recent_stories)
-    
-    scann = tfrs.layers.factorized_top_k.ScaNN(model.query_model.embedding_model.user_embedding, num_reordering_candidates=1000, num_leaves=num_leaves)
-    scann.index_from_dataset(
-        tf.data.Dataset.zip((story_ids, story_id_embeddings)))
-    indexes.update({language: scann})
-  return indexes
-
-
-def save_scann(model):
-  scann = tfrs.layers.factorized_top_k.ScaNN(model.query_model.embedding_model.user_embedding, num_reordering_candidates=1000)
-  tf.saved_model.save(
-        scann,
-        RANKING_MODEL_SCANN_DIR,
-        options=tf.saved_model.SaveOptions(namespace_whitelist=["Scann"])
-    )
+      raise IndexBuildError("Failed to initialize " + language +
+                            " index. Update Index call failed")
+    return list(response.json())
+
+
+def build_index(model, language, recent_stories=None):
+  """Builds the ScaNN index of the recent stories of a language.
+
+    Args:
+        model: The ranking model embedding the users and stories.
+        language: The language of the stories.
+        recent_stories: The stories to index, by default the ones returned
+          by the /update-index route of the core service.
+
+    Returns:
+        The ScaNN layer returning the story ids of a user id.
+
+    Raises:
+        IndexBuildError: The recent stories could not be retrieved.
+
+    """
+
+  with tracer.start_as_current_span("build_index") as span:
+    span.set_attribute("language", language)
+    index = _build_index(model, language, recent_stories)
+    span.set_attribute("story_count", index.artifact.story_count)
+    return index
+
+
+def _build_index(model, language, recent_stories):
+  if recent_stories is None:
+    recent_stories = get_recent_stories(language)
+  story_ids = list(dict.fromkeys(story["story_id"] for story in recent_stories))
+  if not story_ids:
+    raise IndexBuildError("Failed to initialize " + language +
+                          " index. There was no Data")
+  story_embeddings = embed_stories(model, language, story_ids)
+  user_ids, user_embeddings = user_vocabulary(model)
+  tuning = tune_index(language, story_ids, story_embeddings, user_embeddings,
+                      getattr(model, "version", None))
+
+  with tracer.start_as_current_span("index_stories"):
+    layer = index_layer(tuning.config, story_embeddings, story_ids,
+                        model.query_model.embedding_model.user_embedding)
+  index = ServingIndex(layer)
+  index.artifact = IndexArtifact(
+      language=language,
+      version=time.strftime("%Y%m%d%H%M%S", time.gmtime()) + "-" +
+      str(os.getpid()),
+      model_version=getattr(model, "version", None),
+      story_count=len(story_ids),
+      built_at=time.time(),
+      popular_story_ids=popularity.popular_story_ids(recent_stories),
+      index_config=tuning.config,
+      recall=tuning.recall)
+  index.user_ids = np.sort(np.asarray(user_ids, dtype=str))
+  index.stories = filtering.StoryMetadata.from_stories(story_ids,
+                                                       recent_stories)
+  return index
+
+
+def index_layer(config, story_embeddings, story_ids, query_model=None):
+  """Indexes the story embeddings in the top-k layer of a configuration,
+  which is queried with user ids through the query model, or with query
+  embeddings without it.
+  """
+
+  if config.index_type == index_tuning.BRUTE_FORCE:
+    layer = tfrs.layers.factorized_top_k.BruteForce(query_model)
+  else:
+    layer = tfrs.layers.factorized_top_k.ScaNN(
+        query_model,
+        num_leaves=min(config.num_leaves, len(story_ids)),
+        num_leaves_to_search=min(config.num_leaves_to_search,
+                                 config.num_leaves, len(story_ids)),
+        num_reordering_candidates=config.num_reordering_candidates,
+        parallelize_batch_searches=os.getenv("SCANN_PARALLEL_SEARCH",
+                                             "true").lower() == "true")
+  layer.index(tf.constant(story_embeddings), tf.constant(story_ids))
+  return layer
+
+
+def tune_index(language,
+               story_ids,
+               story_embeddings,
+               user_embeddings,
+               model_version=None,
+               directory=INDEX_TUNING_DIR):
+  """Chooses the index of a language from the amount of stories, measuring
+  the recall and latency of the candidate indexes on sampled users when an
+  approximate one could be faster than the exact top-k.
+
+  The selected index is saved in the directory and reused by the next builds
+  of the model until the amount of stories changes enough to tune it again.
+  """
+
+  path = os.path.join(directory, language + ".json")
+  saved = index_tuning.load_tuning(path)
+  if not index_tuning.is_stale(saved, model_version, len(story_ids)):
+    logger.info("Reusing the " + language + " index " +
+                saved.result.config.json() + " tuned for " +
+                str(saved.story_count) + " stories")
+    return saved.result
+
+  def build(config):
+    layer = index_layer(config, story_embeddings, story_ids)
+    dimensions = story_embeddings.shape[1]
+
+    @tf.function(input_signature=[
+        tf.TensorSpec(shape=[None, dimensions], dtype=tf.float32),
+        tf.TensorSpec(shape=[], dtype=tf.int32)
+    ])
+    def search(queries, k):
+      return layer(queries, k=k)
+
+    def query(query_embeddings, k):
+      _, ids = search(tf.constant(query_embeddings), tf.constant(k))
+      return [[s.decode("utf-8") for s in row] for row in ids.numpy().tolist()]
+
+    return query
+
+  with tracer.start_as_current_span("tune_index") as span:
+    span.set_attribute("language", language)
+    selected, results = index_tuning.tune(
+        build, index_tuning.sample_users(user_embeddings), story_embeddings,
+        story_ids)
+    span.set_attribute("index_type", selected.config.index_type)
+  for result in results:
+    logger.debug("Measured the " + language + " index " +
+                 result.config.json() + ": " + json.dumps(
+                     result.dict(exclude={"config"})))
+  if selected.query_seconds is None:
+    logger.info("Selected the " + language + " index " +
+                selected.config.json() + " for " + str(len(story_ids)) +
+                " stories without tuning it")
+  else:
+    logger.info("Selected the " + language + " index " +
+                selected.config.json() + " for " + str(len(story_ids)) +
+                " stories out of " + str(len(results)) +
+                " configurations, with a recall@" +
+                str(index_tuning.TUNING_K) + " of " +
+                format(selected.recall, ".3f") + " and a latency of " +
+                format(selected.query_seconds * 1000, ".2f") + " ms")
+  index_tuning.save_tuning(
+      path,
+      index_tuning.SavedTuning(model_version=model_version,
+                               story_count=len(story_ids),
+                               k=index_tuning.TUNING_K,
+                               result=selected))
+  return selected
+
+
+def user_vocabulary(model):
+  """Returns the user ids known to the model, in the order of the rows of
+  their embeddings, and the embedding table whose row 0 is the OOV row.
+  """
+
+  user_model = model.query_model.embedding_model.user_embedding
+  user_lookup, user_embedding = user_model.layers
+  # The first token of the lookup vocabulary is the OOV token of row 0
+  return user_lookup.get_vocabulary()[1:], user_embedding.get_weights()[0]
+
+
+def embed_stories(model, language, story_ids,
+                  directory=embedding_cache.STORY_EMBEDDING_CACHE_DIR):
+  """Computes the story_id embeddings of the stories, reusing the ones
+  computed by the same model version on the previous builds.
+  """
+
+  story_embedding = model.candidate_model.embedding_model._embeddings[
+      "story_id"]
+
+  def embed(new_story_ids):
+    return np.concatenate([
+        story_embedding(tf.constant(new_story_ids[offset:offset + 4096]))
+        for offset in range(0, len(new_story_ids), 4096)
+    ])
 
-def get_scann():
-  return tf.saved_model.load(RANKING_MODEL_SCANN_DIR)
+  with tracer.start_as_current_span("embed_stories") as span:
+    model_version = getattr(model, "version", None)
+    if not model_version:
+      return embed(story_ids)
+    cache = embedding_cache.StoryEmbeddingCache(language, model_version,
+                                                directory)
+    story_embeddings, update = cache.update(story_ids, embed)
+    span.set_attribute("embedded", update.embedded)
+    span.set_attribute("reused", update.reused)
+  logger.info("Embedded " + str(update.embedded) + " new " + language +
+              " stories, reused " + str(update.reused) + " and dropped " +
+              str(update.dropped))
+  return story_embeddings
+
+
+class ServingIndex(tf.Module):
+  """Wraps an index layer with a fixed signature, so that it is served the
+  same way once saved and loaded back.
+  """
+
+  def __init__(self, layer):
+    super(ServingIndex, self).__init__()
+    self.layer = layer
+
+  @tf.function(input_signature=[
+      tf.TensorSpec(shape=[None], dtype=tf.string),
+      tf.TensorSpec(shape=[], dtype=tf.int32)
+  ])
+  def __call__(self, user_ids, k):
+    return self.layer(user_ids, k=k)
+
+
+class IndexArtifact(BaseModel):
+  language: str
+  version: str
+  model_version: Optional[str] = None
+  story_count: int
+  built_at: float
+  popular_story_ids: List[str] = []
+  # Saved before the indexes were tuned, it was a ScaNN one
+  index_config: index_tuning.IndexConfig = index_tuning.DEFAULT_SCANN_CONFIG
+  # The recall@k measured against the exact top-k on sampled users
+  recall: Optional[float] = None
+
+
+def save_index(index, directory=RANKING_INDEX_DIR):
+  """Saves a built index as a new version of the index of its language, and
+  removes the oldest versions.
+  """
+
+  artifact = index.artifact
+  language_directory = os.path.join(directory, artifact.language)
+  version_directory = os.path.join(language_directory, artifact.version)
+  staging_directory = version_directory + ".tmp"
+  if os.path.isdir(staging_directory):
+    shutil.rmtree(staging_directory)
+  tf.saved_model.save(
+      index,
+      staging_directory,
+      options=tf.saved_model.SaveOptions(namespace_whitelist=["Scann"]))
+  np.save(os.path.join(staging_directory, INDEX_USER_IDS_FILE),
+          index.user_ids,
+          allow_pickle=False)
+  index.stories.save(staging_directory)
+  with open(os.path.join(staging_directory, INDEX_CONFIG_FILE),
+            "w") as config_file:
+    json.dump(artifact.dict(), config_file)
+  # Other processes only see complete versions
+  if os.path.isdir(version_directory):
+    shutil.rmtree(version_directory)
+  os.replace(staging_directory, version_directory)
+  for version in list_index_versions(language_directory)[:-INDEX_VERSIONS_KEPT]:
+    shutil.rmtree(os.path.join(language_directory, version),
+                  ignore_errors=True)
+  return artifact
+
+
+def list_index_versions(language_directory):
+  if not os.path.isdir(language_directory):
+    return []
+  return sorted(version for version in os.listdir(language_directory)
+                if os.path.isfile(
+                    os.path.join(language_directory, version,
+                                 INDEX_CONFIG_FILE)))
+
+
+def load_index(language, model_version=None, max_age=None,
+               directory=RANKING_INDEX_DIR):
+  """Loads the latest saved index of a language.
+
+    Args:
+        language: The language of the index.
+        model_version: If set, an index built with another model version is
+          stale.
+        max_age: If set, an index built more than this amount of seconds ago
+          is stale.
+        directory: The directory of the saved indexes.
+
+    Returns:
+        The loaded index, or None when it is missing or stale.
+
+    """
+
+  language_directory = os.path.join(directory, language)
+  versions = list_index_versions(language_directory)
+  if not versions:
+    return None
+  version_directory = os.path.join(language_directory, versions[-1])
+  with open(os.path.join(version_directory, INDEX_CONFIG_FILE)) as config_file:
+    artifact = IndexArtifact(**json.load(config_file))
+  if model_version and artifact.model_version != model_version:
+    return None
+  if max_age and time.time() - artifact.built_at > max_age:
+    return None
+  user_ids_file = os.path.join(version_directory, INDEX_USER_IDS_FILE)
+  if not os.path.isfile(user_ids_file):
+    # Saved before the user ids were, it cannot tell the unknown users apart
+    return None
+  stories = filtering.StoryMetadata.load(version_directory)
+  if stories is None:
+    # Saved before the story metadata was, it cannot filter the stories
+    return None
+  index = tf.saved_model.load(version_directory)
+  index.artifact = artifact
+  index.user_ids = np.load(user_ids_file, mmap_mode="r", allow_pickle=False)
+  index.stories = stories
+  return index
+
+
+def load_or_build_index(saved_model, language, max_age=None,
+                        directory=RANKING_INDEX_DIR):
+  """Loads the saved index of a language, or builds and saves it when it is
+  missing or stale.
+
+  The workers of a host take a file lock, so that only one of them builds
+  a stale index while the others wait to load it. The saved model is only
+  loaded to build an index, so that the workers loading the indexes saved
+  by build_indexes.py never load it.
+  """
+
+  os.makedirs(directory, exist_ok=True)
+  with open(os.path.join(directory, language + ".lock"), "w") as lock_file:
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    try:
+      with tracer.start_as_current_span("load_index") as span:
+        span.set_attribute("language", language)
+        index = load_index(language,
+                           model_version=saved_model.version,
+                           max_age=max_age,
+                           directory=directory)
+      if index is not None:
+        logger.info("Loaded the " + language + " index " +
+                    index.artifact.version)
+        return index
+      index = build_index(saved_model.load(), language)
+      with tracer.start_as_current_span("save_index"):
+        save_index(index, directory)
+      return index
+    finally:
+      fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def export_embeddings(model,
+                      language,
+                      directory=numpy_index.RANKING_EMBEDDINGS_DIR,
+                      recent_stories=None):
+  """Exports the user embedding table and the embeddings of the recent
+  stories of a language as NumPy files, for numpy_index to serve them
+  without TensorFlow.
+
+    Raises:
+        IndexBuildError: The recent stories could not be retrieved.
+
+  """
+
+  user_ids, user_embeddings = user_vocabulary(model)
+  numpy_index.save_users(model.version,
+                         user_ids,
+                         user_embeddings,
+                         directory=directory)
+
+  if recent_stories is None:
+    recent_stories = get_recent_stories(language)
+  story_ids = list(dict.fromkeys(story["story_id"] for story in recent_stories))
+  if not story_ids:
+    raise IndexBuildError("Failed to initialize " + language +
+                          " index. There was no Data")
+  story_embeddings = embed_stories(model, language, story_ids)
+  artifact = numpy_index.EmbeddingExport(
+      language=language,
+      version=time.strftime("%Y%m%d%H%M%S", time.gmtime()) + "-" +
+      str(os.getpid()),
+      model_version=model.version,
+      story_count=len(story_ids),
+      built_at=time.time(),
+      popular_story_ids=popularity.popular_story_ids(recent_stories))
+  numpy_index.save_stories(artifact,
+                           story_ids,
+                           story_embeddings,
+                           directory=directory,
+                           stories=filtering.StoryMetadata.from_stories(
+                               story_ids, recent_stories))
+  return artifact
+
+
+def load_or_export_embeddings(saved_model,
+                              language,
+                              max_age=None,
+                              directory=numpy_index.RANKING_EMBEDDINGS_DIR):
+  os.makedirs(directory, exist_ok=True)
+  with open(os.path.join(directory, language + ".lock"), "w") as lock_file:
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    try:
+      index = numpy_index.load_index(language,
+                                     model_version=saved_model.version,
+                                     max_age=max_age,
+                                     directory=directory)
+      if index is None:
+        export_embeddings(saved_model.load(), language, directory)
+        index = numpy_index.load_index(language, directory=directory)
+      return index
+    finally:
+      fcntl.flock(lock_file, fcntl.LOCK_UN)
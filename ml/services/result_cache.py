@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from pydantic import BaseModel
+from typing import Any, Callable, Hashable, Optional, Tuple
+import threading
+import time
+
+
+class CacheStats(BaseModel):
+  size: int
+  max_size: int
+  ttl_seconds: float
+  hits: int
+  misses: int
+  evictions: int
+  expirations: int
+  invalidations: int
+  hit_rate: float
+  miss_rate: float
+
+
+class ResultCache:
+  """A thread-safe LRU cache of recommendation results, keyed by
+  (user_id, language, k), whose entries expire after a TTL.
+
+  The least recently used entry is evicted once the cache is full, and
+  every entry of a language is dropped when its index is rebuilt. An entry
+  can also be stored with the version of the index it was queried from,
+  and is only returned to the gets of that same version, so that a result
+  of the previous index put after the invalidation is never served.
+  """
+
+  def __init__(self,
+               max_size: int,
+               ttl_seconds: float,
+               clock: Callable[[], float] = time.monotonic):
+    self.max_size = max_size
+    self.ttl_seconds = ttl_seconds
+    self._clock = clock
+    self._entries: "OrderedDict[Hashable, Tuple[float, Optional[str], Any]]" = (
+        OrderedDict())
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._misses = 0
+    self._evictions = 0
+    self._expirations = 0
+    self._invalidations = 0
+
+  def get(self,
+          user_id: str,
+          language: str,
+          k: int,
+          version: Optional[str] = None) -> Optional[Any]:
+    key = (user_id, language, k)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self._misses += 1
+        return None
+      expires_at, entry_version, value = entry
+      if expires_at <= self._clock():
+        del self._entries[key]
+        self._expirations += 1
+        self._misses += 1
+        return None
+      if entry_version != version:
+        del self._entries[key]
+        self._invalidations += 1
+        self._misses += 1
+        return None
+      self._entries.move_to_end(key)
+      self._hits += 1
+      return value
+
+  def put(self,
+          user_id: str,
+          language: str,
+          k: int,
+          value: Any,
+          version: Optional[str] = None):
+    if self.max_size <= 0:
+      return
+    key = (user_id, language, k)
+    with self._lock:
+      self._entries[key] = (self._clock() + self.ttl_seconds, version, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+        self._evictions += 1
+
+  def invalidate(self, language: str) -> int:
+    with self._lock:
+      keys = [key for key in self._entries if key[1] == language]
+      for key in keys:
+        del self._entries[key]
+      self._invalidations += len(keys)
+      return len(keys)
+
+  def stats(self) -> CacheStats:
+    with self._lock:
+      lookups = self._hits + self._misses
+      return CacheStats(size=len(self._entries),
+                        max_size=self.max_size,
+                        ttl_seconds=self.ttl_seconds,
+                        hits=self._hits,
+                        misses=self._misses,
+                        evictions=self._evictions,
+                        expirations=self._expirations,
+                        invalidations=self._invalidations,
+                        hit_rate=self._hits / lookups if lookups else 0.0,
+                        miss_rate=self._misses / lookups if lookups else 0.0)
@@ -0,0 +1,224 @@
+from typing import Any, List, Optional
+import subprocess
+import logging
+import fcntl
+import sys
+import os
+
+import numpy as np
+from opentelemetry import trace
+from prometheus_client import CollectorRegistry, Gauge, Histogram, REGISTRY
+
+from services import filtering
+from services import metrics
+from services import numpy_index
+
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+LANGUAGES = ("en", "fr")
+SCANN_BACKEND = "scann"
+NUMPY_BACKEND = "numpy"
+EXPORT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                             "build_indexes.py")
+
+
+class ScannBackend:
+  """Serves the indexes built with the TensorFlow model, a ScaNN one or an
+  exact one depending on the amount of stories.
+  """
+
+  name = SCANN_BACKEND
+
+  def __init__(self, max_age: float = None):
+    self.max_age = max_age
+
+  def load_model(self, load_seconds=None):
+    from services import ranking
+    # Loading a saved index only needs the version of the model
+    return ranking.open_ranking_model(load_seconds)
+
+  def build_index(self, model, language: str):
+    from services import ranking
+    # An index saved by another worker is loaded while it is not stale
+    return ranking.load_or_build_index(model,
+                                       language,
+                                       max_age=self.max_age)
+
+  def known_users(self, index, user_ids: List[str]) -> np.ndarray:
+    return filtering.find_sorted(index.user_ids, user_ids)[1]
+
+  def query(self, index, user_ids: List[str], k: int) -> List[List[str]]:
+    import tensorflow as tf
+    # The exact index cannot return more stories than it has
+    k = min(k, index.artifact.story_count)
+    # One call ranks the stories of every user of the batch
+    _, story_ids = index(tf.constant(user_ids), k=k)
+    return [[s.decode("utf-8")
+             for s in row]
+            for row in story_ids.numpy().tolist()]
+
+  def query_filtered(self, index, user_ids: List[str], k: int,
+                     allowed: np.ndarray) -> List[List[str]]:
+    # The index cannot skip stories, so it fetches more of them
+    artifact = index.artifact
+    return filtering.overfetch(
+        lambda batch, fetch: self.query(index, batch, fetch), index.stories,
+        user_ids, k, allowed,
+        artifact.index_config.max_results(artifact.story_count))
+
+
+class NumpyBackend:
+  """Serves memory-mapped embedding exports with NumPy, the process never
+  imports TensorFlow.
+
+  A missing or stale export is written by build_indexes.py in a separate
+  process, which is the only one to load the TensorFlow model.
+  """
+
+  name = NUMPY_BACKEND
+
+  def __init__(self,
+               max_age: float = None,
+               directory: str = numpy_index.RANKING_EMBEDDINGS_DIR):
+    self.max_age = max_age
+    self.directory = directory
+
+  def load_model(self, load_seconds=None):
+    # The exports are self-contained, there is no model to load
+    return self.directory
+
+  def build_index(self, directory: str, language: str):
+    with tracer.start_as_current_span("load_index") as span:
+      span.set_attribute("language", language)
+      index = numpy_index.load_index(language,
+                                     max_age=self.max_age,
+                                     directory=directory)
+    if index is not None:
+      return index
+    os.makedirs(directory, exist_ok=True)
+    # The other workers wait for the export instead of running it too
+    with open(os.path.join(directory, language + ".export.lock"),
+              "w") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        index = numpy_index.load_index(language,
+                                       max_age=self.max_age,
+                                       directory=directory)
+        if index is None:
+          environment = dict(os.environ, SERVING_BACKEND=NUMPY_BACKEND)
+          with tracer.start_as_current_span("export_embeddings"):
+            subprocess.run([sys.executable, EXPORT_SCRIPT, language],
+                           env=environment,
+                           check=True)
+          index = numpy_index.load_index(language, directory=directory)
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    if index is None:
+      raise ValueError("No " + language + " embeddings were exported")
+    return index
+
+  def known_users(self, index, user_ids: List[str]) -> np.ndarray:
+    return index.known_users(user_ids)
+
+  def query(self, index, user_ids: List[str], k: int) -> List[List[str]]:
+    return index.query(user_ids, k)
+
+  def query_filtered(self, index, user_ids: List[str], k: int,
+                     allowed: np.ndarray) -> List[List[str]]:
+    return index.query(user_ids, k, allowed)
+
+
+class MeteredBackend:
+  """Records the model load time, the index build time and size, and the
+  latency of the index queries of a backend.
+  """
+
+  def __init__(self, backend, registry: CollectorRegistry = REGISTRY):
+    self.backend = backend
+    self.name = backend.name
+    self.model_load_seconds = Histogram(
+        "ranking_model_load_seconds",
+        "Time to load the vocabularies and weights of the ranking model, "
+        "once per refresh building an index with it",
+        buckets=metrics.BUILD_BUCKETS,
+        registry=registry)
+    self.index_build_seconds = Histogram(
+        "ranking_index_build_seconds",
+        "Time to load or build the index of a language", ("language",),
+        buckets=metrics.BUILD_BUCKETS,
+        registry=registry)
+    # The workers serve the same indexes, the last one to swap them is shown
+    self.index_stories = Gauge("ranking_index_stories",
+                               "Amount of stories in the served index",
+                               ("language",),
+                               multiprocess_mode="livemostrecent",
+                               registry=registry)
+    self.index_recall = Gauge(
+        "ranking_index_recall",
+        "Recall@k of the served index measured against the exact top-k",
+        ("language",),
+        multiprocess_mode="livemostrecent",
+        registry=registry)
+    self.query_seconds = Histogram(
+        "ranking_index_query_seconds",
+        "Latency of the index queries, without the request handling",
+        ("language",),
+        buckets=metrics.LATENCY_BUCKETS,
+        registry=registry)
+    self.query_users = Histogram("ranking_index_query_users",
+                                 "Amount of users per index query",
+                                 ("language",),
+                                 buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256,
+                                          512, 1024),
+                                 registry=registry)
+
+  def load_model(self):
+    # Opening the model is cheap, its weights are loaded by the index builds
+    return self.backend.load_model(load_seconds=self.model_load_seconds)
+
+  def build_index(self, model, language: str):
+    with self.index_build_seconds.labels(language=language).time():
+      index = self.backend.build_index(model, language)
+    self.index_stories.labels(language=language).set(
+        index.artifact.story_count)
+    # The NumPy exports are exact, the recall of older indexes is unknown
+    recall = getattr(index.artifact, "recall", 1.0)
+    if recall is not None:
+      self.index_recall.labels(language=language).set(recall)
+    return index
+
+  def known_users(self, index, user_ids: List[str]) -> np.ndarray:
+    return self.backend.known_users(index, user_ids)
+
+  def query(self, index, user_ids: List[str], k: int) -> List[List[str]]:
+    language = index.artifact.language
+    self.query_users.labels(language=language).observe(len(user_ids))
+    with self.query_seconds.labels(language=language).time():
+      return self.backend.query(index, user_ids, k)
+
+  def query_filtered(self, index, user_ids: List[str], k: int,
+                     allowed: np.ndarray) -> List[List[str]]:
+    language = index.artifact.language
+    self.query_users.labels(language=language).observe(len(user_ids))
+    with self.query_seconds.labels(language=language).time():
+      return self.backend.query_filtered(index, user_ids, k, allowed)
+
+
+def popular_stories(index, k: int) -> Optional[List[str]]:
+  """Returns the k most engaging recent stories of an index, or None when
+  it was built without them.
+  """
+
+  popular_story_ids = getattr(index.artifact, "popular_story_ids", None)
+  if not popular_story_ids:
+    return None
+  return list(popular_story_ids[:k])
+
+
+def get_backend(name: str, max_age: float = None) -> Any:
+  if name == SCANN_BACKEND:
+    return ScannBackend(max_age)
+  if name == NUMPY_BACKEND:
+    return NumpyBackend(max_age)
+  raise ValueError("Unknown serving backend: " + name)
@@ -0,0 +1,180 @@
+from typing import Dict, Iterator, List
+import pyarrow as pa
+import pyarrow.parquet as pq
+import numpy as np
+import logging
+import shutil
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPOOL_BATCH_SIZE = 50_000
+SHARD_PREFIX = "part-"
+SHARD_SUFFIX = ".parquet"
+
+# Columnar layout of the RankingData schema found in schemas/DataSet.yaml
+RANKING_DATA_COLUMNS = {
+    "story_id": "string",
+    "user_id": "string",
+    "relevancy_rate": "float64",
+    "time_stamp": "float64",
+    "story_title": "string",
+    "source_alexa_rank": "int64",
+    "read_count": "int64",
+    "shared_count": "int64",
+    "angry_count": "int64",
+    "cry_count": "int64",
+    "neutral_count": "int64",
+    "smile_count": "int64",
+    "happy_count": "int64",
+    "source_id": "string",
+    "author_id": "string",
+    "most_frequent_keyword": "string",
+    "most_frequent_entity": "string",
+}
+
+RANKING_DATA_SCHEMA = pa.schema([
+    (name, pa.type_for_alias(column_type))
+    for name, column_type in RANKING_DATA_COLUMNS.items()
+])
+
+RANKING_DATA_DEFAULTS = {
+    name: "" if column_type == "string" else 0
+    for name, column_type in RANKING_DATA_COLUMNS.items()
+}
+
+
+def to_table(entries: List[dict]) -> pa.Table:
+  """Converts RankingData dictionaries to an arrow table following the
+  DataSet schema, missing values are replaced by the schema defaults.
+
+    Args:
+        entries: The RankingData formated as python dictionaries.
+
+    Returns:
+        The arrow table.
+
+    """
+
+  columns = []
+  for field in RANKING_DATA_SCHEMA:
+    column = pa.array([entry.get(field.name) for entry in entries],
+                      type=field.type)
+    columns.append(column.fill_null(RANKING_DATA_DEFAULTS[field.name]))
+  return pa.Table.from_arrays(columns, schema=RANKING_DATA_SCHEMA)
+
+
+class ParquetSpool:
+  """Buffers RankingData entries and writes them as parquet shards once the
+  buffer reaches the batch size, so that only one batch is held in memory.
+  """
+
+  def __init__(self,
+               directory: str,
+               batch_size: int = DEFAULT_SPOOL_BATCH_SIZE):
+    self.directory = directory
+    self.batch_size = batch_size
+    self.row_count = 0
+    self.shard_count = 0
+    self._buffer = []
+    if os.path.isdir(directory):
+      shutil.rmtree(directory)
+    os.makedirs(directory)
+
+  def write(self, entries: List[dict]):
+    self._buffer.extend(entries)
+    if len(self._buffer) >= self.batch_size:
+      self.flush()
+
+  def flush(self):
+    if not self._buffer:
+      return
+    shard_name = SHARD_PREFIX + str(self.shard_count).zfill(5) + SHARD_SUFFIX
+    pq.write_table(to_table(self._buffer),
+                   os.path.join(self.directory, shard_name))
+    self.row_count += len(self._buffer)
+    self.shard_count += 1
+    self._buffer = []
+
+  def close(self):
+    self.flush()
+    logger.info("Spooled " + str(self.row_count) + " entries to " +
+                str(self.shard_count) + " shards in " + self.directory)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+def list_shards(directory: str) -> List[str]:
+  return sorted(
+      os.path.join(directory, file_name)
+      for file_name in os.listdir(directory)
+      if file_name.startswith(SHARD_PREFIX) and file_name.endswith(SHARD_SUFFIX))
+
+
+def count_rows(directory: str) -> int:
+  return sum(
+      pq.ParquetFile(shard).metadata.num_rows
+      for shard in list_shards(directory))
+
+
+def read_shard(
+    shard: str,
+    batch_size: int = DEFAULT_SPOOL_BATCH_SIZE
+) -> Iterator[Dict[str, np.ndarray]]:
+  parquet_file = pq.ParquetFile(shard)
+  for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+    yield {
+        name: column.to_numpy(zero_copy_only=False)
+        for name, column in zip(record_batch.schema.names,
+                                record_batch.columns)
+    }
+
+
+def read_batches(
+    directory: str,
+    batch_size: int = DEFAULT_SPOOL_BATCH_SIZE
+) -> Iterator[Dict[str, np.ndarray]]:
+  """Streams the spooled shards back as columnar batches.
+
+    Args:
+        directory: The directory holding the parquet shards.
+        batch_size: The maximum amount of rows in each batch.
+
+    Returns:
+        An iterator of dictionaries mapping each column of the DataSet schema
+        to a numpy array.
+
+    """
+
+  for shard in list_shards(directory):
+    yield from read_shard(shard, batch_size)
+
+
+def remove_cache_files(cache_file: str):
+  """Removes the files tf.data wrote for the train and test caches of a
+  cache file prefix, which the next run would otherwise read back: their
+  .index and .data-* files, and the _{shard}.lockfile and temporary files
+  of a partially written cache.
+
+    Raises:
+        ValueError: The cache file is a directory instead of a path prefix.
+
+  """
+
+  prefix = os.path.basename(cache_file)
+  if not prefix or prefix in (".", "..") or os.path.isdir(cache_file):
+    raise ValueError("The cache file " + cache_file +
+                     " must be a path prefix, not a directory")
+  cache_directory = os.path.dirname(cache_file) or "."
+  if not os.path.isdir(cache_directory):
+    return
+  names = re.compile(
+      re.escape(prefix) + r"_(train|test)(_\d+)?\.(index|lockfile|data-.*)")
+  for file_name in os.listdir(cache_directory):
+    if names.fullmatch(file_name):
+      os.remove(os.path.join(cache_directory, file_name))
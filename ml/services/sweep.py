@@ -0,0 +1,234 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional, Union
+import multiprocessing
+import itertools
+import logging
+import shutil
+import time
+import os
+
+from services import mongo
+from services import spool
+from services import vocabulary
+
+logger = logging.getLogger(__name__)
+
+SWEEP_COLLECTION = "RankingModelSweep"
+SNAPSHOT_DATA_DIR = "data"
+SNAPSHOT_TRIALS_DIR = "trials"
+HYPERPARAMETERS = ("layer_sizes", "embedding_dimension", "ranking_weight",
+                   "retrieval_weight")
+
+
+class SweepTrial(BaseModel):
+  layer_sizes: List[int] = [32]
+  embedding_dimension: int = 32
+  ranking_weight: float = 1.0
+  retrieval_weight: float = 1.0
+
+
+class TrialResult(BaseModel):
+  index: int
+  trial: SweepTrial
+  results: Optional[Dict[str, float]] = None
+  seconds: float = 0.0
+  artifact_dir: Optional[str] = None
+  error: Optional[str] = None
+
+
+class SweepSnapshot(BaseModel):
+  data_dir: str
+  vocabulary_dir: str
+
+
+def expand_grid(grid: Dict[str, List[Any]]) -> List[SweepTrial]:
+  """Expands lists of hyperparameter values into every combination of them.
+
+    Args:
+        grid: A dictionary mapping NewsRankingModel hyperparameters to the
+          list of values to try, missing ones keep their default value.
+
+    Returns:
+        One trial per combination.
+
+    Raises:
+        ValueError: The grid contains an unknown hyperparameter.
+
+    """
+
+  unknown = set(grid) - set(HYPERPARAMETERS)
+  if unknown:
+    raise ValueError("Unknown hyperparameters: " + ", ".join(sorted(unknown)))
+  names = list(grid)
+  return [
+      SweepTrial(**dict(zip(names, values)))
+      for values in itertools.product(*(grid[name] for name in names))
+  ]
+
+
+def allocate_threads(trial_count: int,
+                     workers: int = None,
+                     threads_per_worker: int = None,
+                     cpu_count: int = None):
+  """Splits the cores of the host between the workers, so that the trials
+  running in parallel do not oversubscribe them.
+
+    Returns:
+        The amount of workers and of threads per worker.
+
+    """
+
+  cpu_count = cpu_count or os.cpu_count() or 1
+  if not workers:
+    workers = cpu_count // (threads_per_worker or 1)
+  workers = max(1, min(workers, trial_count, cpu_count))
+  if not threads_per_worker:
+    threads_per_worker = cpu_count // workers
+  return workers, max(1, threads_per_worker)
+
+
+def select_best(results: List[TrialResult]) -> Optional[TrialResult]:
+  # The lower the RMSE metric, the more accurate the model is at ranking
+  completed = [result for result in results if result.results]
+  if not completed:
+    return None
+  return min(completed,
+             key=lambda result: result.results["root_mean_squared_error"])
+
+
+def prepare_snapshot(data_entries: Union[str, List[dict]], directory: str,
+                     min_frequency: int = 1) -> SweepSnapshot:
+  """Writes the training data and its vocabularies once, for every worker to
+  read instead of rebuilding them.
+
+    Args:
+        data_entries: The training entries, or a spool directory of parquet
+          shards which is then shared as is.
+        directory: The directory of the snapshot.
+        min_frequency: The minimum frequency of the vocabulary values.
+
+    Returns:
+        The location of the training data and of the vocabularies.
+
+    """
+
+  if isinstance(data_entries, str):
+    data_dir = data_entries
+  else:
+    data_dir = os.path.join(directory, SNAPSHOT_DATA_DIR)
+    if os.path.isdir(data_dir):
+      shutil.rmtree(data_dir)
+    with spool.ParquetSpool(data_dir) as parquet_spool:
+      parquet_spool.write(data_entries)
+  vocabularies = vocabulary.build_vocabularies(spool.read_batches(data_dir),
+                                               min_frequency=min_frequency)
+  vocabularies.save(directory)
+  return SweepSnapshot(data_dir=data_dir, vocabulary_dir=directory)
+
+
+def limit_threads(threads: int):
+  # The thread pools of TensorFlow are sized when its runtime starts, so the
+  # limits are set in each worker before any trial runs.
+  os.environ["OMP_NUM_THREADS"] = str(threads)
+  import tensorflow as tf
+  tf.config.threading.set_intra_op_parallelism_threads(threads)
+  tf.config.threading.set_inter_op_parallelism_threads(min(threads, 2))
+
+
+def run_trial(snapshot: SweepSnapshot, index: int, trial: SweepTrial,
+              artifact_dir: str, threads: int) -> TrialResult:
+  # Imported here so that the grid and snapshot helpers work without
+  # TensorFlow
+  from services import ranking
+
+  start = time.perf_counter()
+  model, eval_dict = ranking.fit_ranking_model(
+      snapshot.data_dir,
+      vocabularies=vocabulary.Vocabularies.load(snapshot.vocabulary_dir),
+      threads=threads,
+      **trial.dict())
+  ranking.save_model_artifact(model, artifact_dir)
+  return TrialResult(index=index,
+                     trial=trial,
+                     results={
+                         name: float(value)
+                         for name, value in eval_dict.items()
+                     },
+                     seconds=time.perf_counter() - start,
+                     artifact_dir=artifact_dir)
+
+
+def run_sweep(data_entries: Union[str, List[dict]],
+              trials: List[SweepTrial],
+              directory: str,
+              workers: int = None,
+              threads_per_worker: int = None) -> List[TrialResult]:
+  """Trains every trial in parallel worker processes on one snapshot of the
+  training data.
+
+    Args:
+        data_entries: The training entries, or a spool directory.
+        trials: The hyperparameters of each trial.
+        directory: The working directory of the sweep, holding the snapshot
+          and the artifact of each trial.
+        workers: The amount of worker processes, by default as many as fit
+          the threads per worker on the cores of the host.
+        threads_per_worker: The amount of threads of each worker, by default
+          the cores of the host split evenly between the workers.
+
+    Returns:
+        The result of each trial, in the order of the trials.
+
+    """
+
+  workers, threads = allocate_threads(len(trials), workers,
+                                      threads_per_worker)
+  snapshot = prepare_snapshot(
+      data_entries,
+      directory,
+      min_frequency=int(os.getenv("TRAINING_VOCABULARY_MIN_FREQUENCY", "1")))
+  logger.info("Running " + str(len(trials)) + " trials on " + str(workers) +
+              " workers of " + str(threads) + " threads")
+  results = []
+  # Workers are spawned rather than forked, so that none of them inherits a
+  # TensorFlow runtime already started with other thread limits.
+  with ProcessPoolExecutor(max_workers=workers,
+                           mp_context=multiprocessing.get_context("spawn"),
+                           initializer=limit_threads,
+                           initargs=(threads,)) as executor:
+    futures = {
+        executor.submit(
+            run_trial, snapshot, index, trial,
+            os.path.join(directory, SNAPSHOT_TRIALS_DIR,
+                         "trial-" + format(index, "03d")), threads): index
+        for index, trial in enumerate(trials)
+    }
+    for future in as_completed(futures):
+      index = futures[future]
+      try:
+        result = future.result()
+        logger.info("Trial " + str(index) + " " + str(result.trial.dict()) +
+                    ": " + str(result.results))
+      except Exception as exception:
+        logger.exception("Trial " + str(index) + " failed")
+        result = TrialResult(index=index,
+                             trial=trials[index],
+                             error=repr(exception))
+      results.append(result)
+  return sorted(results, key=lambda result: result.index)
+
+
+def record_sweep(results: List[TrialResult],
+                 best: Optional[TrialResult] = None,
+                 model_version: str = None):
+  """Records the results of a sweep next to the RankingModel document."""
+
+  return mongo.add_or_update(
+      {
+          "ranking_model_id": "1",
+          "created_at": time.time(),
+          "trials": [result.dict(exclude={"artifact_dir"}) for result in results],
+          "best_trial": best.index if best else None,
+          "model_version": model_version,
+      }, SWEEP_COLLECTION)
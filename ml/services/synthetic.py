@@ -0,0 +1,168 @@
+from typing import Dict, List
+import numpy as np
+
+DEFAULT_START_TIME = 1_600_000_000.0
+DEFAULT_END_TIME = DEFAULT_START_TIME + 30 * 24 * 3600.0
+# The relevancy added by each type of feedback, as converted by the core service
+FEEDBACK_SCORES = np.array([1.0, 5.0, -5.0, -2.0, 0.0, 2.0, 5.0])
+FEEDBACK_PROBABILITIES = np.array([0.6, 0.05, 0.05, 0.05, 0.1, 0.1, 0.05])
+
+
+def long_tail_weights(count: int, exponent: float) -> np.ndarray:
+  """Zipf-like weights, the item of rank r being drawn proportionally to
+  1 / r^exponent.
+  """
+
+  weights = 1.0 / np.arange(1, count + 1)**exponent
+  return weights / weights.sum()
+
+
+def generate_stories(story_count: int,
+                     seed: int = 42,
+                     source_count: int = 50,
+                     author_count: int = 500,
+                     keyword_count: int = 2000,
+                     entity_count: int = 2000,
+                     popularity_exponent: float = 1.1) -> Dict[str, np.ndarray]:
+  """Generates the story features of RankingData rows, the stories being
+  ordered from the most to the least popular.
+
+    Args:
+        story_count: The amount of stories.
+        seed: The seed of the random generator.
+        source_count: The amount of distinct sources.
+        author_count: The amount of distinct authors.
+        keyword_count: The amount of distinct keywords.
+        entity_count: The amount of distinct entities.
+        popularity_exponent: The exponent of the long-tail distribution of
+          the reads between stories.
+
+    Returns:
+        A dictionary mapping each story feature to a numpy array.
+
+    """
+
+  rng = np.random.default_rng(seed)
+  popularity = long_tail_weights(story_count, popularity_exponent)
+  read_count = rng.poisson(popularity * story_count * 50)
+  source_ids = rng.integers(0, source_count, story_count)
+  return {
+      "story_id":
+          np.array(["story-" + str(i) for i in range(story_count)],
+                   dtype=object),
+      "story_title":
+          np.array(["Title of story " + str(i) for i in range(story_count)],
+                   dtype=object),
+      "source_alexa_rank":
+          (source_ids * 997 % 10_000).astype(np.int64),
+      "read_count":
+          read_count.astype(np.int64),
+      "shared_count":
+          rng.binomial(read_count, 0.02).astype(np.int64),
+      "angry_count":
+          rng.binomial(read_count, 0.01).astype(np.int64),
+      "cry_count":
+          rng.binomial(read_count, 0.01).astype(np.int64),
+      "neutral_count":
+          rng.binomial(read_count, 0.03).astype(np.int64),
+      "smile_count":
+          rng.binomial(read_count, 0.03).astype(np.int64),
+      "happy_count":
+          rng.binomial(read_count, 0.02).astype(np.int64),
+      "source_id":
+          np.array(["source-" + str(i) for i in source_ids], dtype=object),
+      "author_id":
+          np.array([
+              "author-" + str(i)
+              for i in rng.integers(0, author_count, story_count)
+          ],
+                   dtype=object),
+      "most_frequent_keyword":
+          np.array([
+              "keyword-" + str(i) for i in rng.choice(
+                  keyword_count, story_count, p=long_tail_weights(
+                      keyword_count, 1.0))
+          ],
+                   dtype=object),
+      "most_frequent_entity":
+          np.array([
+              "entity-" + str(i) for i in rng.choice(
+                  entity_count, story_count, p=long_tail_weights(
+                      entity_count, 1.0))
+          ],
+                   dtype=object),
+  }
+
+
+def generate_ranking_data(user_count: int,
+                          story_count: int,
+                          interactions_per_user: float = 20.0,
+                          popularity_exponent: float = 1.1,
+                          start_time: float = DEFAULT_START_TIME,
+                          end_time: float = DEFAULT_END_TIME,
+                          seed: int = 42) -> Dict[str, np.ndarray]:
+  """Generates RankingData rows following schemas/DataSet.yaml, with one row
+  per user and story pair like the core /training/{user_id} route.
+
+  The activity of the users is log-normal and the stories they interact with
+  are drawn from a long-tail distribution, so that a few users and stories
+  account for most of the interactions.
+
+    Args:
+        user_count: The amount of users.
+        story_count: The amount of stories.
+        interactions_per_user: The mean amount of interactions of a user.
+        popularity_exponent: The exponent of the long-tail distribution of
+          the interactions between stories.
+        start_time: The unix time of the oldest interaction.
+        end_time: The unix time of the most recent interaction.
+        seed: The seed of the random generator.
+
+    Returns:
+        A dictionary mapping each RankingData field to a numpy array.
+
+    """
+
+  rng = np.random.default_rng(seed)
+  stories = generate_stories(story_count,
+                             seed=seed,
+                             popularity_exponent=popularity_exponent)
+  sigma = 1.0
+  activity = rng.lognormal(
+      np.log(interactions_per_user) - sigma**2 / 2, sigma, user_count)
+  interaction_counts = np.maximum(1, np.round(activity)).astype(np.int64)
+  user_rows = np.repeat(np.arange(user_count), interaction_counts)
+  cumulative = np.cumsum(long_tail_weights(story_count, popularity_exponent))
+  story_rows = np.minimum(
+      np.searchsorted(cumulative, rng.random(user_rows.size)),
+      story_count - 1)
+  # A user interacting several times with a story is a single row
+  pairs = np.unique(user_rows * story_count + story_rows)
+  user_rows = pairs // story_count
+  story_rows = pairs % story_count
+  row_count = pairs.size
+
+  feedback_counts = rng.integers(1, 4, row_count)
+  relevancy_rate = np.zeros(row_count)
+  for feedback_number in range(feedback_counts.max()):
+    scores = rng.choice(FEEDBACK_SCORES, row_count, p=FEEDBACK_PROBABILITIES)
+    relevancy_rate += np.where(feedback_counts > feedback_number, scores, 0.0)
+
+  data = {
+      feature: values[story_rows] for feature, values in stories.items()
+  }
+  data["user_id"] = np.array(["user-" + str(i) for i in range(user_count)],
+                             dtype=object)[user_rows]
+  data["relevancy_rate"] = relevancy_rate
+  data["time_stamp"] = np.floor(rng.uniform(start_time, end_time, row_count))
+  return data
+
+
+def to_entries(columns: Dict[str, np.ndarray]) -> List[dict]:
+  """Converts columnar rows to RankingData dictionaries, as they are
+  received from the core service.
+  """
+
+  names = list(columns)
+  values = [columns[name].tolist() for name in names]
+  return [dict(zip(names, row)) for row in zip(*values)]
@@ -0,0 +1,154 @@
+from collections import Counter
+from pydantic import BaseModel
+from typing import Any, Dict, Iterable, Iterator, List
+import numpy as np
+import json
+import os
+
+VOCABULARY_FILE = "vocabularies.json"
+DEFAULT_TIMESTAMP_BUCKET_COUNT = 1000
+
+STRING_FEATURES = ("story_id", "story_title", "source_id", "author_id",
+                   "most_frequent_keyword", "most_frequent_entity")
+INT_FEATURES = ("source_alexa_rank", "read_count", "shared_count",
+                "angry_count", "cry_count", "neutral_count", "smile_count",
+                "happy_count")
+USER_FEATURES = ("user_id",)
+STORY_FEATURES = STRING_FEATURES + INT_FEATURES
+VOCABULARY_FEATURES = USER_FEATURES + STORY_FEATURES
+
+
+class Vocabularies(BaseModel):
+  vocabularies: Dict[str, List[Any]]
+  frequencies: Dict[str, List[int]]
+  timestamp_buckets: List[float]
+  timestamp_mean: float
+  timestamp_variance: float
+  row_count: int
+
+  def save(self, directory: str):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, VOCABULARY_FILE)
+    with open(path + ".tmp", "w") as vocabulary_file:
+      json.dump(self.dict(), vocabulary_file)
+    os.replace(path + ".tmp", path)
+
+  @classmethod
+  def load(cls, directory: str) -> "Vocabularies":
+    with open(os.path.join(directory, VOCABULARY_FILE)) as vocabulary_file:
+      return cls(**json.load(vocabulary_file))
+
+
+class StoryCorpus:
+  """Collects the story features of the first interaction with each story,
+  so that the retrieval candidates grow with the amount of stories rather
+  than with the amount of interactions.
+  """
+
+  def __init__(self):
+    self._story_ids = set()
+    self._columns = {feature: [] for feature in STORY_FEATURES}
+
+  def add(self, batch: Dict[str, np.ndarray]):
+    story_ids, first_rows = np.unique(batch["story_id"], return_index=True)
+    is_new = np.array(
+        [story_id not in self._story_ids for story_id in story_ids.tolist()],
+        dtype=bool)
+    if not is_new.any():
+      return
+    rows = first_rows[is_new]
+    self._story_ids.update(story_ids[is_new].tolist())
+    for feature in STORY_FEATURES:
+      self._columns[feature].append(batch[feature][rows])
+
+  def observe(
+      self, batches: Iterable[Dict[str, np.ndarray]]
+  ) -> Iterator[Dict[str, np.ndarray]]:
+    # Passes the batches through, so the corpus is collected during another
+    # pass over the data.
+    for batch in batches:
+      self.add(batch)
+      yield batch
+
+  def columns(self) -> Dict[str, np.ndarray]:
+    return {
+        feature: np.concatenate(chunks)
+        for feature, chunks in self._columns.items()
+    }
+
+  def __len__(self):
+    return len(self._story_ids)
+
+
+def _decode(token):
+  if isinstance(token, bytes):
+    return token.decode("utf-8")
+  return token
+
+
+def build_vocabularies(
+    batches: Iterable[Dict[str, np.ndarray]],
+    min_frequency: int = 1,
+    timestamp_bucket_count: int = DEFAULT_TIMESTAMP_BUCKET_COUNT
+) -> Vocabularies:
+  """Computes every lookup vocabulary along with the time_stamp statistics
+  in a single pass over the training data.
+
+    Args:
+        batches: The training data as columnar batches of numpy arrays.
+        min_frequency: The minimum amount of occurrences for a value to be
+          part of a vocabulary, rarer values fall in the OOV bucket.
+        timestamp_bucket_count: The amount of time_stamp bucket boundaries.
+
+    Returns:
+        The vocabularies, sorted, with the frequency of each of their values.
+
+    Raises:
+        ValueError: The batches did not contain any row.
+
+    """
+
+  counters = {feature: Counter() for feature in VOCABULARY_FEATURES}
+  row_count = 0
+  timestamp_mean = 0.0
+  timestamp_m2 = 0.0
+  timestamp_min = np.inf
+  timestamp_max = -np.inf
+  for batch in batches:
+    timestamps = np.asarray(batch["time_stamp"], dtype=np.float64)
+    if not timestamps.size:
+      continue
+    for feature in VOCABULARY_FEATURES:
+      values, counts = np.unique(batch[feature], return_counts=True)
+      counters[feature].update(dict(zip(values.tolist(), counts.tolist())))
+    # Combines the batch moments with the running ones (Chan et al.) which
+    # stays accurate for large epoch values unlike a sum of squares.
+    batch_count = timestamps.size
+    batch_mean = timestamps.mean()
+    delta = batch_mean - timestamp_mean
+    total_count = row_count + batch_count
+    timestamp_mean += delta * batch_count / total_count
+    timestamp_m2 += (((timestamps - batch_mean)**2).sum() +
+                     delta**2 * row_count * batch_count / total_count)
+    row_count = total_count
+    timestamp_min = min(timestamp_min, timestamps.min())
+    timestamp_max = max(timestamp_max, timestamps.max())
+  if not row_count:
+    raise ValueError("Can not build vocabularies without training data")
+
+  vocabularies = {}
+  frequencies = {}
+  for feature, counter in counters.items():
+    tokens = sorted(
+        token for token, count in counter.items() if count >= min_frequency)
+    vocabularies[feature] = [_decode(token) for token in tokens]
+    frequencies[feature] = [counter[token] for token in tokens]
+  return Vocabularies(vocabularies=vocabularies,
+                      frequencies=frequencies,
+                      timestamp_buckets=np.linspace(
+                          timestamp_min,
+                          timestamp_max,
+                          num=timestamp_bucket_count).tolist(),
+                      timestamp_mean=timestamp_mean,
+                      timestamp_variance=timestamp_m2 / row_count,
+                      row_count=row_count)
@@ -0,0 +1,62 @@
+"""Trains several NewsRankingModel configurations in parallel and promotes
+the best one.
+
+The grid is a JSON file mapping hyperparameters to the values to try:
+    {"layer_sizes": [[32], [64, 32]], "embedding_dimension": [32, 64]}
+"""
+import argparse
+import json
+import logging
+import os
+from dotenv import load_dotenv
+from services import ranking
+from services import sweep
+import training
+
+logger = logging.getLogger(__name__)
+
+
+def run(grid_file, directory, workers=None, threads_per_worker=None):
+  with open(grid_file) as grid:
+    trials = sweep.expand_grid(json.load(grid))
+  data_entries = training.get_training_data()
+  if not data_entries:
+    return
+  results = sweep.run_sweep(data_entries,
+                            trials,
+                            directory,
+                            workers=workers,
+                            threads_per_worker=threads_per_worker)
+  best = sweep.select_best(results)
+  model_version = None
+  if best:
+    # The best trial still has to beat the saved model to be promoted
+    if ranking.promote_ranking_model(best.artifact_dir, best.results):
+      model_version = ranking.SavedRankingModel(best.artifact_dir).version
+      logger.info("Promoted trial " + str(best.index) + " with RMSE score: " +
+                  str(best.results["root_mean_squared_error"]))
+    else:
+      logger.info("Trial " + str(best.index) +
+                  " did not improve on the saved model")
+  else:
+    logger.error("Every trial failed")
+  sweep.record_sweep(results, best, model_version)
+
+
+if __name__ == "__main__":
+  load_dotenv()
+  logging.basicConfig(level=logging.INFO)
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("grid", help="JSON file of the hyperparameter grid")
+  parser.add_argument("--directory",
+                      default=os.getenv("TRAINING_SWEEP_DIR", "sweep"),
+                      help="Working directory of the snapshot and trials")
+  parser.add_argument("--workers",
+                      type=int,
+                      default=int(os.getenv("TRAINING_SWEEP_WORKERS", "0")))
+  parser.add_argument("--threads-per-worker",
+                      type=int,
+                      default=int(
+                          os.getenv("TRAINING_SWEEP_THREADS_PER_WORKER", "0")))
+  args = parser.parse_args()
+  run(args.grid, args.directory, args.workers, args.threads_per_worker)
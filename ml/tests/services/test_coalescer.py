@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from services import coalescer
+
+
+class Index:
+
+  def __init__(self):
+    self.queries = []
+
+  def __call__(self, index, user_ids, k):
+    self.queries.append(list(user_ids))
+    return [[user_id + "-" + str(story) for story in range(k)]
+            for user_id in user_ids]
+
+
+def submit_concurrently(request_coalescer, user_ids, k=2):
+  results = {}
+
+  def submit(user_id):
+    results[user_id] = request_coalescer.submit("en", "index", user_id, k)
+
+  threads = [threading.Thread(target=submit, args=(user_id,))
+             for user_id in user_ids]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return results
+
+
+def test_concurrent_requests_share_one_query():
+  index = Index()
+  request_coalescer = coalescer.RequestCoalescer(index, 5, 4)
+
+  results = submit_concurrently(request_coalescer,
+                                ["user-1", "user-2", "user-3", "user-4"])
+
+  assert len(index.queries) == 1
+  assert sorted(index.queries[0]) == ["user-1", "user-2", "user-3", "user-4"]
+  assert results["user-3"] == ["user-3-0", "user-3-1"]
+  assert request_coalescer.batches == 1
+
+
+def test_a_batch_is_queried_at_the_end_of_the_window():
+  index = Index()
+  request_coalescer = coalescer.RequestCoalescer(index, 0.01, 100)
+
+  assert request_coalescer.submit("en", "index", "user-1", 1) == ["user-1-0"]
+  assert index.queries == [["user-1"]]
+
+
+def test_full_batches_start_a_new_batch():
+  index = Index()
+  request_coalescer = coalescer.RequestCoalescer(index, 5, 2)
+
+  results = submit_concurrently(request_coalescer,
+                                ["user-" + str(i) for i in range(4)])
+
+  assert sorted(len(query) for query in index.queries) == [2, 2]
+  assert results["user-2"] == ["user-2-0", "user-2-1"]
+
+
+def test_duplicated_users_are_queried_once():
+  index = Index()
+  request_coalescer = coalescer.RequestCoalescer(index, 5, 3)
+
+  submit_concurrently(request_coalescer, ["user-1"] * 3)
+
+  assert index.queries == [["user-1"]]
+
+
+def test_no_window_queries_each_request():
+  index = Index()
+  request_coalescer = coalescer.RequestCoalescer(index, 0, 64)
+
+  request_coalescer.submit("en", "index", "user-1", 1)
+  request_coalescer.submit("en", "index", "user-2", 1)
+
+  assert index.queries == [["user-1"], ["user-2"]]
+
+
+def test_errors_are_raised_to_every_request():
+
+  def failing_query(index, user_ids, k):
+    raise ValueError("Index query failed")
+
+  request_coalescer = coalescer.RequestCoalescer(failing_query, 0.01, 64)
+
+  with pytest.raises(ValueError):
+    request_coalescer.submit("en", "index", "user-1", 1)
@@ -0,0 +1,82 @@
+import numpy as np
+
+from services import embedding_cache
+
+
+class Embedder:
+
+  def __init__(self):
+    self.calls = []
+
+  def __call__(self, story_ids):
+    self.calls.append(list(story_ids))
+    return np.array([[float(story_id.split("-")[1]), 1.0]
+                     for story_id in story_ids])
+
+
+def expected(story_ids):
+  return Embedder()(story_ids).astype(np.float32)
+
+
+def test_only_new_stories_are_embedded(tmp_path):
+  embed = Embedder()
+  cache = embedding_cache.StoryEmbeddingCache("en", "1", str(tmp_path))
+  first = ["story-1", "story-2", "story-3"]
+  embeddings, update = cache.update(first, embed)
+  assert update == embedding_cache.CacheUpdate(embedded=3, reused=0, dropped=0)
+  np.testing.assert_array_equal(embeddings, expected(first))
+
+  second = ["story-4", "story-2", "story-3", "story-5"]
+  embeddings, update = cache.update(second, embed)
+
+  assert embed.calls[-1] == ["story-4", "story-5"]
+  assert update == embedding_cache.CacheUpdate(embedded=2, reused=2, dropped=1)
+  np.testing.assert_array_equal(embeddings, expected(second))
+
+
+def test_unchanged_stories_are_not_embedded(tmp_path):
+  embed = Embedder()
+  story_ids = ["story-1", "story-2"]
+  embedding_cache.StoryEmbeddingCache("en", "1",
+                                      str(tmp_path)).update(story_ids, embed)
+
+  embeddings, update = embedding_cache.StoryEmbeddingCache(
+      "en", "1", str(tmp_path)).update(story_ids, embed)
+
+  assert len(embed.calls) == 1
+  assert update.reused == 2
+  np.testing.assert_array_equal(embeddings, expected(story_ids))
+
+
+def test_dropped_stories_are_removed_from_the_cache(tmp_path):
+  cache = embedding_cache.StoryEmbeddingCache("en", "1", str(tmp_path))
+  cache.update(["story-1", "story-2"], Embedder())
+  cache.update(["story-2"], Embedder())
+
+  story_ids, embeddings = cache.load()
+
+  assert story_ids.tolist() == ["story-2"]
+  assert embeddings.shape == (1, 2)
+
+
+def test_a_new_model_version_embeds_every_story(tmp_path):
+  embedding_cache.StoryEmbeddingCache("en", "1", str(tmp_path)).update(
+      ["story-1", "story-2"], Embedder())
+  embed = Embedder()
+
+  _, update = embedding_cache.StoryEmbeddingCache(
+      "en", "2", str(tmp_path)).update(["story-1", "story-2"], embed)
+
+  assert update.embedded == 2
+  assert embed.calls == [["story-1", "story-2"]]
+  assert sorted(p.name for p in (tmp_path / "en").iterdir()) == ["2"]
+
+
+def test_languages_are_cached_separately(tmp_path):
+  embedding_cache.StoryEmbeddingCache("en", "1", str(tmp_path)).update(
+      ["story-1"], Embedder())
+
+  _, update = embedding_cache.StoryEmbeddingCache(
+      "fr", "1", str(tmp_path)).update(["story-1"], Embedder())
+
+  assert update.embedded == 1
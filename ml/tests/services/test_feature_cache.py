@@ -0,0 +1,95 @@
+from services import feature_cache
+from services import spool
+
+
+def mock_entry(user_id: str, story_id: str, time_stamp: float) -> dict:
+  return {
+      "story_id": story_id,
+      "user_id": user_id,
+      "relevancy_rate": 1.0,
+      "time_stamp": time_stamp,
+  }
+
+
+def test_merge_replaces_entries_and_moves_watermark(tmp_path):
+  cache = feature_cache.FeatureCache(str(tmp_path), bucket_count=4)
+  cache.merge([mock_entry("1", "a", 10.0), mock_entry("1", "b", 20.0)])
+  updated = mock_entry("1", "a", 30.0)
+  updated["relevancy_rate"] = 5.0
+
+  cache.merge([updated])
+
+  assert cache.row_count() == 2
+  assert cache.watermarks == {"1": 30.0}
+  rows = {
+      story_id: rate for batch in spool.read_batches(str(tmp_path))
+      for story_id, rate in zip(batch["story_id"], batch["relevancy_rate"])
+  }
+  assert rows == {"a": 5.0, "b": 1.0}
+
+
+def test_watermarks_are_persisted(tmp_path):
+  feature_cache.FeatureCache(str(tmp_path)).merge([mock_entry("1", "a", 10.0)])
+
+  assert feature_cache.FeatureCache(str(tmp_path)).watermarks == {"1": 10.0}
+
+
+def test_merge_nothing_rewrites_no_bucket(tmp_path):
+  cache = feature_cache.FeatureCache(str(tmp_path))
+
+  assert cache.merge([]) == 0
+
+
+def test_prune_removes_missing_users(tmp_path):
+  cache = feature_cache.FeatureCache(str(tmp_path), bucket_count=1)
+  cache.merge([mock_entry("1", "a", 10.0), mock_entry("2", "a", 10.0)])
+
+  assert cache.prune(["2"]) == 1
+  assert cache.row_count() == 1
+  assert cache.watermarks == {"2": 10.0}
+
+
+def test_refresh_stories_replaces_the_counts_of_the_cached_stories(tmp_path):
+  cache = feature_cache.FeatureCache(str(tmp_path), bucket_count=4)
+  entries = [mock_entry(user_id, "a", 10.0) for user_id in "123"]
+  entries.append(mock_entry("1", "b", 10.0))
+  for entry in entries:
+    entry["read_count"] = 1
+  cache.merge(entries)
+
+  rewritten = cache.refresh_stories([{
+      "story_id": "a",
+      "read_count": 7,
+      "happy_count": 2
+  }, {
+      "story_id": "unknown",
+      "read_count": 3
+  }])
+
+  assert 1 <= rewritten <= 3
+  rows = {(user_id, story_id): (read_count, happy_count)
+          for batch in spool.read_batches(str(tmp_path))
+          for user_id, story_id, read_count, happy_count in zip(
+              batch["user_id"], batch["story_id"], batch["read_count"],
+              batch["happy_count"])}
+  assert rows == {
+      ("1", "a"): (7, 2),
+      ("2", "a"): (7, 2),
+      ("3", "a"): (7, 2),
+      ("1", "b"): (1, 0),
+  }
+  assert cache.refresh_stories([]) == 0
+
+
+def test_changes_since_the_most_recent_entry(tmp_path):
+  cache = feature_cache.FeatureCache(str(tmp_path))
+
+  assert cache.changes_since(5.0) is None
+  cache.merge([mock_entry("1", "a", 10.0), mock_entry("2", "a", 30.0)])
+  assert cache.changes_since(5.0) == 25.0
+
+
+def test_pending_users_are_persisted(tmp_path):
+  feature_cache.FeatureCache(str(tmp_path)).set_pending(["2", "1"])
+
+  assert feature_cache.FeatureCache(str(tmp_path)).pending_user_ids == ["1", "2"]
@@ -0,0 +1,92 @@
+from pytest_mock import MockerFixture
+import pytest
+
+from services import fetcher
+
+
+@pytest.fixture(autouse=True)  #before each
+def run_around_tests(mocker: MockerFixture):
+  mocker.patch.dict("os.environ", {"CORE_URL": "http://127.0.0.1:5057"})
+  yield
+
+
+def test_fetch_user_features(requests_mock):
+  requests_mock.get("http://127.0.0.1:5057/training/1",
+                    json=[{"story_id": "a", "user_id": "1"}])
+  session = fetcher.build_session()
+
+  assert fetcher.fetch_user_features(session, "1") == [{
+      "story_id": "a",
+      "user_id": "1"
+  }]
+
+
+def test_fetch_user_features_not_found(requests_mock):
+  requests_mock.get("http://127.0.0.1:5057/training/1", status_code=404)
+  session = fetcher.build_session()
+
+  assert fetcher.fetch_user_features(session, "1") == []
+
+
+def test_fetch_training_data(requests_mock):
+  requests_mock.get("http://127.0.0.1:5057/training/1",
+                    json=[{"story_id": "a"}, {"story_id": "b"}])
+  requests_mock.get("http://127.0.0.1:5057/training/2",
+                    json=[{"story_id": "c"}])
+  requests_mock.get("http://127.0.0.1:5057/training/3", status_code=500)
+
+  entries, report = fetcher.fetch_training_data(["1", "2", "3"],
+                                                workers=2,
+                                                retries=0)
+
+  assert sorted(e["story_id"] for e in entries) == ["a", "b", "c"]
+  assert report.user_count == 2
+  assert report.entry_count == 3
+  assert report.failed_user_ids == ["3"]
+
+
+def test_fetch_training_data_sink(requests_mock):
+  requests_mock.get("http://127.0.0.1:5057/training/1",
+                    json=[{"story_id": "a"}])
+  received = []
+
+  entries, report = fetcher.fetch_training_data(["1"], sink=received.extend)
+
+  assert entries == []
+  assert received == [{"story_id": "a"}]
+  assert report.users_per_second > 0
+
+
+def test_fetch_training_data_since(requests_mock):
+  requests_mock.get("http://127.0.0.1:5057/training/1?since=10.0",
+                    json=[{"story_id": "b"}])
+  requests_mock.get("http://127.0.0.1:5057/training/2",
+                    json=[{"story_id": "c"}])
+
+  entries, _ = fetcher.fetch_training_data(["1", "2"], since={"1": 10.0})
+
+  assert sorted(e["story_id"] for e in entries) == ["b", "c"]
+  queries = {r.path: r.qs for r in requests_mock.request_history}
+  assert queries == {"/training/1": {"since": ["10.0"]}, "/training/2": {}}
+
+
+def test_fetch_training_changes(requests_mock):
+  requests_mock.get("http://127.0.0.1:5057/training/changes?since=10.0",
+                    json={
+                        "user_ids": ["1"],
+                        "stories": [{
+                            "story_id": "a",
+                            "read_count": 3
+                        }]
+                    })
+
+  changes = fetcher.fetch_training_changes(10.0)
+
+  assert changes.user_ids == ["1"]
+  assert changes.stories == [{"story_id": "a", "read_count": 3}]
+
+
+def test_fetch_training_changes_of_an_older_core(requests_mock):
+  requests_mock.get("http://127.0.0.1:5057/training/changes", status_code=404)
+
+  assert fetcher.fetch_training_changes(10.0, retries=0) is None
@@ -0,0 +1,113 @@
+import numpy as np
+
+from services import filtering
+
+RECENT_STORIES = [
+    {"story_id": "story-0", "source_id": "source-a", "time_stamp": 100.0,
+     "read_count": 1},
+    {"story_id": "story-1", "source_id": "source-b", "time_stamp": 200.0,
+     "read_count": 5},
+    {"story_id": "story-2", "source_id": "source-a", "time_stamp": 300.0,
+     "read_count": 3},
+    {"story_id": "story-3", "source_id": "source-c", "time_stamp": None,
+     "read_count": 4},
+    {"story_id": "story-4", "source_id": "source-b", "time_stamp": 500.0,
+     "read_count": 2},
+]
+STORY_IDS = ["story-" + str(row) for row in range(5)]
+
+
+def metadata():
+  return filtering.StoryMetadata.from_stories(STORY_IDS, RECENT_STORIES)
+
+
+def allowed_story_ids(story_filter):
+  return np.asarray(STORY_IDS)[metadata().allowed(story_filter)].tolist()
+
+
+def test_find_sorted_in_an_empty_array():
+  _, found = filtering.find_sorted(np.array([], dtype=str), ["user-1"])
+
+  assert found.tolist() == [False]
+
+
+def test_an_empty_filter_allows_every_story():
+  assert filtering.StoryFilter().is_empty()
+  assert allowed_story_ids(filtering.StoryFilter()) == STORY_IDS
+
+
+def test_stories_are_filtered_by_source():
+  story_filter = filtering.StoryFilter(source_ids=["source-b", "source-z"])
+
+  assert allowed_story_ids(story_filter) == ["story-1", "story-4"]
+
+
+def test_stories_without_a_publication_time_pass_the_time_filter():
+  story_filter = filtering.StoryFilter(published_after=250.0)
+
+  assert allowed_story_ids(story_filter) == ["story-2", "story-3", "story-4"]
+
+
+def test_excluded_stories_are_filtered_out():
+  story_filter = filtering.StoryFilter(
+      exclude_story_ids=["story-1", "story-3", "story-unknown"])
+
+  assert allowed_story_ids(story_filter) == ["story-0", "story-2", "story-4"]
+
+
+def test_the_metadata_is_saved_and_loaded(tmp_path):
+  metadata().save(str(tmp_path))
+
+  loaded = filtering.StoryMetadata.load(str(tmp_path))
+  story_filter = filtering.StoryFilter(source_ids=["source-a"],
+                                       exclude_story_ids=["story-0"])
+  assert np.asarray(STORY_IDS)[loaded.allowed(story_filter)].tolist() == [
+      "story-2"
+  ]
+  assert filtering.StoryMetadata.load(str(tmp_path / "missing")) is None
+
+
+def test_the_popular_stories_are_filtered():
+  stories = metadata()
+  allowed = stories.allowed(
+      filtering.StoryFilter(exclude_story_ids=["story-1"]))
+
+  assert stories.popular(allowed, 2) == ["story-3", "story-2"]
+  assert stories.popular(allowed, 2, exclude=["story-3"]) == [
+      "story-2", "story-4"
+  ]
+
+
+def test_overfetch_queries_again_the_users_short_of_stories():
+  stories = metadata()
+  allowed = stories.allowed(filtering.StoryFilter(source_ids=["source-b"]))
+  fetches = []
+
+  def query(user_ids, k):
+    fetches.append((user_ids, k))
+    # Ranks the stories by row, padded like ScaNN with empty ids
+    return [(STORY_IDS + ["", ""])[:k] for _ in user_ids]
+
+  results = filtering.overfetch(query, stories, ["user-1", "user-2"], 1,
+                                allowed, 1000)
+
+  assert results == [["story-1"], ["story-1"]]
+  assert fetches == [(["user-1", "user-2"], 4)]
+
+  results = filtering.overfetch(query, stories, ["user-1"], 2, allowed, 1000)
+
+  assert results == [["story-1", "story-4"]]
+  assert fetches[1:] == [(["user-1"], 5)]
+
+
+def test_overfetch_pads_with_the_popular_allowed_stories():
+  stories = metadata()
+  allowed = stories.allowed(filtering.StoryFilter(source_ids=["source-a"]))
+
+  def query(user_ids, k):
+    # An approximate index which misses story-2 and repeats story-1
+    return [["story-1", "story-1", "story-0"][:k] for _ in user_ids]
+
+  results = filtering.overfetch(query, stories, ["user-1"], 2, allowed, 3)
+
+  assert results == [["story-0", "story-2"]]
@@ -0,0 +1,114 @@
+import threading
+
+from services import index_refresher
+
+
+def build_index(model, language):
+  if language == "fr":
+    raise ValueError("Update Index call failed")
+  return model + "-" + language
+
+
+def test_refresh_swaps_built_indexes_and_keeps_failed_ones():
+  indexes = {"en": "old-en", "fr": "old-fr"}
+  swapped_languages = []
+  refresher = index_refresher.IndexRefresher(indexes, ("en", "fr"),
+                                             lambda: "model",
+                                             build_index,
+                                             on_swap=swapped_languages.append)
+
+  assert refresher.refresh() == {"en": True, "fr": False}
+
+  assert indexes == {"en": "model-en", "fr": "old-fr"}
+  assert swapped_languages == ["en"]
+  assert refresher.statuses["en"].built_at
+  assert refresher.statuses["en"].last_error is None
+  assert refresher.statuses["fr"].built_at is None
+  assert refresher.statuses["fr"].last_error == "Update Index call failed"
+
+
+def test_refresh_keeps_indexes_without_a_model():
+  indexes = {"en": "old-en"}
+  refresher = index_refresher.IndexRefresher(indexes, ("en",), lambda: None,
+                                             build_index)
+
+  assert refresher.refresh() == {"en": False}
+
+  assert indexes == {"en": "old-en"}
+  assert refresher.statuses["en"].last_error
+
+
+def test_refresh_skips_when_a_refresh_is_running():
+  building = threading.Event()
+  release = threading.Event()
+
+  def slow_build(model, language):
+    building.set()
+    release.wait()
+    return model
+
+  refresher = index_refresher.IndexRefresher({}, ("en",), lambda: "model",
+                                             slow_build)
+  assert refresher.trigger()
+  building.wait()
+
+  assert not refresher.trigger()
+  assert refresher.refresh() == {}
+  release.set()
+
+
+def test_scheduled_refreshes():
+  refreshed = threading.Event()
+  indexes = {}
+
+  def load_model():
+    refreshed.set()
+    return "model"
+
+  refresher = index_refresher.IndexRefresher(indexes, ("en",),
+                                             load_model,
+                                             build_index,
+                                             interval_seconds=0.01)
+  refresher.start()
+  assert refreshed.wait(5)
+  refresher.stop()
+
+  assert indexes["en"] == "model-en"
+
+
+def test_languages_are_built_concurrently_and_swapped_independently():
+  fr_swapped = threading.Event()
+  swapped_languages = []
+
+  def build(model, language):
+    # en can only finish once fr was swapped in
+    if language == "en" and not fr_swapped.wait(5):
+      raise TimeoutError("fr was not built concurrently")
+    return model + "-" + language
+
+  def on_swap(language):
+    swapped_languages.append(language)
+    if language == "fr":
+      fr_swapped.set()
+
+  indexes = {}
+  refresher = index_refresher.IndexRefresher(indexes, ("en", "fr"),
+                                             lambda: "model",
+                                             build,
+                                             on_swap=on_swap)
+
+  assert refresher.refresh() == {"en": True, "fr": True}
+
+  assert swapped_languages == ["fr", "en"]
+  assert indexes == {"en": "model-en", "fr": "model-fr"}
+
+
+def test_builds_can_be_limited_to_one_language_at_a_time():
+  indexes = {}
+  refresher = index_refresher.IndexRefresher(indexes, ("en", "fr", "de"),
+                                             lambda: "model",
+                                             build_index,
+                                             build_workers=1)
+
+  assert refresher.refresh() == {"en": True, "fr": False, "de": True}
+  assert indexes == {"en": "model-en", "de": "model-de"}
@@ -0,0 +1,157 @@
+import numpy as np
+
+from services import index_tuning
+
+
+def embeddings(count, seed):
+  return np.random.default_rng(seed).normal(size=(count, 8)).astype(np.float32)
+
+
+def test_small_corpora_are_served_exactly(monkeypatch):
+  monkeypatch.setattr(index_tuning, "EXACT_MAX_STORIES", 1000)
+
+  assert index_tuning.candidate_configs(1000) == [
+      index_tuning.IndexConfig(index_type=index_tuning.BRUTE_FORCE)
+  ]
+
+
+def test_large_corpora_get_scann_candidates(monkeypatch):
+  monkeypatch.setattr(index_tuning, "EXACT_MAX_STORIES", 1000)
+
+  configs = index_tuning.candidate_configs(40000, min_results=500)
+
+  assert configs[0].index_type == index_tuning.BRUTE_FORCE
+  scann_configs = configs[1:]
+  assert len(scann_configs) == 12
+  assert {config.num_leaves for config in scann_configs} == {200, 400}
+  assert {config.num_reordering_candidates for config in scann_configs
+         } == {500, 1000}
+  assert all(1 <= config.num_leaves_to_search < config.num_leaves
+             for config in scann_configs)
+
+
+def test_max_results_of_the_indexes():
+  assert index_tuning.IndexConfig(
+      index_type=index_tuning.BRUTE_FORCE).max_results(5000) == 5000
+  assert index_tuning.DEFAULT_SCANN_CONFIG.max_results(5000) == 1000
+  assert index_tuning.DEFAULT_SCANN_CONFIG.max_results(50) == 50
+
+
+def test_recall_at_k():
+  assert index_tuning.recall_at_k([["a", "b"], ["c", "x"]],
+                                  [["b", "a"], ["c", "d"]]) == 0.75
+
+
+def test_select_prefers_the_fastest_configuration_reaching_the_target():
+
+  def result(leaves, recall, seconds):
+    return index_tuning.TuningResult(config=index_tuning.IndexConfig(
+        index_type=index_tuning.SCANN, num_leaves=leaves),
+                                     recall=recall,
+                                     query_seconds=seconds)
+
+  results = [result(1, 1.0, 0.003), result(2, 0.96, 0.001), result(3, 0.9,
+                                                                     0.0005)]
+
+  assert index_tuning.select(results, 0.95).config.num_leaves == 2
+  assert index_tuning.select(results, 0.99).config.num_leaves == 1
+  assert index_tuning.select(results[1:], 0.99).config.num_leaves == 2
+
+
+def test_tune_measures_every_candidate_against_the_exact_top_k(monkeypatch):
+  monkeypatch.setattr(index_tuning, "EXACT_MAX_STORIES", 100)
+  story_embeddings = embeddings(400, 0)
+  story_ids = ["story-" + str(row) for row in range(400)]
+  queries = embeddings(20, 1)
+  built = []
+
+  def build(config):
+    built.append(config)
+
+    def query(query_embeddings, k):
+      results = index_tuning.exact_top_k(query_embeddings, story_embeddings,
+                                         story_ids, k)
+      if config.index_type == index_tuning.SCANN:
+        # An approximate index missing the best story of every user
+        return [row[1:] + ["story-unknown"] for row in results]
+      return results
+
+    return query
+
+  selected, results = index_tuning.tune(build,
+                                        queries,
+                                        story_embeddings,
+                                        story_ids,
+                                        k=10,
+                                        target_recall=0.95)
+
+  assert built == index_tuning.candidate_configs(400, 10)
+  assert selected.config.index_type == index_tuning.BRUTE_FORCE
+  assert selected.recall == 1.0
+  assert all(result.recall == 0.9 for result in results[1:])
+  assert all(result.query_seconds > 0 for result in results)
+
+
+def test_tune_skips_the_measures_of_small_corpora(monkeypatch):
+  monkeypatch.setattr(index_tuning, "EXACT_MAX_STORIES", 1000)
+
+  def build(config):
+    raise AssertionError("No index should be built")
+
+  story_ids = ["story-" + str(row) for row in range(50)]
+  selected, results = index_tuning.tune(build, embeddings(5, 0),
+                                        embeddings(50, 1), story_ids)
+
+  assert selected.config.index_type == index_tuning.BRUTE_FORCE
+  assert results == [selected]
+
+
+def test_sample_users_skips_the_oov_row():
+  user_embeddings = np.arange(11, dtype=np.float32).reshape(11, 1)
+
+  assert sorted(index_tuning.sample_users(user_embeddings, 20)[:, 0]) == list(
+      range(1, 11))
+  sample = index_tuning.sample_users(user_embeddings, 4)
+  assert len(sample) == 4 and 0 not in sample[:, 0]
+
+
+def saved_tuning(story_count, model_version="1", k=20):
+  return index_tuning.SavedTuning(
+      model_version=model_version,
+      story_count=story_count,
+      k=k,
+      result=index_tuning.TuningResult(
+          config=index_tuning.DEFAULT_SCANN_CONFIG, recall=0.97,
+          query_seconds=0.001))
+
+
+def test_the_tuning_is_saved_and_loaded(tmp_path):
+  path = str(tmp_path / "tuning" / "en.json")
+
+  assert index_tuning.load_tuning(path) is None
+  index_tuning.save_tuning(path, saved_tuning(20000))
+
+  assert index_tuning.load_tuning(path) == saved_tuning(20000)
+  (tmp_path / "tuning" / "en.json").write_text("{")
+  assert index_tuning.load_tuning(path) is None
+
+
+def test_the_tuning_is_reused_while_the_story_count_is_close(monkeypatch):
+  monkeypatch.setattr(index_tuning, "EXACT_MAX_STORIES", 1000)
+  monkeypatch.setattr(index_tuning, "RETUNING_STORY_COUNT_CHANGE", 0.5)
+  tuning = saved_tuning(20000)
+
+  assert not index_tuning.is_stale(tuning, "1", 20000, k=20)
+  assert not index_tuning.is_stale(tuning, "1", 29000, k=20)
+  assert not index_tuning.is_stale(tuning, "1", 11000, k=20)
+  assert index_tuning.is_stale(tuning, "1", 31000, k=20)
+  assert index_tuning.is_stale(tuning, "1", 9000, k=20)
+
+
+def test_the_tuning_is_stale_for_another_model_k_or_index_type(monkeypatch):
+  monkeypatch.setattr(index_tuning, "EXACT_MAX_STORIES", 1000)
+
+  assert index_tuning.is_stale(None, "1", 20000, k=20)
+  assert index_tuning.is_stale(saved_tuning(20000), "2", 20000, k=20)
+  assert index_tuning.is_stale(saved_tuning(20000), "1", 20000, k=200)
+  assert index_tuning.is_stale(saved_tuning(1000), "1", 1001, k=20)
@@ -0,0 +1,37 @@
+import os
+
+from services import memory
+
+
+def test_process_memory_of_the_current_process():
+  process_memory = memory.process_memory()
+
+  assert process_memory.pid == os.getpid()
+  assert process_memory.rss_bytes > 0
+  assert process_memory.shared_bytes <= process_memory.rss_bytes
+
+
+def test_process_memory_without_smaps_rollup(mocker):
+  statm = "1000 200 50 1 0 100 0"
+  real_open = open
+
+  def fake_open(path, *args, **kwargs):
+    if path.endswith("smaps_rollup"):
+      raise FileNotFoundError(path)
+    if path.endswith("statm"):
+      return mocker.mock_open(read_data=statm)()
+    return real_open(path, *args, **kwargs)
+
+  mocker.patch("builtins.open", side_effect=fake_open)
+
+  process_memory = memory.process_memory(1234)
+
+  assert process_memory.rss_bytes == 200 * memory.PAGE_SIZE
+  assert process_memory.shared_bytes == 50 * memory.PAGE_SIZE
+  assert process_memory.pss_bytes is None
+
+
+def test_workers_memory_outside_gunicorn():
+  workers = memory.workers_memory()
+
+  assert [worker.pid for worker in workers] == [os.getpid()]
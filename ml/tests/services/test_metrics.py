@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+import subprocess
+import sys
+import os
+
+from prometheus_client import CollectorRegistry
+import prometheus_client
+
+from services import metrics
+from services import serving
+
+WORKER = """
+from prometheus_client import Gauge, Histogram
+requests = Histogram("request_seconds", "Latency", ("route",),
+                     buckets=(0.1, 1.0))
+in_flight = Gauge("in_flight", "Requests in flight",
+                  multiprocess_mode="livesum")
+requests.labels(route="/a").observe(0.05)
+requests.labels(route="/a").observe(0.5)
+in_flight.inc()
+"""
+
+
+def run_worker(directory):
+  environment = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+  subprocess.run([sys.executable, "-c", WORKER], env=environment, check=True)
+
+
+def test_the_metrics_of_every_worker_are_aggregated(tmp_path):
+  for _ in range(2):
+    run_worker(str(tmp_path))
+
+  lines = metrics.render(str(tmp_path)).decode().splitlines()
+
+  assert 'request_seconds_bucket{le="0.1",route="/a"} 2.0' in lines
+  assert 'request_seconds_bucket{le="+Inf",route="/a"} 4.0' in lines
+  assert 'request_seconds_count{route="/a"} 4.0' in lines
+  assert "in_flight 2.0" in lines
+
+
+class StubBackend:
+  name = "stub"
+
+  def load_model(self, load_seconds=None):
+    return SimpleNamespace(load_seconds=load_seconds)
+
+  def build_index(self, model, language):
+    return SimpleNamespace(artifact=SimpleNamespace(
+        language=language, story_count=3, recall=0.97))
+
+  def query(self, index, user_ids, k):
+    return [[] for _ in user_ids]
+
+
+def test_metered_backend_records_the_builds_and_queries():
+  registry = CollectorRegistry()
+  backend = serving.MeteredBackend(StubBackend(), registry)
+
+  index = backend.build_index(None, "en")
+  backend.query(index, ["1", "2"], 10)
+
+  lines = prometheus_client.generate_latest(registry).decode().splitlines()
+  assert 'ranking_index_stories{language="en"} 3.0' in lines
+  assert 'ranking_index_recall{language="en"} 0.97' in lines
+  assert 'ranking_index_build_seconds_count{language="en"} 1.0' in lines
+  assert 'ranking_index_query_users_bucket{language="en",le="2.0"} 1.0' in lines
+  assert 'ranking_index_query_seconds_count{language="en"} 1.0' in lines
+
+
+def test_metered_backend_times_the_model_load_of_the_index_builds():
+  registry = CollectorRegistry()
+  backend = serving.MeteredBackend(StubBackend(), registry)
+
+  model = backend.load_model()
+
+  assert model.load_seconds is backend.model_load_seconds
+  assert registry.get_sample_value("ranking_model_load_seconds_count") == 0
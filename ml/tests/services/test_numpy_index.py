@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+
+from services import filtering
+from services import numpy_index
+from services import serving
+
+
+def export(directory, model_version="20240101000000", version="1", built_at=None,
+           story_count=50, with_stories=True):
+  rng = np.random.default_rng(0)
+  user_ids = ["user-" + str(i) for i in range(10)]
+  user_embeddings = rng.normal(size=(len(user_ids) + 1, 4))
+  story_ids = ["story-" + str(i) for i in range(story_count)]
+  story_embeddings = rng.normal(size=(story_count, 4))
+  stories = filtering.StoryMetadata.from_stories(story_ids, [{
+      "story_id": story_id,
+      "source_id": "source-" + str(row % 2),
+      "time_stamp": float(row)
+  } for row, story_id in enumerate(story_ids)])
+  numpy_index.save_users(model_version,
+                         user_ids,
+                         user_embeddings,
+                         directory=directory)
+  numpy_index.save_stories(numpy_index.EmbeddingExport(
+      language="en",
+      version=version,
+      model_version=model_version,
+      story_count=story_count,
+      built_at=built_at or numpy_index.time.time()),
+                           story_ids,
+                           story_embeddings,
+                           directory=directory,
+                           stories=stories if with_stories else None)
+  return user_ids, user_embeddings, story_ids, story_embeddings
+
+
+def test_lookup_keeps_the_rows_of_the_embedding_table(tmp_path):
+  export(str(tmp_path))
+  index = numpy_index.load_index("en", directory=str(tmp_path))
+
+  assert index.lookup(["user-0", "user-9", "unknown", "user-3"]).tolist() == [
+      1, 10, 0, 4
+  ]
+
+
+def test_lookup_does_not_truncate_longer_user_ids(tmp_path):
+  export(str(tmp_path))
+  index = numpy_index.load_index("en", directory=str(tmp_path))
+
+  assert index.lookup(["user-10", "user-1x"]).tolist() == [0, 0]
+  assert index.known_users(["user-1", "user-10"]).tolist() == [True, False]
+
+
+def test_search_matches_an_exact_top_k(tmp_path):
+  user_ids, user_embeddings, story_ids, story_embeddings = export(
+      str(tmp_path))
+  index = numpy_index.load_index("en", directory=str(tmp_path))
+
+  scores, rows = index.search(["user-2", "unknown"], 5)
+
+  expected_scores = user_embeddings[[3, 0]] @ story_embeddings.T
+  expected_rows = np.argsort(-expected_scores, axis=1)[:, :5]
+  assert rows.tolist() == expected_rows.tolist()
+  assert np.allclose(scores,
+                     np.take_along_axis(expected_scores, expected_rows, 1),
+                     atol=1e-5)
+  assert index.query(["user-2"], 5) == [[
+      story_ids[row] for row in expected_rows[0]
+  ]]
+
+
+def test_search_caps_k_to_the_amount_of_stories(tmp_path):
+  export(str(tmp_path), story_count=3)
+  index = numpy_index.load_index("en", directory=str(tmp_path))
+
+  assert len(index.query(["user-1"], 20)[0]) == 3
+
+
+def test_search_only_returns_the_allowed_stories(tmp_path):
+  user_ids, user_embeddings, story_ids, story_embeddings = export(
+      str(tmp_path))
+  index = numpy_index.load_index("en", directory=str(tmp_path))
+  allowed = index.stories.allowed(
+      filtering.StoryFilter(source_ids=["source-1"],
+                            exclude_story_ids=["story-1"]))
+
+  _, rows = index.search(["user-2"], 5, allowed)
+
+  expected_scores = user_embeddings[3] @ story_embeddings.T
+  expected_scores[~allowed] = -np.inf
+  assert rows[0].tolist() == np.argsort(-expected_scores)[:5].tolist()
+  assert all(row % 2 == 1 and row != 1 for row in rows[0])
+  assert len(index.query(["user-2"], 100, allowed)[0]) == 24
+  assert index.query(["user-2"], 5, np.zeros(50, dtype=bool)) == [[]]
+
+
+def test_load_index_of_exports_without_story_metadata(tmp_path):
+  export(str(tmp_path), with_stories=False)
+
+  assert numpy_index.load_index("en", directory=str(tmp_path)) is None
+
+
+def test_load_index_of_stale_exports(tmp_path):
+  assert numpy_index.load_index("en", directory=str(tmp_path)) is None
+  export(str(tmp_path), built_at=1.0)
+
+  assert numpy_index.load_index("en",
+                                model_version="other",
+                                directory=str(tmp_path)) is None
+  assert numpy_index.load_index("en", max_age=60,
+                                directory=str(tmp_path)) is None
+  assert numpy_index.load_index("en", directory=str(tmp_path)) is not None
+
+
+def test_save_stories_keeps_the_latest_versions(tmp_path):
+  for version in ("1", "2", "3"):
+    export(str(tmp_path), version=version)
+
+  assert numpy_index.list_versions(str(tmp_path / "en")) == ["2", "3"]
+  index = numpy_index.load_index("en", directory=str(tmp_path))
+  assert index.artifact.version == "3"
+
+
+def test_numpy_backend_loads_a_fresh_export(tmp_path, mocker):
+  export(str(tmp_path))
+  run = mocker.patch("subprocess.run")
+  backend = serving.NumpyBackend(max_age=60, directory=str(tmp_path))
+
+  index = backend.build_index(backend.load_model(), "en")
+
+  assert backend.query(index, ["user-1"], 2)[0] == index.query(["user-1"],
+                                                               2)[0]
+  run.assert_not_called()
+
+
+def test_popular_stories_of_an_export(tmp_path):
+  export(str(tmp_path))
+  index = numpy_index.load_index("en", directory=str(tmp_path))
+  assert serving.popular_stories(index, 2) is None
+
+  index.artifact.popular_story_ids = ["story-3", "story-1", "story-2"]
+
+  assert serving.popular_stories(index, 2) == ["story-3", "story-1"]
+
+
+def test_get_backend_rejects_unknown_backends():
+  with pytest.raises(ValueError):
+    serving.get_backend("faiss")
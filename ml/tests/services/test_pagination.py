@@ -0,0 +1,32 @@
+import pytest
+
+from services import pagination
+
+
+def test_cursors_round_trip():
+  snapshot_id = pagination.new_snapshot_id()
+
+  assert pagination.decode_cursor(pagination.encode_cursor(snapshot_id,
+                                                           40)) == (snapshot_id,
+                                                                    40)
+
+
+@pytest.mark.parametrize("cursor", ["", "abc", "abc-", "-20", "abc--1"])
+def test_malformed_cursors_are_rejected(cursor):
+  with pytest.raises(ValueError):
+    pagination.decode_cursor(cursor)
+
+
+def test_pages_walk_through_the_stories():
+  story_ids = ["story-" + str(i) for i in range(5)]
+
+  first = pagination.get_page("snapshot", story_ids, 0, 2)
+  _, offset = pagination.decode_cursor(first.next_cursor)
+  second = pagination.get_page("snapshot", story_ids, offset, 2)
+  _, offset = pagination.decode_cursor(second.next_cursor)
+  last = pagination.get_page("snapshot", story_ids, offset, 2)
+
+  assert first.story_ids == ["story-0", "story-1"]
+  assert second.story_ids == ["story-2", "story-3"]
+  assert last.story_ids == ["story-4"]
+  assert last.next_cursor is None
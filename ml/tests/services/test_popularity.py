@@ -0,0 +1,43 @@
+from services import popularity
+
+
+def test_stories_are_ranked_by_engagement():
+  recent_stories = [
+      {"story_id": "story-1", "read_count": 10, "shared_count": 1},
+      {"story_id": "story-2", "read_count": 50, "happy_count": 5},
+      {"story_id": "story-3", "read_count": None, "angry_count": 30},
+      {"story_id": "story-4"},
+  ]
+
+  assert popularity.popular_story_ids(recent_stories) == [
+      "story-2", "story-3", "story-1", "story-4"
+  ]
+
+
+def test_the_most_popular_stories_are_kept():
+  recent_stories = [{
+      "story_id": "story-" + str(i),
+      "read_count": i
+  } for i in range(10)]
+
+  assert popularity.popular_story_ids(recent_stories, count=3) == [
+      "story-9", "story-8", "story-7"
+  ]
+
+
+def test_duplicated_stories_are_ranked_once():
+  recent_stories = [
+      {"story_id": "story-1", "read_count": 1},
+      {"story_id": "story-2", "read_count": 5},
+      {"story_id": "story-1", "read_count": 10},
+  ]
+
+  assert popularity.popular_story_ids(recent_stories) == ["story-1", "story-2"]
+
+
+def test_ties_keep_the_order_of_the_stories():
+  recent_stories = [{"story_id": "story-" + str(i)} for i in range(3)]
+
+  assert popularity.popular_story_ids(recent_stories) == [
+      "story-0", "story-1", "story-2"
+  ]
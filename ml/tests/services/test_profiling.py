@@ -0,0 +1,36 @@
+import pytest
+
+from services import profiling
+
+
+def test_phase_timer_records_each_phase():
+  timer = profiling.PhaseTimer()
+
+  with timer.phase("fetch"):
+    data = [0] * 1000
+  with pytest.raises(RuntimeError):
+    with timer.phase("fit"):
+      raise RuntimeError("Failed")
+
+  summary = timer.summary()
+  assert list(summary) == ["fetch", "fit"]
+  assert summary["fetch"]["seconds"] >= 0
+  assert summary["fetch"]["peak_rss_bytes"] > len(data)
+
+
+def test_peak_rss_without_procfs(mocker):
+  mocker.patch("services.profiling.PROC_STATUS", "/nonexistent/status")
+
+  assert profiling.peak_rss_bytes() > 0
+
+
+@pytest.mark.parametrize("steps,expected", [("10,20", [10, 20]),
+                                            ("5", [5, 5])])
+def test_parse_steps(steps, expected):
+  assert profiling.parse_steps(steps) == expected
+
+
+@pytest.mark.parametrize("steps", ["0", "20,10", "1,2,3", "a"])
+def test_parse_steps_rejects_invalid_steps(steps):
+  with pytest.raises(ValueError):
+    profiling.parse_steps(steps)
@@ -0,0 +1,175 @@
+from types import SimpleNamespace
+import os
+
+import pytest
+
+from services import synthetic
+
+# The ranking model needs TensorFlow and TensorFlow Recommenders
+ranking = pytest.importorskip("services.ranking", exc_type=ImportError)
+
+
+class Artifact:
+  version = "20240101000000"
+
+
+def stored_model(rmse):
+  return ranking.RankingModel(ranking_model_id="1",
+                              results={"root_mean_squared_error": rmse},
+                              model_version="20230101000000")
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+  directory = str(tmp_path / "ranking_model")
+  monkeypatch.setattr(ranking, "RANKING_MODEL_DIR", directory)
+  return directory
+
+
+def test_a_worse_model_is_saved_when_there_is_no_artifact(model_dir, mocker):
+  mocker.patch.object(ranking,
+                      "get_ranking_model",
+                      return_value=stored_model(0.5))
+  save_model_artifact = mocker.patch.object(ranking,
+                                            "save_model_artifact",
+                                            return_value=Artifact())
+  add_or_update = mocker.patch.object(ranking.mongo, "add_or_update")
+
+  ranking.save_ranking_model(object(), {"root_mean_squared_error": 0.9})
+
+  save_model_artifact.assert_called_once()
+  saved = add_or_update.call_args[0][0]
+  assert saved["model_version"] == Artifact.version
+  assert saved["results"] == {"root_mean_squared_error": 0.9}
+
+
+def test_a_worse_model_is_not_saved_over_an_artifact(model_dir, mocker):
+  os.makedirs(model_dir)
+  mocker.patch.object(ranking,
+                      "get_ranking_model",
+                      return_value=stored_model(0.5))
+  save_model_artifact = mocker.patch.object(ranking, "save_model_artifact")
+  add_or_update = mocker.patch.object(ranking.mongo, "add_or_update")
+
+  assert ranking.save_ranking_model(object(),
+                                    {"root_mean_squared_error": 0.9}) is None
+
+  save_model_artifact.assert_not_called()
+  saved = add_or_update.call_args[0][0]
+  assert saved["model_version"] == "20230101000000"
+  assert len(saved["history"]) == 1
+
+
+def predict(model, columns):
+  features = {
+      name: ranking.tf.constant(values)
+      for name, values in columns.items()
+      if name != "relevancy_rate"
+  }
+  return model(features)[2].numpy()
+
+
+def test_a_promoted_trial_keeps_its_predictions(model_dir, tmp_path,
+                                               monkeypatch, mocker):
+  monkeypatch.setenv("TRAINING_EPOCHS", "1")
+  columns = synthetic.generate_ranking_data(20, 50)
+  model, eval_dict = ranking.fit_ranking_model(
+      synthetic.to_entries(columns))
+  trial_dir = str(tmp_path / "trial-000")
+  ranking.save_model_artifact(model, trial_dir)
+  mocker.patch.object(ranking, "get_ranking_model", return_value=None)
+  mocker.patch.object(ranking.mongo, "add_or_update", return_value="1")
+
+  assert ranking.promote_ranking_model(trial_dir, eval_dict)
+
+  # Calling the loaded model builds its remaining layers from the weights
+  promoted = ranking.load_model_artifact(model_dir)
+  assert promoted.version == ranking.SavedRankingModel(trial_dir).version
+  ranking.np.testing.assert_allclose(predict(promoted, columns),
+                                     predict(model, columns),
+                                     rtol=1e-5,
+                                     atol=1e-5)
+
+
+@pytest.fixture
+def saved_model(tmp_path):
+  directory = tmp_path / "ranking_model"
+  directory.mkdir()
+  (directory / ranking.ARTIFACT_CONFIG_FILE).write_text(
+      ranking.ModelArtifact(version="20240101000000",
+                            layer_sizes=[32],
+                            embedding_dimension=32,
+                            ranking_weight=1.0,
+                            retrieval_weight=1.0).json())
+  return ranking.SavedRankingModel(str(directory))
+
+
+def test_a_saved_index_is_loaded_without_loading_the_model(
+    saved_model, tmp_path, mocker):
+  index = SimpleNamespace(artifact=SimpleNamespace(version="1"))
+  load_index = mocker.patch.object(ranking, "load_index", return_value=index)
+  load_model_artifact = mocker.patch.object(ranking, "load_model_artifact")
+
+  assert ranking.load_or_build_index(saved_model,
+                                     "en",
+                                     directory=str(tmp_path)) is index
+
+  assert load_index.call_args[1]["model_version"] == "20240101000000"
+  load_model_artifact.assert_not_called()
+
+
+def test_the_model_is_loaded_once_to_build_stale_indexes(
+    saved_model, tmp_path, mocker):
+  mocker.patch.object(ranking, "load_index", return_value=None)
+  load_model_artifact = mocker.patch.object(ranking,
+                                            "load_model_artifact",
+                                            return_value="model")
+  build_index = mocker.patch.object(ranking, "build_index")
+  mocker.patch.object(ranking, "save_index")
+
+  for language in ("en", "fr"):
+    ranking.load_or_build_index(saved_model,
+                                language,
+                                directory=str(tmp_path))
+
+  load_model_artifact.assert_called_once_with(saved_model.directory)
+  assert [call[0] for call in build_index.call_args_list] == [("model", "en"),
+                                                              ("model", "fr")]
+
+
+def test_an_index_is_only_tuned_again_for_a_changed_story_count(
+    tmp_path, mocker):
+  mocker.patch.object(ranking.index_tuning, "EXACT_MAX_STORIES", 10)
+  selected = ranking.index_tuning.TuningResult(
+      config=ranking.index_tuning.DEFAULT_SCANN_CONFIG,
+      recall=0.97,
+      query_seconds=0.001)
+  tune = mocker.patch.object(ranking.index_tuning,
+                             "tune",
+                             return_value=(selected, [selected]))
+  embeddings = ranking.np.zeros((1000, 4), dtype=ranking.np.float32)
+
+  def tune_index(story_count):
+    story_ids = ["story-" + str(row) for row in range(story_count)]
+    return ranking.tune_index("en",
+                              story_ids,
+                              embeddings[:story_count],
+                              embeddings[:10],
+                              model_version="1",
+                              directory=str(tmp_path))
+
+  assert tune_index(500) == selected
+  assert tune_index(600) == selected
+  assert tune.call_count == 1
+  assert tune_index(1000) == selected
+  assert tune.call_count == 2
+
+
+def test_the_model_load_is_timed_once(saved_model, mocker):
+  saved_model.load_seconds = mocker.Mock()
+  mocker.patch.object(ranking, "load_model_artifact", return_value="model")
+
+  assert saved_model.load() == "model"
+  assert saved_model.load() == "model"
+
+  saved_model.load_seconds.observe.assert_called_once()
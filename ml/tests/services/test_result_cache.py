@@ -0,0 +1,91 @@
+from services import result_cache
+
+
+class FakeClock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+def test_get_returns_cached_results():
+  cache = result_cache.ResultCache(10, 60)
+  cache.put("1", "en", 20, ("a", "b"))
+
+  assert cache.get("1", "en", 20) == ("a", "b")
+  assert cache.get("1", "en", 10) is None
+  assert cache.get("1", "fr", 20) is None
+  stats = cache.stats()
+  assert (stats.hits, stats.misses) == (1, 2)
+  assert stats.hit_rate == 1 / 3
+
+
+def test_entries_expire_after_ttl():
+  clock = FakeClock()
+  cache = result_cache.ResultCache(10, 60, clock=clock)
+  cache.put("1", "en", 20, ("a",))
+
+  clock.now = 59.0
+  assert cache.get("1", "en", 20) == ("a",)
+  clock.now = 60.0
+  assert cache.get("1", "en", 20) is None
+  assert cache.stats().expirations == 1
+  assert cache.stats().size == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+  cache = result_cache.ResultCache(2, 60)
+  cache.put("1", "en", 20, ("a",))
+  cache.put("2", "en", 20, ("b",))
+  cache.get("1", "en", 20)
+
+  cache.put("3", "en", 20, ("c",))
+
+  assert cache.get("2", "en", 20) is None
+  assert cache.get("1", "en", 20) == ("a",)
+  assert cache.get("3", "en", 20) == ("c",)
+  assert cache.stats().evictions == 1
+
+
+def test_invalidate_drops_the_entries_of_a_language():
+  cache = result_cache.ResultCache(10, 60)
+  cache.put("1", "en", 20, ("a",))
+  cache.put("2", "en", 20, ("b",))
+  cache.put("1", "fr", 20, ("c",))
+
+  assert cache.invalidate("en") == 2
+
+  assert cache.get("1", "en", 20) is None
+  assert cache.get("1", "fr", 20) == ("c",)
+  assert cache.stats().invalidations == 2
+
+
+def test_zero_size_disables_the_cache():
+  cache = result_cache.ResultCache(0, 60)
+  cache.put("1", "en", 20, ("a",))
+
+  assert cache.get("1", "en", 20) is None
+
+
+def test_results_of_another_index_version_are_not_served():
+  cache = result_cache.ResultCache(10, 60)
+  cache.put("1", "en", 20, ("a",), version="2")
+
+  assert cache.get("1", "en", 20, version="2") == ("a",)
+  assert cache.get("1", "en", 20, version="3") is None
+  assert cache.get("1", "en", 20, version="2") is None
+  assert cache.stats().invalidations == 1
+
+
+def test_a_put_racing_an_index_swap_is_not_served():
+  cache = result_cache.ResultCache(10, 60)
+  cache.put("1", "en", 20, ("a",), version="1")
+
+  # The new index is swapped in while a request still queries the old one
+  cache.invalidate("en")
+  cache.put("1", "en", 20, ("stale",), version="1")
+
+  assert cache.get("1", "en", 20, version="2") is None
+  cache.put("1", "en", 20, ("b",), version="2")
+  assert cache.get("1", "en", 20, version="2") == ("b",)
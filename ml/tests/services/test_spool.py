@@ -0,0 +1,65 @@
+import pytest
+
+from services import spool
+
+
+def mock_entry(story_id: str) -> dict:
+  return {
+      "story_id": story_id,
+      "user_id": "1",
+      "relevancy_rate": 1.5,
+      "time_stamp": 1617523200.0,
+      "story_title": "A turtle is on the loose",
+      "read_count": 3,
+      "source_id": "bbc",
+  }
+
+
+def test_to_table_fills_defaults():
+  table = spool.to_table([mock_entry("a")])
+
+  assert table.schema == spool.RANKING_DATA_SCHEMA
+  row = table.to_pylist()[0]
+  assert row["read_count"] == 3
+  assert row["happy_count"] == 0
+  assert row["author_id"] == ""
+
+
+def test_spool_round_trip(tmp_path):
+  directory = str(tmp_path / "spool")
+  with spool.ParquetSpool(directory, batch_size=2) as parquet_spool:
+    parquet_spool.write([mock_entry("a"), mock_entry("b")])
+    parquet_spool.write([mock_entry("c")])
+
+  assert parquet_spool.shard_count == 2
+  assert spool.count_rows(directory) == 3
+  batches = list(spool.read_batches(directory))
+  story_ids = [s for batch in batches for s in batch["story_id"]]
+  assert story_ids == ["a", "b", "c"]
+  assert batches[0]["time_stamp"].dtype == "float64"
+
+
+def test_remove_cache_files_only_removes_the_tf_data_cache(tmp_path):
+  cache_files = [
+      "cache_train.index", "cache_train.data-00000-of-00001",
+      "cache_test_0.lockfile",
+      "cache_test_0.data-00000-of-00001.tempstate8361224882809574382"
+  ]
+  other_files = [
+      "cache", "cache.json", "cache_other.index", "cachex_train.index"
+  ]
+  for file_name in cache_files + other_files:
+    (tmp_path / file_name).write_text("")
+
+  spool.remove_cache_files(str(tmp_path / "cache"))
+
+  assert sorted(path.name for path in tmp_path.iterdir()) == sorted(other_files)
+
+
+def test_remove_cache_files_rejects_directories(tmp_path):
+  (tmp_path / "data_train.index").write_text("")
+
+  for cache_file in (str(tmp_path) + "/", str(tmp_path), str(tmp_path / ".")):
+    with pytest.raises(ValueError):
+      spool.remove_cache_files(cache_file)
+  assert (tmp_path / "data_train.index").exists()
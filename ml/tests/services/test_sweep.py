@@ -0,0 +1,81 @@
+import pytest
+
+from services import spool
+from services import sweep
+from services import synthetic
+from services import vocabulary
+
+
+def test_expand_grid_builds_every_combination():
+  trials = sweep.expand_grid({
+      "layer_sizes": [[32], [64, 32]],
+      "embedding_dimension": [16, 32, 64],
+  })
+
+  assert len(trials) == 6
+  assert trials[0] == sweep.SweepTrial(layer_sizes=[32], embedding_dimension=16)
+  assert all(trial.ranking_weight == 1.0 for trial in trials)
+
+
+def test_expand_grid_rejects_unknown_hyperparameters():
+  with pytest.raises(ValueError):
+    sweep.expand_grid({"learning_rate": [0.1]})
+
+
+@pytest.mark.parametrize(
+    "trial_count,workers,threads_per_worker,expected",
+    [
+        (8, None, None, (8, 2)),
+        (2, None, None, (2, 8)),
+        (8, 4, None, (4, 4)),
+        (8, None, 4, (4, 4)),
+        (8, 32, None, (8, 2)),
+    ],
+)
+def test_allocate_threads_splits_the_cores(trial_count, workers,
+                                           threads_per_worker, expected):
+  assert sweep.allocate_threads(trial_count,
+                                workers,
+                                threads_per_worker,
+                                cpu_count=16) == expected
+
+
+def test_select_best_ignores_failed_trials():
+  results = [
+      sweep.TrialResult(index=0,
+                        trial=sweep.SweepTrial(),
+                        results={"root_mean_squared_error": 2.0}),
+      sweep.TrialResult(index=1, trial=sweep.SweepTrial(), error="Error"),
+      sweep.TrialResult(index=2,
+                        trial=sweep.SweepTrial(),
+                        results={"root_mean_squared_error": 1.5}),
+  ]
+
+  assert sweep.select_best(results).index == 2
+  assert sweep.select_best(results[1:2]) is None
+
+
+def test_prepare_snapshot_writes_data_and_vocabularies(tmp_path):
+  entries = synthetic.to_entries(synthetic.generate_ranking_data(20, 50))
+
+  snapshot = sweep.prepare_snapshot(entries, str(tmp_path))
+
+  assert spool.count_rows(snapshot.data_dir) == len(entries)
+  vocabularies = vocabulary.Vocabularies.load(snapshot.vocabulary_dir)
+  assert vocabularies.row_count == len(entries)
+
+
+def test_record_sweep(mocker):
+  add_or_update = mocker.patch("services.mongo.add_or_update")
+  best = sweep.TrialResult(index=0,
+                           trial=sweep.SweepTrial(),
+                           results={"root_mean_squared_error": 1.5},
+                           artifact_dir="sweep/trials/trial-000")
+
+  sweep.record_sweep([best], best, "20240101000000")
+
+  document, collection = add_or_update.call_args.args
+  assert collection == sweep.SWEEP_COLLECTION
+  assert document["best_trial"] == 0
+  assert document["model_version"] == "20240101000000"
+  assert "artifact_dir" not in document["trials"][0]
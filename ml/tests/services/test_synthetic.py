@@ -0,0 +1,45 @@
+import numpy as np
+
+from services import spool
+from services import synthetic
+
+
+def test_generate_ranking_data_follows_the_dataset_schema():
+  columns = synthetic.generate_ranking_data(50, 200, seed=1)
+
+  assert set(columns) == set(spool.RANKING_DATA_COLUMNS)
+  sizes = {len(values) for values in columns.values()}
+  assert len(sizes) == 1
+  assert spool.to_table(synthetic.to_entries(columns)).num_rows == sizes.pop()
+
+
+def test_generate_ranking_data_has_unique_user_story_pairs():
+  columns = synthetic.generate_ranking_data(50, 200, seed=1)
+
+  pairs = set(zip(columns["user_id"], columns["story_id"]))
+  assert len(pairs) == len(columns["user_id"])
+
+
+def test_generate_ranking_data_is_long_tailed():
+  columns = synthetic.generate_ranking_data(500, 1000, seed=1)
+
+  _, counts = np.unique(columns["story_id"], return_counts=True)
+  counts = np.sort(counts)[::-1]
+  assert counts[:100].sum() > counts[100:].sum()
+
+
+def test_generate_ranking_data_time_range():
+  columns = synthetic.generate_ranking_data(10,
+                                            20,
+                                            start_time=100.0,
+                                            end_time=200.0)
+
+  assert columns["time_stamp"].min() >= 100.0
+  assert columns["time_stamp"].max() <= 200.0
+
+
+def test_generate_ranking_data_is_seeded():
+  first = synthetic.generate_ranking_data(10, 20, seed=3)
+  second = synthetic.generate_ranking_data(10, 20, seed=3)
+
+  assert synthetic.to_entries(first) == synthetic.to_entries(second)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from services import vocabulary
+
+
+def mock_batch(story_ids, time_stamps) -> dict:
+  size = len(story_ids)
+  batch = {
+      feature: np.array([b"x"] * size, dtype=object)
+      for feature in vocabulary.USER_FEATURES + vocabulary.STRING_FEATURES
+  }
+  batch.update({
+      feature: np.zeros(size, dtype=np.int64)
+      for feature in vocabulary.INT_FEATURES
+  })
+  batch["story_id"] = np.array(story_ids, dtype=object)
+  batch["time_stamp"] = np.array(time_stamps, dtype=np.float64)
+  return batch
+
+
+def test_build_vocabularies_single_pass():
+  batches = iter([
+      mock_batch([b"b", b"a"], [1617523200.0, 1617523260.0]),
+      mock_batch([b"b"], [1617523320.0]),
+  ])
+
+  result = vocabulary.build_vocabularies(batches, timestamp_bucket_count=3)
+
+  assert result.vocabularies["story_id"] == ["a", "b"]
+  assert result.frequencies["story_id"] == [1, 2]
+  assert result.vocabularies["read_count"] == [0]
+  assert result.timestamp_buckets == [1617523200.0, 1617523260.0, 1617523320.0]
+  assert result.timestamp_mean == pytest.approx(1617523260.0)
+  assert result.timestamp_variance == pytest.approx(2400.0)
+  assert result.row_count == 3
+
+
+def test_build_vocabularies_min_frequency():
+  result = vocabulary.build_vocabularies(
+      [mock_batch([b"b", b"a", b"b"], [1.0, 2.0, 3.0])], min_frequency=2)
+
+  assert result.vocabularies["story_id"] == ["b"]
+
+
+def test_build_vocabularies_empty():
+  with pytest.raises(ValueError):
+    vocabulary.build_vocabularies([])
+
+
+def test_vocabularies_save_and_load(tmp_path):
+  result = vocabulary.build_vocabularies([mock_batch([b"a"], [1.0])])
+  result.save(str(tmp_path))
+
+  assert vocabulary.Vocabularies.load(str(tmp_path)) == result
+
+
+def test_story_corpus_keeps_first_row_of_each_story():
+  corpus = vocabulary.StoryCorpus()
+  first = mock_batch([b"b", b"a", b"b"], [1.0, 2.0, 3.0])
+  first["read_count"] = np.array([1, 2, 3], dtype=np.int64)
+  second = mock_batch([b"a", b"c"], [4.0, 5.0])
+  second["read_count"] = np.array([4, 5], dtype=np.int64)
+
+  batches = list(corpus.observe(iter([first, second])))
+
+  assert len(batches) == 2
+  assert len(corpus) == 3
+  columns = corpus.columns()
+  assert columns["story_id"].tolist() == [b"a", b"b", b"c"]
+  assert columns["read_count"].tolist() == [2, 1, 5]
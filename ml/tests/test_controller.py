@@ -0,0 +1,211 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import controller
+from services import coalescer
+from services import pagination
+from services import result_cache
+
+
+class StubBackend:
+  """Ranks made up stories for the users whose id does not start with
+  "new-", which the model does not know.
+  """
+
+  def __init__(self):
+    self.queries = []
+
+  def known_users(self, index, user_ids):
+    return np.array([not user_id.startswith("new-") for user_id in user_ids])
+
+  def query(self, index, user_ids, k):
+    self.queries.append(list(user_ids))
+    return [[
+        index.artifact.version + "-" + user_id + "-" + str(rank)
+        for rank in range(k)
+    ]
+            for user_id in user_ids]
+
+
+def stub_index(version="1"):
+  return SimpleNamespace(artifact=SimpleNamespace(
+      language="en",
+      version=version,
+      popular_story_ids=["popular-1", "popular-2", "popular-3"]))
+
+
+@pytest.fixture
+def backend(monkeypatch):
+  stub_backend = StubBackend()
+  monkeypatch.setattr(controller, "backend", stub_backend)
+  monkeypatch.setattr(controller, "request_coalescer",
+                      coalescer.RequestCoalescer(stub_backend.query, 0, 64))
+  monkeypatch.setattr(controller, "indexes", {"en": stub_index()})
+  monkeypatch.setattr(controller, "cache",
+                      result_cache.ResultCache(100, 60))
+  monkeypatch.setattr(controller, "snapshots",
+                      result_cache.ResultCache(100, 60))
+  monkeypatch.setattr(controller, "PAGINATION_DEPTH", 5)
+  return stub_backend
+
+
+@pytest.fixture
+def client(backend):
+  # The startup handler, which builds the indexes, only runs in a with block
+  return TestClient(controller.app)
+
+
+def batch(client, user_ids, k=2, language="en"):
+  return client.post("/recommendations/batch",
+                     json={
+                         "user_ids": user_ids,
+                         "language": language,
+                         "k": k
+                     })
+
+
+def test_batch_rejects_an_empty_batch(client):
+  assert batch(client, []).status_code == 400
+
+
+def test_batch_rejects_too_many_user_ids(client, monkeypatch):
+  monkeypatch.setattr(controller, "MAX_BATCH_SIZE", 2)
+
+  assert batch(client, ["1", "2", "3"]).status_code == 413
+  assert batch(client, ["1", "2"]).status_code == 200
+
+
+def test_batch_validates_k(client):
+  assert batch(client, ["1"], k=0).status_code == 400
+  assert batch(client, ["1"],
+               k=controller.MAX_AMOUNT_OF_STORIES + 1).status_code == 400
+
+
+def test_batch_of_an_index_not_built_yet(client):
+  assert batch(client, ["1"], language="fr").status_code == 404
+  assert batch(client, ["1"], language="de").status_code == 500
+
+
+def test_batch_queries_each_user_once(client, backend):
+  response = batch(client, ["1", "2", "1", " ", "new-1"])
+
+  assert response.status_code == 200
+  assert response.json() == {
+      "recommendations": {
+          "1": ["1-1-0", "1-1-1"],
+          "2": ["1-2-0", "1-2-1"],
+          "new-1": ["popular-1", "popular-2"],
+      },
+      "errors": {
+          " ": "Invalid user id"
+      },
+  }
+  assert backend.queries == [["1", "2"]]
+
+
+def test_batch_only_queries_the_users_not_cached(client, backend):
+  assert client.get("/recommendations/1/en",
+                    params={"k": 2}).json() == ["1-1-0", "1-1-1"]
+
+  response = batch(client, ["1", "2"])
+
+  assert response.json()["recommendations"] == {
+      "1": ["1-1-0", "1-1-1"],
+      "2": ["1-2-0", "1-2-1"],
+  }
+  assert backend.queries == [["1"], ["2"]]
+  assert batch(client, ["1", "2"]).json() == response.json()
+  assert backend.queries == [["1"], ["2"]]
+
+
+def test_cached_results_of_a_replaced_index_are_not_served(client, backend):
+  batch(client, ["1"])
+  controller.indexes["en"] = stub_index("2")
+
+  assert batch(client, ["1"]).json()["recommendations"] == {
+      "1": ["2-1-0", "2-1-1"]
+  }
+
+
+def page(client, cursor=None, k=2):
+  params = {"k": k}
+  if cursor is not None:
+    params["cursor"] = cursor
+  return client.get("/recommendations/1/en/page", params=params)
+
+
+def test_pages_are_sliced_from_one_query(client, backend):
+  first = page(client).json()
+  second = page(client, first["next_cursor"]).json()
+  last = page(client, second["next_cursor"]).json()
+
+  assert first["story_ids"] == ["1-1-0", "1-1-1"]
+  assert second["story_ids"] == ["1-1-2", "1-1-3"]
+  assert last == {"story_ids": ["1-1-4"], "next_cursor": None}
+  assert backend.queries == [["1"]]
+
+
+def test_pages_of_a_snapshot_survive_an_index_swap(client):
+  first = page(client).json()
+  controller.indexes["en"] = stub_index("2")
+
+  assert page(client, first["next_cursor"]).json()["story_ids"] == [
+      "1-1-2", "1-1-3"
+  ]
+
+
+def test_a_malformed_cursor_is_rejected(client):
+  page(client)
+
+  assert page(client, "not-a-cursor").status_code == 400
+  assert page(client, "abc").status_code == 400
+
+
+def test_the_sessions_of_a_user_keep_their_own_snapshot(client, backend):
+  first_session = page(client).json()
+  second_session = page(client).json()
+
+  assert first_session["next_cursor"] != second_session["next_cursor"]
+  assert page(client, first_session["next_cursor"]).json()["story_ids"] == [
+      "1-1-2", "1-1-3"
+  ]
+  assert page(client, second_session["next_cursor"]).json()["story_ids"] == [
+      "1-1-2", "1-1-3"
+  ]
+  assert backend.queries == [["1"]]
+
+
+def test_a_cursor_is_not_valid_for_another_user(client):
+  first = page(client).json()
+
+  assert client.get("/recommendations/2/en/page",
+                    params={
+                        "k": 2,
+                        "cursor": first["next_cursor"]
+                    }).status_code == 410
+
+
+def test_the_cursor_of_an_expired_snapshot_expired(client):
+  first = page(client).json()
+  controller.snapshots.invalidate("en")
+
+  assert page(client, first["next_cursor"]).status_code == 410
+  assert page(client, pagination.encode_cursor("unknown", 2)).status_code == 410
+
+
+def test_page_validates_k_against_the_pagination_depth(client):
+  assert page(client, k=0).status_code == 400
+  assert page(client, k=6).status_code == 400
+
+
+def test_metrics_are_rendered_in_the_prometheus_format(client):
+  client.get("/recommendations/1/en", params={"k": 2})
+
+  response = client.get("/metrics")
+
+  assert response.headers["content-type"].startswith("text/plain")
+  assert ('http_request_seconds_count{route="/recommendations/{user_id}/'
+          '{language}"}') in response.text
@@ -0,0 +1,90 @@
+import pytest
+
+from services import feature_cache
+from services import spool
+
+# The training job imports the TensorFlow ranking model
+training = pytest.importorskip("training", exc_type=ImportError)
+
+CORE_URL = "http://127.0.0.1:5057"
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+  monkeypatch.setenv("CORE_URL", CORE_URL)
+  monkeypatch.setenv("TRAINING_CHANGES_LAG", "5")
+  monkeypatch.setenv("TRAINING_FETCH_RETRIES", "0")
+
+
+def entry(user_id, story_id, time_stamp):
+  return {
+      "story_id": story_id,
+      "user_id": user_id,
+      "time_stamp": time_stamp,
+      "read_count": 1
+  }
+
+
+def fetched_paths(requests_mock):
+  return sorted(request.path for request in requests_mock.request_history)
+
+
+def test_the_first_run_fetches_every_user(tmp_path, requests_mock):
+  requests_mock.get(CORE_URL + "/training/1", json=[entry("1", "a", 10.0)])
+  requests_mock.get(CORE_URL + "/training/2", status_code=404)
+  cache = feature_cache.FeatureCache(str(tmp_path))
+
+  training.update_feature_cache(cache, ["1", "2"])
+
+  assert fetched_paths(requests_mock) == ["/training/1", "/training/2"]
+  assert cache.watermarks == {"1": 10.0}
+
+
+def test_a_rerun_only_fetches_the_changed_and_failed_users(
+    tmp_path, requests_mock):
+  cache = feature_cache.FeatureCache(str(tmp_path))
+  cache.merge([entry("1", "a", 10.0), entry("2", "b", 20.0)])
+  cache.set_pending(["3"])
+  requests_mock.get(CORE_URL + "/training/changes",
+                    json={
+                        "user_ids": ["2", "deleted"],
+                        "stories": [{
+                            "story_id": "a",
+                            "read_count": 4
+                        }]
+                    })
+  requests_mock.get(CORE_URL + "/training/2", json=[entry("2", "c", 30.0)])
+  requests_mock.get(CORE_URL + "/training/3", status_code=500)
+
+  report = training.update_feature_cache(cache, ["1", "2", "3", "4"])
+
+  assert fetched_paths(requests_mock) == [
+      "/training/2", "/training/3", "/training/changes"
+  ]
+  queries = {
+      request.path: request.qs for request in requests_mock.request_history
+  }
+  assert queries["/training/changes"] == {"since": ["15.0"]}
+  assert queries["/training/2"] == {"since": ["15.0"]}
+  assert report.failed_user_ids == ["3"]
+  assert cache.pending_user_ids == ["3"]
+  rows = {(user_id, story_id): read_count
+          for batch in spool.read_batches(str(tmp_path))
+          for user_id, story_id, read_count in zip(
+              batch["user_id"], batch["story_id"], batch["read_count"])}
+  assert rows == {("1", "a"): 4, ("2", "b"): 1, ("2", "c"): 1}
+
+
+def test_every_user_is_fetched_when_the_changes_are_unknown(
+    tmp_path, requests_mock):
+  cache = feature_cache.FeatureCache(str(tmp_path))
+  cache.merge([entry("1", "a", 10.0)])
+  requests_mock.get(CORE_URL + "/training/changes", status_code=404)
+  requests_mock.get(CORE_URL + "/training/1", status_code=404)
+  requests_mock.get(CORE_URL + "/training/2", status_code=404)
+
+  training.update_feature_cache(cache, ["1", "2"])
+
+  assert fetched_paths(requests_mock) == [
+      "/training/1", "/training/2", "/training/changes"
+  ]
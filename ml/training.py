@@ -2,7 +2,11 @@ import requests
 import os
 import logging
 from dotenv import load_dotenv
+from services import feature_cache
+from services import fetcher
+from services import profiling
 from services import ranking
+from services import spool
 
 logger = logging.getLogger(__name__)
 
@@ -15,30 +19,85 @@ def get_user_ids():
   return None
 
 
-def get_features(user_id: str):
-  response = requests.get(os.getenv("CORE_URL") + "/training/" +
-                          user_id)
-  if response:
-    data_entries = list(response.json())
-    return data_entries
-  return None
+def train():
+  timer = profiling.PhaseTimer()
+  with timer.phase("fetch"):
+    data_entries = get_training_data()
+  if data_entries:
+    result = ranking.train_ranking_model(data_entries, timer=timer)
+    logger.info(result)
+  logger.info("Phase timings: " + str(timer.summary()))
 
 
-def train():
+def get_training_data():
   user_ids = get_user_ids()
-  master_data_entry_list = []
-  for user_id in user_ids:
-    data_entries = get_features(user_id)
-    if data_entries:
-      master_data_entry_list = master_data_entry_list + data_entries
-  if master_data_entry_list:
-    result = ranking.train_ranking_model(master_data_entry_list)
-    logger.info(result)
+  if not user_ids:
+    logger.error("Failed to receive User Ids")
+    return None
+  cache_dir = os.getenv("TRAINING_CACHE_DIR")
+  spool_dir = os.getenv("TRAINING_SPOOL_DIR")
+  if cache_dir:
+    cache = feature_cache.FeatureCache(cache_dir)
+    report = update_feature_cache(cache, user_ids)
+    data_entries = cache_dir if cache.row_count() else None
+  elif spool_dir:
+    with spool.ParquetSpool(spool_dir) as parquet_spool:
+      _, report = fetcher.fetch_training_data(user_ids,
+                                              sink=parquet_spool.write)
+    data_entries = spool_dir if parquet_spool.row_count else None
   else:
+    data_entries, report = fetcher.fetch_training_data(user_ids)
+  logger.info(report.summary())
+  if report.failed_user_ids:
+    logger.warning("Failed users: " + ", ".join(report.failed_user_ids))
+  if not data_entries:
     logger.error("Failed to receive Feature list")
+    return None
+  return data_entries
+
+
+def update_feature_cache(cache, user_ids):
+  """Fetches the entries of the users who gave feedback since the last run
+  into the cache, and refreshes the feedback counts of the cached stories.
+
+  On the first run, or when the core service cannot tell the changes, every
+  user is fetched from their watermark.
+  """
+
+  lag = float(os.getenv("TRAINING_CHANGES_LAG", "3600"))
+  changes = None
+  changes_since = cache.changes_since(lag)
+  if changes_since is not None:
+    changes = fetcher.fetch_training_changes(changes_since)
+  fetched_user_ids = user_ids
+  stories = []
+  if changes is not None:
+    # Only the users who gave feedback since the last run have new entries
+    fetched = set(changes.user_ids) | set(cache.pending_user_ids)
+    fetched_user_ids = [user_id for user_id in user_ids if user_id in fetched]
+    stories = changes.stories
+  # The feedback stored late is fetched again within the lag
+  new_entries, report = fetcher.fetch_training_data(
+      fetched_user_ids,
+      since={
+          user_id: watermark - lag
+          for user_id, watermark in cache.watermarks.items()
+      })
+  rewritten_buckets = cache.merge(new_entries)
+  refreshed_buckets = cache.refresh_stories(stories)
+  cache.set_pending(report.failed_user_ids)
+  pruned_users = cache.prune(user_ids)
+  logger.info("Merged " + str(len(new_entries)) + " new entries of " +
+              str(len(fetched_user_ids)) + " users into " +
+              str(rewritten_buckets) + " cache buckets, refreshed the counts "
+              "of " + str(len(stories)) + " stories in " +
+              str(refreshed_buckets) + " buckets, pruned " +
+              str(pruned_users) + " users")
+  return report
 
 
 # Call Train() when file is called
 if __name__ == '__main__':
   load_dotenv()
+  logging.basicConfig(level=logging.INFO)
   train()